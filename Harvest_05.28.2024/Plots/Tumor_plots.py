@@ -1,4 +1,7 @@
+import os
+import sys
 import re
+import argparse
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -6,6 +9,62 @@ from scipy import stats
 from statsmodels.stats.multicomp import pairwise_tukeyhsd
 import TumorMass as tm
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from Utilities import Grouped_stats as gs
+from Utilities import Result_cache as rc
+
+# (x key, y key) of every figure, in the order they are drawn
+PLOT_KEYS = [
+    ('Condition', 'Weight (g)'),
+    ('Mouse_condition', 'Weight (g)'),
+    ('Condition', 'Volume (mm^3)'),
+    ('Mouse_condition', 'Volume (mm^3)')
+    ]
+
+parser = argparse.ArgumentParser()
+
+parser.add_argument(
+    '-o',
+    '--output_dir',
+    default = None,
+    help = 'Directory to write the figures to headlessly instead of showing them'
+    )
+
+parser.add_argument(
+    '--format',
+    default = 'png',
+    choices = ['png', 'svg', 'pdf'],
+    help = 'File format for figures written with --output_dir'
+    )
+
+parser.add_argument(
+    '-f',
+    '--filepath',
+    default = 'Harvest_05.28.2024/Whole_tumor_weights_and_volumes.csv',
+    help = 'Path to whole tumor weights and volumes .csv file'
+    )
+
+parser.add_argument(
+    '--cache_dir',
+    default = rc.DEFAULT_CACHE_DIR,
+    help = 'Directory for the cached tumor table and ANOVA results, keyed by input hashes'
+    )
+
+parser.add_argument(
+    '--cache_size',
+    default = rc.DEFAULT_MAX_BYTES // 2 ** 20,
+    type = int,
+    help = 'Size in MB the cache is trimmed to, least recently used results first'
+    )
+
+parser.add_argument(
+    '--no_cache',
+    action = 'store_true',
+    help = 'Recompute every result instead of reusing cached ones'
+    )
+
+args = parser.parse_args()
+
 def make_condition_helper(input_value, string_to_strip = '-M\d+-\d+'):
     value_to_return = re.split(string_to_strip, input_value)[0]
     return value_to_return
@@ -20,17 +79,36 @@ def calculate_volume_helper(input_value):
         product *= number
     return product
 
-raw_data = pd.read_csv(filepath_or_buffer = 'Harvest_05.28.2024/Whole_tumor_weights_and_volumes.csv')
-
-# Removing NaN values
-raw_data = raw_data.dropna(subset = ['Weight (g)'])
+def figure_path(figure_name):
+    if args.output_dir is None:
+        return None
+    os.makedirs(args.output_dir, exist_ok = True)
+    return os.path.join(args.output_dir, f'{figure_name}.{args.format}')
 
-# Making condition columns
-raw_data['Condition'] = [make_condition_helper(value) for value in list(raw_data.loc[:, 'Sample-ID'])]
-raw_data['Mouse_condition'] = [make_condition_helper(value, '-\d+$') for value in list(raw_data.loc[:, 'Sample-ID'])]
+def tumor_results(filepath):
+    raw_data = pd.read_csv(filepath_or_buffer = filepath)
+    # Removing NaN values
+    raw_data = raw_data.dropna(subset = ['Weight (g)'])
+    # Making condition columns
+    raw_data['Condition'] = [make_condition_helper(value) for value in list(raw_data.loc[:, 'Sample-ID'])]
+    raw_data['Mouse_condition'] = [make_condition_helper(value, '-\d+$') for value in list(raw_data.loc[:, 'Sample-ID'])]
+    # Converting the caliper measurement to volume
+    raw_data['Volume (mm^3)'] = [calculate_volume_helper(value) for value in list(raw_data.loc[:, 'Caliper dims (mm^3)'])]
+    # Volume figures leave out tumors without a caliper measurement
+    volume_data = raw_data.dropna()
+    anova_outputs = {}
+    for xvals_key, yvals_key in PLOT_KEYS:
+        plot_data = raw_data if yvals_key == 'Weight (g)' else volume_data
+        anova_outputs[(xvals_key, yvals_key)] = tm.TumorMass(plot_data).run_anova(xvals_key = xvals_key, yvals_key = yvals_key)
+    return raw_data, anova_outputs
 
-# Converting the caliper measurement to volume
-raw_data['Volume (mm^3)'] = [calculate_volume_helper(value) for value in list(raw_data.loc[:, 'Caliper dims (mm^3)'])]
+# The parsed table and every ANOVA/Tukey result are reused until the data or the analysis code changes
+result_cache = rc.ResultCache(cache_dir = args.cache_dir, max_bytes = args.cache_size * 2 ** 20, enabled = not args.no_cache)
+raw_data, anova_outputs = result_cache.cached(
+    'tumor_results',
+    lambda: tumor_results(args.filepath),
+    input_paths = [args.filepath, __file__, tm.__file__, gs.__file__]
+    )
 
 tumor_plots = tm.TumorMass(raw_data)
 
@@ -39,8 +117,10 @@ tumor_plots.plot_data(
     xvals_key = 'Condition',
     yvals_key = 'Weight (g)',
     y_label = 'Mass (g)',
-    color = 'black', 
-    s = 10
+    color = 'black',
+    s = 10,
+    output_path = figure_path('Mass_vs_condition'),
+    anova_output = anova_outputs[('Condition', 'Weight (g)')]
     )
 
 # Making a plot for different mouse samples
@@ -49,7 +129,9 @@ tumor_plots.plot_data(
     yvals_key = 'Weight (g)',
     y_label = 'Mass (g)',
     color = 'black',
-    s = 10
+    s = 10,
+    output_path = figure_path('Mass_vs_mouse_condition'),
+    anova_output = anova_outputs[('Mouse_condition', 'Weight (g)')]
     )
 
 # Removing NaN volumes
@@ -61,7 +143,9 @@ tumor_plots.plot_data(
     yvals_key = 'Volume (mm^3)',
     y_label = r'$\mathbf{Volume (mm^{3})}$',
     color = 'black',
-    s = 10
+    s = 10,
+    output_path = figure_path('Volume_vs_condition'),
+    anova_output = anova_outputs[('Condition', 'Volume (mm^3)')]
     )
 
 # Making a plot for each different mouse and volume
@@ -70,5 +154,7 @@ tumor_plots.plot_data(
     yvals_key = 'Volume (mm^3)',
     y_label = r'$\mathbf{Volume (mm^{3})}$',
     color = 'black',
-    s = 10
+    s = 10,
+    output_path = figure_path('Volume_vs_mouse_condition'),
+    anova_output = anova_outputs[('Mouse_condition', 'Volume (mm^3)')]
     )
@@ -0,0 +1,259 @@
+import os
+import re
+import sys
+import argparse
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from PIL import Image
+from scipy import ndimage, signal
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from Utilities import Tabular_writer as tw
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import cell_counter as cc
+
+IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp']
+# Fields of the same group are numbered, e.g. FUCRW_1.tif and FUCRW_2.tif
+GROUP_REGEX = r'^(.*?)(?:[_-]\d+)?$'
+# A large square holds 0.1 uL, so each cell in it is 10^4 cells per mL
+CELLS_PER_ML_PER_SQUARE = 10 ** 4
+
+
+def load_image(path: str) -> tuple[np.ndarray, np.ndarray]:
+    # Brightness and trypan blue stain (blue above the red and green mean), both scaled 0-1
+    rgb = np.asarray(Image.open(path).convert('RGB'), dtype = float) / 255.0
+    brightness = rgb.mean(axis = 2)
+    stain = np.clip(rgb[..., 2] - rgb[..., :2].mean(axis = 2), 0.0, None)
+    return brightness, stain
+
+def grid_lines(darkness: np.ndarray, axis: int, line_prominence: float) -> np.ndarray:
+    # Grid lines cross the whole field, so the median darkness along them stands out while cells barely move it
+    profile = np.median(darkness, axis = axis)
+    peaks, _ = signal.find_peaks(profile, prominence = line_prominence)
+    return peaks
+
+def line_mask(length: int, lines: np.ndarray, line_width: int) -> np.ndarray:
+    return np.any(np.abs(np.arange(length)[:, np.newaxis] - lines[np.newaxis, :]) <= line_width // 2, axis = 1)
+
+def counting_bounds(lines: np.ndarray, length: int) -> tuple[int, int]:
+    # The outermost lines frame the counted squares; without two lines the whole field is counted
+    if len(lines) < 2:
+        return 0, length
+    return int(lines[0]), int(lines[-1])
+
+def detect_blobs(contrast: np.ndarray, cell_radius: float, threshold: float) -> np.ndarray:
+    # Scale-normalized Laplacian of Gaussian over a band of radii around the expected cell size; blobs are
+    # the local maxima of the strongest response across scales
+    sigmas = np.array([0.75, 1.0, 1.25]) * cell_radius / np.sqrt(2)
+    response = np.max([-ndimage.gaussian_laplace(contrast, x) * x ** 2 for x in sigmas], axis = 0)
+    peaks = (response == ndimage.maximum_filter(response, size = int(2 * cell_radius) | 1)) & (response > threshold)
+    return np.argwhere(peaks)
+
+def count_image(
+    path: str, cell_radius: float = 10.0, threshold: float = 0.05, dead_threshold: float = 0.1,
+    line_prominence: float = 0.05, line_width: int = 5, squares_per_image: float = 1.0
+    ) -> dict:
+        brightness, stain = load_image(path)
+        # A box filter well beyond the cell size tracks uneven illumination at a fraction of a wide Gaussian's cost
+        background = ndimage.uniform_filter(brightness, int(16 * cell_radius) | 1)
+        rows = grid_lines(background - brightness, 1, line_prominence)
+        columns = grid_lines(background - brightness, 0, line_prominence)
+        # Grid lines are painted over with the background so they are neither counted nor merged into cells
+        on_grid = line_mask(brightness.shape[0], rows, line_width)[:, np.newaxis] | line_mask(brightness.shape[1], columns, line_width)[np.newaxis, :]
+        contrast = np.where(on_grid, 0.0, np.abs(brightness - background))
+        # Live cells are bright with a dark rim, dead cells are dark and blue; smoothing at the cell scale
+        # turns both into filled blobs
+        contrast = ndimage.gaussian_filter(contrast, cell_radius / 4)
+        blobs = detect_blobs(contrast, cell_radius, threshold)
+        top, bottom = counting_bounds(rows, brightness.shape[0])
+        left, right = counting_bounds(columns, brightness.shape[1])
+        # Cells on the top and left borders are counted, those on the bottom and right borders are not
+        inside = (blobs[:, 0] >= top) & (blobs[:, 0] < bottom) & (blobs[:, 1] >= left) & (blobs[:, 1] < right)
+        blobs = blobs[inside]
+        dead = ndimage.gaussian_filter(np.where(on_grid, 0.0, stain), cell_radius / 2)[blobs[:, 0], blobs[:, 1]] > dead_threshold
+        return {
+            'Image': os.path.basename(path),
+            'Live': int(np.sum(~dead)),
+            'Dead': int(np.sum(dead)),
+            'Squares': squares_per_image,
+            'Grid_lines': len(rows) + len(columns)
+            }
+
+def image_paths(image_dir: str) -> list[str]:
+    return sorted(
+        os.path.join(image_dir, x) for x in os.listdir(image_dir)
+        if os.path.splitext(x)[1].lower() in IMAGE_EXTENSIONS
+        )
+
+def count_images(paths: list[str], workers: int = None, **parameters) -> pd.DataFrame:
+    # Images are independent, so each is counted in its own process
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        counts = list(executor.map(partial(count_image, **parameters), paths))
+    return pd.DataFrame(counts, columns = ['Image', 'Live', 'Dead', 'Squares', 'Grid_lines'])
+
+def group_counts(image_counts: pd.DataFrame, group_regex: str = GROUP_REGEX, dilution: float = 1.0) -> pd.DataFrame:
+    # Fields of a group are pooled; count is the live cells over every square counted, and the matching
+    # hemocytometer factor turns it into cells per mL in cell_counter
+    groups = [re.match(group_regex, os.path.splitext(x)[0]).group(1) for x in image_counts.loc[:, 'Image']]
+    pooled = image_counts.loc[:, ['Live', 'Dead', 'Squares']].groupby(groups, sort = False).sum()
+    return pd.DataFrame({
+        'Group': pooled.index.to_numpy(),
+        'count': pooled.loc[:, 'Live'].to_numpy(),
+        'dead': pooled.loc[:, 'Dead'].to_numpy(),
+        'viability': pooled.loc[:, 'Live'].to_numpy() / np.maximum(pooled.loc[:, 'Live'].to_numpy() + pooled.loc[:, 'Dead'].to_numpy(), 1),
+        'hemocytometer_factor': CELLS_PER_ML_PER_SQUARE * dilution / pooled.loc[:, 'Squares'].to_numpy(dtype = float)
+        })
+
+def fill_count_sheet(sheet_path: str, counts: pd.DataFrame) -> pd.DataFrame:
+    # The plating columns of an existing count sheet are kept; its counts come from the images
+    sheet = pd.read_csv(sheet_path)
+    missing = sorted(set(sheet.loc[:, 'Group']) - set(counts.loc[:, 'Group']))
+    if len(missing) > 0:
+        raise ValueError(f'No images were counted for groups {missing} of {sheet_path}')
+    counts = counts.set_index('Group')
+    return sheet.assign(
+        count = sheet.loc[:, 'Group'].map(counts.loc[:, 'count']).to_numpy(),
+        hemocytometer_factor = sheet.loc[:, 'Group'].map(counts.loc[:, 'hemocytometer_factor']).to_numpy()
+        )
+
+def main(
+    image_dir: str, output_path: str, sheet_path: str = None, master_mix_path: str = None, workers: int = None,
+    group_regex: str = GROUP_REGEX, dilution: float = 1.0, **parameters
+    ) -> pd.DataFrame:
+        if master_mix_path is not None and sheet_path is None:
+            raise ValueError('Master mixes need a count sheet with the plating columns (--sheet_path)')
+        paths = image_paths(image_dir)
+        if len(paths) == 0:
+            raise ValueError(f'No images in {image_dir}')
+        image_counts = count_images(paths, workers = workers, **parameters)
+        for image in image_counts.loc[image_counts.loc[:, 'Grid_lines'] == 0, 'Image']:
+            print(f'No grid found in {image}; the whole field was counted')
+        counts = group_counts(image_counts, group_regex = group_regex, dilution = dilution)
+        if sheet_path is not None:
+            counts = fill_count_sheet(sheet_path, counts)
+        tw.write_columns(output_path, counts)
+        print(f'Counted {image_counts.loc[:, "Live"].sum()} live and {image_counts.loc[:, "Dead"].sum()} dead cells in {len(paths)} images into {output_path}')
+        if master_mix_path is not None:
+            cc.main([output_path], output_path = master_mix_path)
+        return counts
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-i',
+        '--image_dir',
+        required = True,
+        help = 'Folder of brightfield hemocytometer images of trypan blue stained cells, named <Group>_<field>'
+        )
+
+    parser.add_argument(
+        '-o',
+        '--output_path',
+        default = 'Tumor_implantations/hemocytometer_counts.csv',
+        help = 'Per-group counts, with the count and hemocytometer_factor columns read by cell_counter'
+        )
+
+    parser.add_argument(
+        '-s',
+        '--sheet_path',
+        default = None,
+        help = 'Existing count sheet whose plating columns are kept and whose counts are filled in from the images'
+        )
+
+    parser.add_argument(
+        '-m',
+        '--master_mix_path',
+        default = None,
+        help = 'Also run cell_counter on the filled count sheet and write the master mixes here'
+        )
+
+    parser.add_argument(
+        '-r',
+        '--cell_radius',
+        default = 10.0,
+        type = float,
+        help = 'Expected cell radius in pixels'
+        )
+
+    parser.add_argument(
+        '-t',
+        '--threshold',
+        default = 0.05,
+        type = float,
+        help = 'Smallest blob response counted as a cell'
+        )
+
+    parser.add_argument(
+        '--dead_threshold',
+        default = 0.1,
+        type = float,
+        help = 'Blue stain above which a cell is counted as dead'
+        )
+
+    parser.add_argument(
+        '--line_prominence',
+        default = 0.05,
+        type = float,
+        help = 'Darkness a grid line must stand out by'
+        )
+
+    parser.add_argument(
+        '--line_width',
+        default = 5,
+        type = int,
+        help = 'Width in pixels of the grid lines masked out'
+        )
+
+    parser.add_argument(
+        '--squares_per_image',
+        default = 1.0,
+        type = float,
+        help = 'Large squares framed by the grid in each image'
+        )
+
+    parser.add_argument(
+        '-d',
+        '--dilution',
+        default = 1.0,
+        type = float,
+        help = 'Dilution of the suspension on the hemocytometer, e.g. 2 for a 1:1 mix with trypan blue'
+        )
+
+    parser.add_argument(
+        '-g',
+        '--group_regex',
+        default = GROUP_REGEX,
+        help = 'Regex whose first group takes the Group out of an image name'
+        )
+
+    parser.add_argument(
+        '-w',
+        '--workers',
+        default = None,
+        type = int,
+        help = 'Number of processes counting images (defaults to the number of CPUs)'
+        )
+
+    args = parser.parse_args()
+
+    main(
+        image_dir = args.image_dir,
+        output_path = args.output_path,
+        sheet_path = args.sheet_path,
+        master_mix_path = args.master_mix_path,
+        workers = args.workers,
+        group_regex = args.group_regex,
+        dilution = args.dilution,
+        cell_radius = args.cell_radius,
+        threshold = args.threshold,
+        dead_threshold = args.dead_threshold,
+        line_prominence = args.line_prominence,
+        line_width = args.line_width,
+        squares_per_image = args.squares_per_image
+        )
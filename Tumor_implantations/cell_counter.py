@@ -1,131 +1,178 @@
+import os
+import sys
 import numpy as np
 import pandas as pd
 import argparse
 
-parser = argparse.ArgumentParser()
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from Utilities import Tabular_writer as tw
 
-parser.add_argument(
-    '-i',
-    '--input_path',
-    default = 'Tumor_implantations/cell_count_input.csv',
-    help = 'Path to input.csv file'
-    )
-
-parser.add_argument(
-    '-o',
-    '--output_path',
-    default = 'Tumor_implantations/cell_count_output.csv',
-    help = 'Path to output .csv'
-    )
-
-args = parser.parse_args()
+# Cells per mL for each cell counted: a large square holds 0.1 uL (10^4 cells per mL per cell), averaged over two squares
+HEMOCYTOMETER_FACTOR = 10 ** 4 / 2.0
+MASTER_MIX_COLUMNS = [
+    'Group', 'Raw_count', 'Total_cells', 'Concentration', 'Volume_of_cells_to_add', 'Volume_of_media_to_add', 'Total_volume'
+    ]
 
 class cell_counter:
 
     def __init__(
-        self, raw_counts, groups = [], volumes = [],
-        total_cells = [], cell_concentrations = []
+        self, raw_counts, groups = None, volumes = None,
+        total_cells = None, cell_concentrations = None, hemocytometer_factor = HEMOCYTOMETER_FACTOR
         ):
-            self.raw_counts = raw_counts
-            self.groups = groups
-            self.volumes = volumes
-            self.total_cells = total_cells
-            self.cell_concentrations = cell_concentrations
-
-    def calculate_cell_concentration_wrapper(self, raw_count):
-        cell_conc = raw_count * (10 ** 4) / 2.0
-        return cell_conc
+            # Every per-group quantity is an array of the same length as raw_counts
+            self.raw_counts = np.asarray(raw_counts)
+            self.groups = None if groups is None else np.asarray(groups, dtype = object)
+            self.volumes = None if volumes is None else np.asarray(volumes, dtype = float)
+            self.total_cells = None if total_cells is None else np.asarray(total_cells, dtype = float)
+            self.cell_concentrations = None if cell_concentrations is None else np.asarray(cell_concentrations, dtype = float)
+            self.hemocytometer_factor = hemocytometer_factor
 
     def calculate_cell_concentrations(self):
-        array_of_counts = np.array(self.raw_counts)
-        concentrations = np.apply_along_axis(
-            func1d = self.calculate_cell_concentration_wrapper,
-            axis = 0,
-            arr = array_of_counts
-            )
-        self.cell_concentrations = list(concentrations)
+        self.cell_concentrations = self.raw_counts * self.hemocytometer_factor
 
     def calculate_total_cells(self):
-        for i in range(len(self.raw_counts)):
-            cell_count = self.cell_concentrations[i] * self.volumes[i]
-            self.total_cells.append(cell_count)
+        self.total_cells = self.cell_concentrations * self.volumes
 
     def calculate(self):
         self.calculate_cell_concentrations()
         self.calculate_total_cells()
 
-    def master_mix_wrapper(self, num_cells_to_plate, volume_to_plate_at, cell_concentration, scaling_factor):
-        vol_of_cells = num_cells_to_plate * scaling_factor / cell_concentration
-        vol_of_media = (volume_to_plate_at * scaling_factor) - vol_of_cells
-        return [vol_of_cells, vol_of_media]
-
-    def calculate_master_mixes(self, num_of_cells_to_plate, volumes_to_plate_at, scaling_factors = 2.0):
-        if isinstance(scaling_factors, float) or isinstance(scaling_factors, int):
-            scaling_factors = [scaling_factors] * len(self.raw_counts)
-        if isinstance(num_of_cells_to_plate, float) or isinstance(num_of_cells_to_plate, int):
-            num_of_cells_to_plate = [num_of_cells_to_plate] * len(self.raw_counts)
-        if isinstance(volumes_to_plate_at, float) or isinstance(volumes_to_plate_at, int):
-            volumes_to_plate_at = [volumes_to_plate_at] * len(self.raw_counts)
-        for i in list(self.__dict__.keys()):
-            if len(self.__dict__[i]) != len(self.raw_counts):
-                new_value = ['NA'] * len(self.raw_counts)
-                self.__dict__[i] = new_value 
-        master_mix = {
-            'Group': self.groups,
+    def column_or_na(self, values) -> np.ndarray:
+        # Quantities that were never given or calculated are reported as NA
+        if values is None or len(values) != len(self.raw_counts):
+            return np.full(len(self.raw_counts), 'NA', dtype = object)
+        return values
+
+    def calculate_master_mixes(self, num_of_cells_to_plate, volumes_to_plate_at, scaling_factors = 2.0) -> dict:
+        # Scalars apply to every group; all volumes come out of one broadcast expression per column
+        num_of_cells_to_plate = np.asarray(num_of_cells_to_plate)
+        volumes_to_plate_at = np.asarray(volumes_to_plate_at)
+        scaling_factors = np.asarray(scaling_factors)
+        vol_of_cells = num_of_cells_to_plate * scaling_factors / self.cell_concentrations
+        total_volumes = np.broadcast_to(volumes_to_plate_at * scaling_factors, vol_of_cells.shape)
+        return {
+            'Group': self.column_or_na(self.groups),
             'Raw_count': self.raw_counts,
-            'Total_cells': self.total_cells,
+            'Total_cells': self.column_or_na(self.total_cells),
             'Concentration': self.cell_concentrations,
-            'Volume_of_cells_to_add': [],
-            'Volume_of_media_to_add': [],
-            'Total_volume': []
+            'Volume_of_cells_to_add': vol_of_cells,
+            'Volume_of_media_to_add': total_volumes - vol_of_cells,
+            'Total_volume': total_volumes
             }
-        for i in range(len(self.raw_counts)):
-            values_to_append = self.master_mix_wrapper(
-                num_cells_to_plate = num_of_cells_to_plate[i],
-                volume_to_plate_at = volumes_to_plate_at[i],
-                cell_concentration = self.cell_concentrations[i],
-                scaling_factor = scaling_factors[i]
-                )
-            master_mix['Volume_of_cells_to_add'].append(values_to_append[0])
-            master_mix['Volume_of_media_to_add'].append(values_to_append[1])
-            master_mix['Total_volume'].append(volumes_to_plate_at[i] * scaling_factors[i])
-        return master_mix
-    
-    def write_to_csv(self, master_mix, filename):
-        columns = list(master_mix.keys())
-        csv_file = open(filename, 'w')
-        for i in range(len(master_mix[columns[0]]) + 1):
-            for t in range(len(columns)):
-                if i == 0:
-                    if t == (len(columns) - 1):
-                        csv_file.write(str(columns[t]))
-                    else:
-                        csv_file.write(str(columns[t]) + ',')
-                else:
-                    if t == (len(columns) - 1):
-                        csv_file.write(str(master_mix[columns[t]][i - 1]))
-                    else:
-                        csv_file.write(str(master_mix[columns[t]][i - 1]) + ',')
-            csv_file.write('\n')
-
-
-input_data = pd.read_csv(args.input_path)
-
-cell_counter_class = cell_counter(
-    raw_counts = list(input_data['count']),
-    groups = list(input_data['Group']),
-    volumes = list(input_data['volume'])
-    )
-
-cell_counter_class.calculate()
-
-master_mix = cell_counter_class.calculate_master_mixes(
-    num_of_cells_to_plate = list(input_data['cells_to_plate']),
-    volumes_to_plate_at = list(input_data['volume_to_plate']),
-    scaling_factors = list(input_data['scaling_factor'])
-    )
-
-cell_counter_class.write_to_csv(
-    master_mix = master_mix,
-    filename = args.output_path
-    )
+
+    def write_to_csv(self, master_mix, filename, append = False):
+        tw.write_columns(filename, master_mix, append = append)
+
+
+def count_sheet(input_path: str, hemocytometer_factor: float = HEMOCYTOMETER_FACTOR) -> dict:
+    # One count sheet (Group, count, volume, cells_to_plate, volume_to_plate, scaling_factor) to its master mixes;
+    # sheets written by Hemocytometer_counter carry their own per-group hemocytometer_factor
+    input_data = pd.read_csv(input_path)
+    if 'hemocytometer_factor' in input_data:
+        hemocytometer_factor = input_data.loc[:, 'hemocytometer_factor'].to_numpy(dtype = float)
+    cell_counter_class = cell_counter(
+        raw_counts = input_data.loc[:, 'count'].to_numpy(),
+        groups = input_data.loc[:, 'Group'].to_numpy(),
+        volumes = input_data.loc[:, 'volume'].to_numpy(),
+        hemocytometer_factor = hemocytometer_factor
+        )
+    cell_counter_class.calculate()
+    return cell_counter_class.calculate_master_mixes(
+        num_of_cells_to_plate = input_data.loc[:, 'cells_to_plate'].to_numpy(),
+        volumes_to_plate_at = input_data.loc[:, 'volume_to_plate'].to_numpy(),
+        scaling_factors = input_data.loc[:, 'scaling_factor'].to_numpy()
+        )
+
+def sheet_labels(input_paths: list) -> list:
+    # Sheets are named by their path below the folder they all share, so day1/cell_count_input.csv and
+    # day2/cell_count_input.csv stay apart
+    paths = [os.path.abspath(x) for x in input_paths]
+    root = os.path.commonpath([os.path.dirname(x) for x in paths])
+    labels = [os.path.relpath(x, root).replace(os.sep, '/') for x in paths]
+    duplicates = sorted(set(x for x in labels if labels.count(x) > 1))
+    if len(duplicates) > 0:
+        raise ValueError(f'Count sheets given more than once: {duplicates}')
+    return labels
+
+def sheet_output_path(sheet_label: str, output_dir: str) -> str:
+    stem = os.path.splitext(sheet_label)[0]
+    stem = stem[:-len('_input')] if stem.endswith('_input') else stem
+    return os.path.join(output_dir, stem.replace('/', '_') + '_output.csv')
+
+def main(
+    input_paths: list, output_path: str = None, output_dir: str = None, append: bool = False,
+    hemocytometer_factor: float = HEMOCYTOMETER_FACTOR
+    ) -> list:
+        labels = sheet_labels(input_paths)
+        master_mixes = [count_sheet(x, hemocytometer_factor = hemocytometer_factor) for x in input_paths]
+        if output_dir is not None:
+            # One output per sheet, named after its path below the shared folder
+            output_paths = [sheet_output_path(x, output_dir) for x in labels]
+            duplicates = sorted(set(x for x in output_paths if output_paths.count(x) > 1))
+            if len(duplicates) > 0:
+                raise ValueError(f'Several count sheets would be written to {duplicates}')
+            os.makedirs(output_dir, exist_ok = True)
+            for sheet_path, master_mix in zip(output_paths, master_mixes):
+                tw.write_columns(sheet_path, master_mix, append = append)
+        elif len(input_paths) == 1:
+            tw.write_columns(output_path, master_mixes[0], append = append)
+        else:
+            # Several sheets share one table, each row labelled with the sheet it came from
+            combined = {'Sheet': np.concatenate([[x] * len(y['Raw_count']) for x, y in zip(labels, master_mixes)])}
+            for column in MASTER_MIX_COLUMNS:
+                combined[column] = np.concatenate([x[column] for x in master_mixes])
+            tw.write_columns(output_path, combined, append = append)
+        print(f'Calculated master mixes for {len(input_paths)} count sheets')
+        return master_mixes
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-i',
+        '--input_path',
+        default = ['Tumor_implantations/cell_count_input.csv'],
+        nargs = '+',
+        help = 'Path to input.csv file, or several count sheets (e.g. one per implantation day)'
+        )
+
+    parser.add_argument(
+        '-o',
+        '--output_path',
+        default = 'Tumor_implantations/cell_count_output.csv',
+        help = 'Path to output .csv; several sheets are combined into it with a Sheet column'
+        )
+
+    parser.add_argument(
+        '-d',
+        '--output_dir',
+        default = None,
+        help = 'Write one <sheet>_output.csv per count sheet into this directory instead, named by its path below the folder the sheets share'
+        )
+
+    parser.add_argument(
+        '-a',
+        '--append',
+        action = 'store_true',
+        help = 'Append to an existing output with the same columns instead of overwriting it'
+        )
+
+    parser.add_argument(
+        '-f',
+        '--hemocytometer_factor',
+        default = HEMOCYTOMETER_FACTOR,
+        type = float,
+        help = 'Cells per mL represented by each counted cell, unless the sheet has a hemocytometer_factor column'
+        )
+
+    args = parser.parse_args()
+
+    main(
+        input_paths = args.input_path,
+        output_path = args.output_path,
+        output_dir = args.output_dir,
+        append = args.append,
+        hemocytometer_factor = args.hemocytometer_factor
+        )
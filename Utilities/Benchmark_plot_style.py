@@ -0,0 +1,117 @@
+import os
+import sys
+import io
+import time
+import argparse
+import numpy as np
+import matplotlib as mpl
+from matplotlib.figure import Figure
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from Utilities import Plot_style as ps
+
+
+def draw_bars(ax, group_values: list[np.ndarray], rng: np.random.Generator):
+    for i, y in enumerate(group_values):
+        ax.scatter(
+            x = i + rng.uniform(-0.1, 0.1, size = len(y)),
+            y = y,
+            c = 'black'
+            )
+        ax.bar(
+            i,
+            np.mean(y),
+            color = 'none',
+            edgecolor = 'black'
+            )
+        ax.errorbar(
+            i,
+            np.mean(y),
+            yerr = np.std(y) / np.sqrt(len(y)),
+            fmt = '_',
+            capsize = 5,
+            color = 'black'
+            )
+    ax.set_ylabel(
+        ylabel = 'Intensity',
+        fontsize = 'large',
+        fontweight = 'bold'
+        )
+
+def render_per_figure_setup(group_values: list[np.ndarray], rng: np.random.Generator, buffer: io.BytesIO):
+    # The styling every plotting function used to repeat on a freshly allocated figure
+    fig = Figure(figsize = (5, 4))
+    ax = fig.add_subplot(1, 1, 1)
+    draw_bars(ax = ax, group_values = group_values, rng = rng)
+    ax.spines['right'].set_color('none')
+    ax.spines['top'].set_color('none')
+    ax.spines['left'].set_linewidth(1.5)
+    ax.spines['bottom'].set_linewidth(1.5)
+    ax.xaxis.set_tick_params(width = 1.5)
+    ax.yaxis.set_tick_params(width = 1.5)
+    for tick in ax.xaxis.get_major_ticks():
+        tick.label1.set_fontweight('bold')
+    for tick in ax.yaxis.get_major_ticks():
+        tick.label1.set_fontweight('bold')
+    if buffer is not None:
+        fig.savefig(buffer, format = 'png')
+
+def render_template(group_values: list[np.ndarray], rng: np.random.Generator, buffer: io.BytesIO):
+    if buffer is None:
+        with mpl.rc_context(ps.plot_style()):
+            fig, ax = ps.cached_axes()
+            draw_bars(ax = ax, group_values = group_values, rng = rng)
+        return
+    with ps.figure_template(output_path = buffer, format = 'png') as (fig, ax):
+        draw_bars(ax = ax, group_values = group_values, rng = rng)
+
+def time_renderer(renderer, number_of_figures: int, number_of_groups: int, save: bool = True, seed: int = 1717) -> float:
+    rng = np.random.default_rng(seed)
+    start_time = time.perf_counter()
+    for _ in range(number_of_figures):
+        group_values = [rng.normal(1.0, 0.2, size = 8) for _ in range(number_of_groups)]
+        buffer = io.BytesIO() if save else None
+        renderer(group_values = group_values, rng = rng, buffer = buffer)
+    return (time.perf_counter() - start_time) / number_of_figures
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-n',
+        '--number_of_figures',
+        default = 200,
+        type = int,
+        help = 'Number of per-target figures to render with each approach'
+        )
+
+    parser.add_argument(
+        '-g',
+        '--number_of_groups',
+        default = 4,
+        type = int,
+        help = 'Number of conditions drawn on each figure'
+        )
+
+    args = parser.parse_args()
+
+    print(f'Figures rendered per approach: {args.number_of_figures}')
+    for save in [False, True]:
+        per_figure_time = time_renderer(
+            renderer = render_per_figure_setup,
+            number_of_figures = args.number_of_figures,
+            number_of_groups = args.number_of_groups,
+            save = save
+            )
+        template_time = time_renderer(
+            renderer = render_template,
+            number_of_figures = args.number_of_figures,
+            number_of_groups = args.number_of_groups,
+            save = save
+            )
+        print('Setup and drawing, including PNG encoding:' if save else 'Setup and drawing only:')
+        print(f'    Fresh figure + per-tick styling: {per_figure_time * 1000:.2f} ms/figure')
+        print(f'    Cached template + rcParams: {template_time * 1000:.2f} ms/figure')
+        print(f'    Speedup: {per_figure_time / template_time:.2f}x')
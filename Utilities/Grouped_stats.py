@@ -0,0 +1,185 @@
+from collections import namedtuple
+from itertools import combinations
+from typing import Union
+import numpy as np
+import pandas as pd
+from scipy import stats
+from statsmodels.stats.multitest import multipletests
+
+F_onewayResult = namedtuple('F_onewayResult', ['statistic', 'pvalue'])
+Ttest_indResult = namedtuple('Ttest_indResult', ['statistic', 'pvalue', 'df'])
+
+
+def studentized_range_sf(q_statistic: np.ndarray, number_of_levels: int, df: float) -> np.ndarray:
+    # Each sf call is a numerical integral, so it is evaluated exactly once per distinct finite q; NaN q stays NaN
+    q_statistic = np.asarray(q_statistic, dtype = float)
+    sf = np.full(q_statistic.shape, np.nan)
+    finite = np.isfinite(q_statistic)
+    unique_q, inverse = np.unique(q_statistic[finite], return_inverse = True)
+    sf[finite] = stats.studentized_range.sf(unique_q, number_of_levels, df)[inverse]
+    return sf
+
+def adjust_pvalues(pvalues, correction: str = 'fdr_bh', alpha: float = 0.05) -> tuple[np.ndarray, np.ndarray]:
+    # Only finite p-values are corrected, so a constant or empty feature cannot turn every adjusted p-value into NaN;
+    # untested features keep NaN and are never rejected
+    pvalues = np.asarray(pvalues, dtype = float)
+    tested = np.isfinite(pvalues)
+    pvalue_adjusted = np.full(len(pvalues), np.nan)
+    reject = np.zeros(len(pvalues), dtype = bool)
+    if tested.any():
+        reject[tested], pvalue_adjusted[tested], _, _ = multipletests(pvalues[tested], alpha = alpha, method = correction)
+    return reject, pvalue_adjusted
+
+
+class GroupedData:
+
+    def __init__(
+        self,
+        input_data: pd.DataFrame,
+        xvals_key: Union[str, int],
+        yvals_keys: Union[str, int, list]
+        ):
+            self.xvals_key = xvals_key
+            self.single_feature = not isinstance(yvals_keys, list)
+            self.feature_labels = [yvals_keys] if self.single_feature else list(yvals_keys)
+            # Factorizing the condition column once; every statistic below reuses these codes
+            codes, levels = pd.factorize(input_data.loc[:, xvals_key], sort = True)
+            if (codes < 0).any():
+                raise ValueError(f'{xvals_key} contains missing condition labels')
+            self.codes = codes
+            self.levels = list(levels)
+            self.values = input_data.loc[:, self.feature_labels].to_numpy(dtype = float)
+            number_of_levels = len(self.levels)
+            self.sizes = np.bincount(codes, minlength = number_of_levels)
+            indicator = np.zeros((number_of_levels, len(codes)))
+            indicator[codes, np.arange(len(codes))] = 1.0
+            self.means = (indicator @ self.values) / self.sizes[:, np.newaxis]
+            self.sum_of_squares = indicator @ ((self.values - self.means[codes]) ** 2)
+            # Stable ordering of rows by group so each group's members are one contiguous slice
+            self.order = np.argsort(codes, kind = 'stable')
+            self.boundaries = np.concatenate([[0], np.cumsum(self.sizes)])
+
+    @property
+    def number_of_levels(self) -> int:
+        return len(self.levels)
+
+    def _output(self, values: np.ndarray):
+        if self.single_feature:
+            return values[..., 0][()]
+        return values
+
+    def group_indices(self, level_index: int) -> np.ndarray:
+        return self.order[self.boundaries[level_index]:self.boundaries[level_index + 1]]
+
+    def group_values(self, level_index: int, feature_index: int = 0) -> np.ndarray:
+        return self.values[self.group_indices(level_index), feature_index]
+
+    def variances(self, ddof: int = 1) -> np.ndarray:
+        return self._output(self.sum_of_squares / (self.sizes[:, np.newaxis] - ddof))
+
+    def sems(self) -> np.ndarray:
+        # Population standard deviation over sqrt(n), as drawn on the barplots
+        return self._output(np.sqrt(self.sum_of_squares / self.sizes[:, np.newaxis]) / np.sqrt(self.sizes[:, np.newaxis]))
+
+    def group_means(self) -> np.ndarray:
+        return self._output(self.means)
+
+    def welch_ttest(self) -> Ttest_indResult:
+        if self.number_of_levels != 2:
+            raise ValueError('Cannot perform a T-test with a categorical variable that does not have two levels')
+        variances = self.sum_of_squares / (self.sizes[:, np.newaxis] - 1)
+        standard_errors = variances / self.sizes[:, np.newaxis]
+        # Constant features have no variance; their statistic, df and p-value are left NaN
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            statistic = (self.means[0] - self.means[1]) / np.sqrt(standard_errors[0] + standard_errors[1])
+            df = (standard_errors[0] + standard_errors[1]) ** 2 / (
+                standard_errors[0] ** 2 / (self.sizes[0] - 1) + standard_errors[1] ** 2 / (self.sizes[1] - 1)
+                )
+        pvalue = 2.0 * stats.t.sf(np.abs(statistic), df)
+        return Ttest_indResult(self._output(statistic), self._output(pvalue), self._output(df))
+
+    def paired_ttest(self):
+        if self.number_of_levels != 2:
+            raise ValueError('Cannot perform a T-test with a categorical variable that does not have two levels')
+        return stats.ttest_rel(
+            a = self._output(self.values[self.group_indices(0)]),
+            b = self._output(self.values[self.group_indices(1)])
+            )
+
+    def anova_components(self) -> dict:
+        grand_means = (self.sizes[:, np.newaxis] * self.means).sum(axis = 0) / self.sizes.sum()
+        df_between = self.number_of_levels - 1
+        df_within = self.sizes.sum() - self.number_of_levels
+        ss_between = (self.sizes[:, np.newaxis] * (self.means - grand_means) ** 2).sum(axis = 0)
+        ss_within = self.sum_of_squares.sum(axis = 0)
+        return {
+            'df_between': df_between,
+            'df_within': df_within,
+            'ss_between': ss_between,
+            'ss_within': ss_within,
+            'mse': ss_within / df_within
+            }
+
+    def anova(self) -> F_onewayResult:
+        components = self.anova_components()
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            statistic = (components['ss_between'] / components['df_between']) / components['mse']
+        pvalue = stats.f.sf(statistic, components['df_between'], components['df_within'])
+        return F_onewayResult(self._output(statistic), self._output(pvalue))
+
+    def tukey_hsd(self, alpha: float = 0.05) -> pd.DataFrame:
+        # Tukey-Kramer comparisons from the group means, sizes and pooled MSE computed above
+        components = self.anova_components()
+        pairs = np.array(list(combinations(range(self.number_of_levels), 2)))
+        first, second = pairs[:, 0], pairs[:, 1]
+        meandiff = self.means[second] - self.means[first]
+        standard_error = np.sqrt(components['mse'] / 2.0 * (1.0 / self.sizes[first] + 1.0 / self.sizes[second])[:, np.newaxis])
+        # Constant features have no within-group variance; their statistics are left NaN rather than warned about
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            q_statistic = np.abs(meandiff) / standard_error
+        p_adjusted = studentized_range_sf(q_statistic, self.number_of_levels, components['df_within'])
+        q_critical = stats.studentized_range.ppf(1.0 - alpha, self.number_of_levels, components['df_within'])
+        levels = np.array(self.levels, dtype = object)
+        tukey_table = pd.DataFrame({
+            'Feature': np.repeat(np.array(self.feature_labels, dtype = object), len(pairs)),
+            'group1': np.tile(levels[first], len(self.feature_labels)),
+            'group2': np.tile(levels[second], len(self.feature_labels)),
+            'meandiff': meandiff.T.ravel(),
+            'p-adj': np.clip(p_adjusted.T.ravel(), 0.0, 1.0),
+            'lower': (meandiff - q_critical * standard_error).T.ravel(),
+            'upper': (meandiff + q_critical * standard_error).T.ravel()
+            })
+        tukey_table['reject'] = tukey_table.loc[:, 'p-adj'] < alpha
+        if self.single_feature:
+            tukey_table = tukey_table.drop(columns = ['Feature'])
+        return tukey_table
+
+def batch_tests(
+    input_data: pd.DataFrame, xvals_key: Union[str, int], feature_labels: list,
+    correction: str = 'fdr_bh', alpha: float = 0.05, post_hoc_test: bool = True
+    ) -> pd.DataFrame:
+        # Every feature column is tested in the same array operations, then corrected across features
+        grouped_data = GroupedData(input_data, xvals_key, list(feature_labels))
+        results = pd.DataFrame({'Feature': list(feature_labels)})
+        for i, level in enumerate(grouped_data.levels):
+            results[f'Mean {level}'] = grouped_data.means[i]
+        if grouped_data.number_of_levels == 2:
+            test_output = grouped_data.welch_ttest()
+            results['Test'] = 'Welch t-test'
+            results['df'] = test_output.df
+        else:
+            test_output = grouped_data.anova()
+            components = grouped_data.anova_components()
+            results['Test'] = 'One-way ANOVA'
+            results['df'] = f'{components["df_between"]}, {components["df_within"]}'
+        results['Statistic'] = test_output.statistic
+        results['pvalue'] = test_output.pvalue
+        reject, pvalue_adjusted = adjust_pvalues(results.loc[:, 'pvalue'], correction = correction, alpha = alpha)
+        results['pvalue_adjusted'] = pvalue_adjusted
+        results['reject'] = reject
+        if post_hoc_test is True and grouped_data.number_of_levels > 2:
+            tukey_table = grouped_data.tukey_hsd(alpha = alpha)
+            tukey_table['Comparison'] = 'p-adj ' + tukey_table.loc[:, 'group1'].astype(str) + ' vs ' + tukey_table.loc[:, 'group2'].astype(str)
+            tukey_pvalues = tukey_table.pivot(index = 'Feature', columns = 'Comparison', values = 'p-adj')
+            results = results.join(tukey_pvalues, on = 'Feature')
+        return results
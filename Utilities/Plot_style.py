@@ -0,0 +1,54 @@
+from contextlib import contextmanager
+import matplotlib as mpl
+from matplotlib import pyplot as plt
+from matplotlib.figure import Figure
+
+# Open top/right spines with 1.5 pt axes and tick lines, set once through rcParams
+BOLD_SPINE_STYLE = {
+    'axes.spines.right': False,
+    'axes.spines.top': False,
+    'axes.linewidth': 1.5,
+    'xtick.major.width': 1.5,
+    'ytick.major.width': 1.5
+    }
+
+# Tick labels pick up their weight from font.weight when they are created
+BOLD_TICK_STYLE = dict(BOLD_SPINE_STYLE, **{'font.weight': 'bold'})
+
+_figure_cache = {}
+
+
+def plot_style(bold_ticks: bool = True) -> dict:
+    if bold_ticks is True:
+        return BOLD_TICK_STYLE
+    return BOLD_SPINE_STYLE
+
+def cached_axes(figsize: tuple = (5, 4), bold_ticks: bool = True):
+    # One figure per (size, style) and process; axes are cleared rather than reallocated
+    cache_key = (tuple(figsize), bold_ticks)
+    if cache_key in _figure_cache:
+        fig, ax = _figure_cache[cache_key]
+        ax.cla()
+    else:
+        fig = Figure(figsize = figsize)
+        ax = fig.add_subplot(1, 1, 1)
+        _figure_cache[cache_key] = (fig, ax)
+    return fig, ax
+
+def clear_figure_cache():
+    _figure_cache.clear()
+
+@contextmanager
+def figure_template(output_path: str = None, figsize: tuple = (5, 4), bold_ticks: bool = True, **savefig_kwargs):
+    with mpl.rc_context(plot_style(bold_ticks = bold_ticks)):
+        if output_path is None:
+            fig = plt.figure(figsize = figsize)
+            ax = fig.add_subplot(1, 1, 1)
+        else:
+            # Figures written straight to disk never touch pyplot or an interactive backend
+            fig, ax = cached_axes(figsize = figsize, bold_ticks = bold_ticks)
+        yield fig, ax
+        if output_path is None:
+            plt.show()
+        else:
+            fig.savefig(output_path, **savefig_kwargs)
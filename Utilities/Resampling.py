@@ -0,0 +1,240 @@
+from itertools import combinations
+from math import comb
+from concurrent.futures import ProcessPoolExecutor
+from typing import Union
+import numpy as np
+import pandas as pd
+from scipy import stats
+from Utilities import Grouped_stats as gs
+
+DEFAULT_SEED = 1717
+CHUNK_SIZE = 10000
+
+
+def seed_sequence(seed: Union[int, np.random.SeedSequence]) -> np.random.SeedSequence:
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    return np.random.SeedSequence(seed)
+
+def spawn_generators(seed: Union[int, np.random.SeedSequence], number_of_generators: int) -> list[np.random.Generator]:
+    return [np.random.default_rng(child) for child in seed_sequence(seed).spawn(number_of_generators)]
+
+def chunk_sizes(n_resamples: int, chunk_size: int = CHUNK_SIZE) -> list[int]:
+    # Chunks depend only on n_resamples, so results do not change with the number of processes
+    sizes = [chunk_size] * (n_resamples // chunk_size)
+    if n_resamples % chunk_size != 0:
+        sizes.append(n_resamples % chunk_size)
+    return sizes
+
+def map_chunks(function, jobs: list, processes: int = None) -> list:
+    if processes == 1 or len(jobs) == 1:
+        return [function(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers = processes) as executor:
+        return list(executor.map(function, jobs))
+
+def exact_label_matrix(codes: np.ndarray) -> np.ndarray:
+    # Every way of choosing which rows carry the first label; only defined for two groups
+    number_of_rows = len(codes)
+    first_size = int(np.sum(codes == 0))
+    chosen_rows = np.array(list(combinations(range(number_of_rows), first_size)), dtype = np.intp)
+    label_matrix = np.ones((len(chosen_rows), number_of_rows), dtype = codes.dtype)
+    np.put_along_axis(label_matrix, chosen_rows, 0, axis = 1)
+    return label_matrix
+
+def group_statistic(label_matrix: np.ndarray, values: np.ndarray, number_of_levels: int, statistic: str) -> np.ndarray:
+    # label_matrix is resamples x rows of group codes, values is rows x features
+    sizes = np.array([np.sum(label_matrix[0] == level) for level in range(number_of_levels)], dtype = float)
+    group_sums = np.stack([(label_matrix == level).astype(float) @ values for level in range(number_of_levels)])
+    group_means = group_sums / sizes[:, np.newaxis, np.newaxis]
+    if statistic == 'mean_difference':
+        return group_means[0] - group_means[1]
+    if statistic == 'welch_t':
+        group_squares = np.stack([(label_matrix == level).astype(float) @ (values ** 2) for level in range(number_of_levels)])
+        variances = (group_squares - sizes[:, np.newaxis, np.newaxis] * group_means ** 2) / (sizes[:, np.newaxis, np.newaxis] - 1)
+        return (group_means[0] - group_means[1]) / np.sqrt(variances[0] / sizes[0] + variances[1] / sizes[1])
+    if statistic == 'f':
+        number_of_rows = label_matrix.shape[1]
+        grand_means = values.mean(axis = 0)
+        ss_total = ((values - grand_means) ** 2).sum(axis = 0)
+        ss_between = (sizes[:, np.newaxis, np.newaxis] * (group_means - grand_means) ** 2).sum(axis = 0)
+        return (ss_between / (number_of_levels - 1)) / ((ss_total - ss_between) / (number_of_rows - number_of_levels))
+    raise ValueError(f'{statistic} should be one of: mean_difference, welch_t, f')
+
+def permutation_chunk(job: dict) -> np.ndarray:
+    if job['label_matrix'] is not None:
+        label_matrix = job['label_matrix']
+    else:
+        label_matrix = job['rng'].permuted(np.tile(job['codes'], (job['size'], 1)), axis = 1)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        null_statistics = group_statistic(
+            label_matrix = label_matrix,
+            values = job['values'],
+            number_of_levels = job['number_of_levels'],
+            statistic = job['statistic']
+            )
+    # Only exceedance counts travel back from the workers
+    if job['statistic'] == 'f':
+        return np.sum(null_statistics >= job['observed'] * (1.0 - 1e-12), axis = 0)
+    return np.sum(np.abs(null_statistics) >= np.abs(job['observed']) * (1.0 - 1e-12), axis = 0)
+
+def permutation_test(
+    input_data: pd.DataFrame, xvals_key: Union[str, int], feature_labels: list,
+    n_resamples: int = 10000, statistic: str = None, exact_limit: int = 100000,
+    seed: Union[int, np.random.SeedSequence] = DEFAULT_SEED, processes: int = None,
+    chunk_size: int = CHUNK_SIZE, correction: str = 'fdr_bh', alpha: float = 0.05
+    ) -> pd.DataFrame:
+        codes, levels = pd.factorize(input_data.loc[:, xvals_key], sort = True)
+        values = input_data.loc[:, list(feature_labels)].to_numpy(dtype = float)
+        number_of_levels = len(levels)
+        if statistic is None:
+            statistic = 'mean_difference' if number_of_levels == 2 else 'f'
+        if statistic != 'f' and number_of_levels != 2:
+            raise ValueError(f'{statistic} needs exactly two levels in {xvals_key}')
+        # Constant or empty features have no observed statistic; their p-values are NaN rather than 0
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            observed = group_statistic(codes[np.newaxis, :], values, number_of_levels, statistic)[0]
+        base_job = {
+            'codes': codes,
+            'values': values,
+            'number_of_levels': number_of_levels,
+            'statistic': statistic,
+            'observed': observed
+            }
+        exact = number_of_levels == 2 and comb(len(codes), int(np.sum(codes == 0))) <= exact_limit
+        if exact:
+            label_matrix = exact_label_matrix(codes)
+            jobs = [dict(base_job, label_matrix = label_matrix[i:i + chunk_size]) for i in range(0, len(label_matrix), chunk_size)]
+            total_resamples = len(label_matrix)
+        else:
+            sizes = chunk_sizes(n_resamples = n_resamples, chunk_size = chunk_size)
+            generators = spawn_generators(seed = seed, number_of_generators = len(sizes))
+            jobs = [dict(base_job, label_matrix = None, rng = rng, size = size) for rng, size in zip(generators, sizes)]
+            total_resamples = n_resamples
+        exceedances = np.sum(map_chunks(permutation_chunk, jobs, processes = processes), axis = 0)
+        if exact:
+            # The observed labelling is one of the enumerated ones, so no +1 correction
+            pvalues = exceedances / total_resamples
+        else:
+            pvalues = (exceedances + 1) / (total_resamples + 1)
+        pvalues = np.where(np.isfinite(observed), pvalues, np.nan)
+        _, pvalues_adjusted = gs.adjust_pvalues(pvalues, correction = correction, alpha = alpha)
+        return pd.DataFrame({
+            'Feature': list(feature_labels),
+            'Statistic': statistic,
+            'Observed': observed,
+            'pvalue_permutation': pvalues,
+            'pvalue_permutation_adjusted': pvalues_adjusted,
+            'n_resamples': total_resamples,
+            'exact': exact
+            })
+
+def resample_counts(rng: np.random.Generator, number_of_rows: int, size: int) -> np.ndarray:
+    # Bootstrap draws as a resamples x rows count matrix, so a statistic is one matrix product
+    draws = rng.integers(0, number_of_rows, size = (size, number_of_rows))
+    offsets = np.arange(size)[:, np.newaxis] * number_of_rows
+    return np.bincount((draws + offsets).ravel(), minlength = size * number_of_rows).reshape(size, number_of_rows)
+
+def bootstrap_means_chunk(job: dict) -> np.ndarray:
+    generators = job['generators']
+    chunk_means = []
+    for level_index, level_values in enumerate(job['group_values']):
+        counts = resample_counts(generators[level_index], len(level_values), job['size'])
+        chunk_means.append((counts @ level_values) / len(level_values))
+    return np.stack(chunk_means, axis = 1)
+
+def bootstrap_means(
+    input_data: pd.DataFrame, xvals_key: Union[str, int], feature_labels: list,
+    n_resamples: int = 10000, confidence: float = 0.95,
+    seed: Union[int, np.random.SeedSequence] = DEFAULT_SEED, processes: int = None,
+    chunk_size: int = CHUNK_SIZE
+    ) -> pd.DataFrame:
+        codes, levels = pd.factorize(input_data.loc[:, xvals_key], sort = True)
+        values = input_data.loc[:, list(feature_labels)].to_numpy(dtype = float)
+        group_values = [values[codes == level] for level in range(len(levels))]
+        sizes = chunk_sizes(n_resamples = n_resamples, chunk_size = chunk_size)
+        chunk_seeds = seed_sequence(seed).spawn(len(sizes))
+        jobs = [{
+            'group_values': group_values,
+            'generators': spawn_generators(seed = chunk_seed, number_of_generators = len(levels)),
+            'size': size
+            } for chunk_seed, size in zip(chunk_seeds, sizes)]
+        # resamples x levels x features
+        resampled_means = np.concatenate(map_chunks(bootstrap_means_chunk, jobs, processes = processes), axis = 0)
+        tail = (1.0 - confidence) / 2.0
+        lower, upper = np.quantile(resampled_means, [tail, 1.0 - tail], axis = 0)
+        observed_means = np.stack([level_values.mean(axis = 0) for level_values in group_values])
+        return pd.DataFrame({
+            'Feature': np.tile(np.array(feature_labels, dtype = object), len(levels)),
+            'Condition': np.repeat(np.array(levels, dtype = object), len(feature_labels)),
+            'Mean': observed_means.ravel(),
+            'CI_lower': lower.ravel(),
+            'CI_upper': upper.ravel(),
+            'n_resamples': n_resamples
+            })
+
+def rowwise_correlation(x_matrix: np.ndarray, y_matrix: np.ndarray) -> np.ndarray:
+    x_centered = x_matrix - x_matrix.mean(axis = 1, keepdims = True)
+    y_centered = y_matrix - y_matrix.mean(axis = 1, keepdims = True)
+    return (x_centered * y_centered).sum(axis = 1) / np.sqrt((x_centered ** 2).sum(axis = 1) * (y_centered ** 2).sum(axis = 1))
+
+def correlation_chunk(job: dict) -> tuple[np.ndarray, int]:
+    x_values, y_values = job['x_values'], job['y_values']
+    number_of_rows = len(x_values)
+    rng = job['rng']
+    # Bootstrap pairs and permute y against a fixed x, both as index matrices
+    bootstrap_index = rng.integers(0, number_of_rows, size = (job['size'], number_of_rows))
+    x_boot, y_boot = x_values[bootstrap_index], y_values[bootstrap_index]
+    permuted_y = y_values[rng.permuted(np.tile(np.arange(number_of_rows), (job['size'], 1)), axis = 1)]
+    if job['method'] == 'spearman':
+        x_boot, y_boot = stats.rankdata(x_boot, axis = 1), stats.rankdata(y_boot, axis = 1)
+        permuted_y = stats.rankdata(permuted_y, axis = 1)
+        x_fixed = stats.rankdata(x_values)[np.newaxis, :]
+    else:
+        x_fixed = x_values[np.newaxis, :]
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        bootstrap_statistics = rowwise_correlation(x_boot, y_boot)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        null_statistics = rowwise_correlation(np.broadcast_to(x_fixed, permuted_y.shape), permuted_y)
+    exceedances = int(np.sum(np.abs(null_statistics) >= np.abs(job['observed']) * (1.0 - 1e-12)))
+    return bootstrap_statistics, exceedances
+
+def correlation_test(
+    x_values, y_values, method: str = 'pearson', n_resamples: int = 10000,
+    confidence: float = 0.95, seed: Union[int, np.random.SeedSequence] = DEFAULT_SEED,
+    processes: int = None, chunk_size: int = CHUNK_SIZE
+    ) -> dict:
+        if method not in ['pearson', 'spearman']:
+            raise ValueError(f'{method} should be one of: pearson, spearman')
+        x_values = np.asarray(x_values, dtype = float)
+        y_values = np.asarray(y_values, dtype = float)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            if method == 'spearman':
+                observed = rowwise_correlation(stats.rankdata(x_values)[np.newaxis, :], stats.rankdata(y_values)[np.newaxis, :])[0]
+            else:
+                observed = rowwise_correlation(x_values[np.newaxis, :], y_values[np.newaxis, :])[0]
+        sizes = chunk_sizes(n_resamples = n_resamples, chunk_size = chunk_size)
+        generators = spawn_generators(seed = seed, number_of_generators = len(sizes))
+        jobs = [{
+            'x_values': x_values,
+            'y_values': y_values,
+            'method': method,
+            'observed': observed,
+            'rng': rng,
+            'size': size
+            } for rng, size in zip(generators, sizes)]
+        chunk_outputs = map_chunks(correlation_chunk, jobs, processes = processes)
+        bootstrap_statistics = np.concatenate([output[0] for output in chunk_outputs])
+        exceedances = sum(output[1] for output in chunk_outputs)
+        tail = (1.0 - confidence) / 2.0
+        # Resamples that drew a constant x or y have no defined correlation and are left out of the CI
+        bootstrap_statistics = bootstrap_statistics[np.isfinite(bootstrap_statistics)]
+        lower, upper = np.quantile(bootstrap_statistics, [tail, 1.0 - tail]) if len(bootstrap_statistics) > 0 else (np.nan, np.nan)
+        return {
+            'method': method,
+            'statistic': observed,
+            # A constant x or y has no observed correlation to test
+            'pvalue_permutation': (exceedances + 1) / (n_resamples + 1) if np.isfinite(observed) else np.nan,
+            'CI_lower': lower,
+            'CI_upper': upper,
+            'n_resamples': n_resamples
+            }
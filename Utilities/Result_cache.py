@@ -0,0 +1,124 @@
+import os
+import json
+import pickle
+import hashlib
+import tempfile
+
+# Results live at the top of the repository by default, next to the scripts that share them
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.result_cache')
+DEFAULT_MAX_BYTES = 512 * 2 ** 20
+HASH_CHUNK_SIZE = 2 ** 24
+RESULT_EXTENSION = '.pkl'
+
+# Content digests keyed by (path, size, mtime), so a file is only re-read when it may have changed
+_file_digests = {}
+
+
+def file_hash(path: str) -> str:
+    path = os.path.abspath(path)
+    status = os.stat(path)
+    stamp = (path, status.st_size, status.st_mtime_ns)
+    if stamp not in _file_digests:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as input_file:
+            for chunk in iter(lambda: input_file.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        _file_digests[stamp] = digest.hexdigest()
+    return _file_digests[stamp]
+
+def parameter_hash(parameters: dict) -> str:
+    # Anything JSON cannot encode (compiled regexes, numpy scalars, tuples nested in sets) is keyed by its repr
+    encoded = json.dumps(parameters, sort_keys = True, default = repr)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+class ResultCache:
+
+    def __init__(
+        self,
+        cache_dir: str = None,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        enabled: bool = True
+        ):
+            self.cache_dir = DEFAULT_CACHE_DIR if cache_dir is None else cache_dir
+            self.max_bytes = max_bytes
+            self.enabled = enabled
+
+    def key(self, name: str, input_paths: list = None, parameters: dict = None) -> str:
+        # Inputs are keyed by content rather than path or timestamp, so copies and re-saves of the same data still hit
+        digest = hashlib.sha256(name.encode())
+        for path in [] if input_paths is None else input_paths:
+            digest.update(file_hash(path).encode())
+        digest.update(parameter_hash({} if parameters is None else parameters).encode())
+        return f'{name}-{digest.hexdigest()}'
+
+    def result_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + RESULT_EXTENSION)
+
+    def load(self, key: str) -> tuple:
+        # Returns (hit, value); a hit refreshes the entry's timestamp so eviction follows last use
+        path = self.result_path(key)
+        if not self.enabled or not os.path.exists(path):
+            return False, None
+        try:
+            with open(path, 'rb') as result_file:
+                value = pickle.load(result_file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return False, None
+        os.utime(path)
+        return True, value
+
+    def store(self, key: str, value):
+        if not self.enabled:
+            return
+        os.makedirs(self.cache_dir, exist_ok = True)
+        # Written beside the target and renamed into place, so concurrent runs never read half an entry
+        handle, temporary_path = tempfile.mkstemp(dir = self.cache_dir, suffix = '.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as result_file:
+                pickle.dump(value, result_file, protocol = pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_path, self.result_path(key))
+        except BaseException:
+            # A result that cannot be pickled (or an interrupted write) must not leave an orphan that eviction never sees
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        self.evict()
+
+    def entries(self) -> list:
+        # (last use, size, path) for every stored result, least recently used first
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(RESULT_EXTENSION):
+                status = entry.stat()
+                entries.append((status.st_mtime_ns, status.st_size, entry.path))
+        return sorted(entries)
+
+    def evict(self):
+        entries = self.entries()
+        total_bytes = sum(x[1] for x in entries)
+        for _, size, path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            os.remove(path)
+
+    def cached(self, name: str, compute, input_paths: list = None, parameters: dict = None):
+        # compute() is only called on a miss; its return value must be picklable
+        if not self.enabled:
+            return compute()
+        key = self.key(name, input_paths = input_paths, parameters = parameters)
+        hit, value = self.load(key)
+        if hit:
+            return value
+        value = compute()
+        self.store(key, value)
+        return value
@@ -0,0 +1,88 @@
+import os
+import pandas as pd
+
+# Extensions understood by read_table/write_table; anything else is read as CSV
+TABLE_FORMATS = {
+    '.csv': 'csv',
+    '.parquet': 'parquet',
+    '.feather': 'feather',
+    '.arrow': 'feather',
+    '.xlsx': 'xlsx'
+    }
+
+DEFAULT_FORMAT = 'csv'
+
+
+def table_format(path: str, file_format: str = None) -> str:
+    if file_format is not None:
+        return file_format
+    return TABLE_FORMATS.get(os.path.splitext(path)[1].lower(), DEFAULT_FORMAT)
+
+def with_format(path: str, file_format: str) -> str:
+    extension = [x for x, y in TABLE_FORMATS.items() if y == file_format][0]
+    return os.path.splitext(path)[0] + extension
+
+def read_table(path: str, index_col: int = None, dtype = None, file_format: str = None, memory_map: bool = True, **kwargs) -> pd.DataFrame:
+    file_format = table_format(path, file_format)
+    if file_format == 'csv':
+        return pd.read_csv(path, index_col = index_col, dtype = dtype, **kwargs)
+    if file_format == 'parquet':
+        table = pd.read_parquet(path, memory_map = memory_map, **kwargs)
+    elif file_format == 'feather':
+        # Arrow IPC files are mapped rather than read, so only the columns that get touched are paged in
+        from pyarrow import feather
+        table = feather.read_table(path, memory_map = memory_map, **kwargs).to_pandas()
+    elif file_format == 'xlsx':
+        table = pd.read_excel(path, **kwargs)
+    else:
+        raise ValueError(f'Unknown table format {file_format} for {path}')
+    if dtype is not None:
+        table = table.astype(dtype)
+    if index_col is not None:
+        table = table.set_index(keys = table.columns[index_col])
+    return table
+
+def read_columns(path: str, file_format: str = None) -> list:
+    # Header only for CSV; the columnar formats keep their schema in the footer or header
+    file_format = table_format(path, file_format)
+    if file_format == 'csv':
+        return list(pd.read_csv(path, nrows = 0).columns)
+    if file_format == 'parquet':
+        from pyarrow import parquet
+        return list(parquet.read_schema(path).names)
+    if file_format == 'feather':
+        from pyarrow import ipc
+        with ipc.open_file(path) as reader:
+            return list(reader.schema.names)
+    return list(read_table(path, file_format = file_format, nrows = 0).columns)
+
+def write_table(table: pd.DataFrame, path: str, index: bool = False, file_format: str = None, **kwargs):
+    file_format = table_format(path, file_format)
+    if file_format == 'csv':
+        table.to_csv(path, index = index, **kwargs)
+    elif file_format == 'parquet':
+        table.to_parquet(path, index = index, **kwargs)
+    elif file_format == 'feather':
+        if index is True:
+            table = table.reset_index()
+        table.reset_index(drop = True).to_feather(path, **kwargs)
+    elif file_format == 'xlsx':
+        table.to_excel(path, index = index, **kwargs)
+    else:
+        raise ValueError(f'Unknown table format {file_format} for {path}')
+
+def read_plate(path: str, file_format: str = None) -> pd.DataFrame:
+    # Plate reads are a row-letter index by numbered columns; labels are kept as strings whatever the format
+    plate_data = read_table(path, index_col = 0, file_format = file_format)
+    plate_data.index = plate_data.index.astype(str)
+    plate_data.columns = plate_data.columns.astype(str)
+    return plate_data
+
+def read_layout(path: str, file_format: str = None) -> pd.DataFrame:
+    layout = read_plate(path, file_format = file_format)
+    return layout.astype(object).where(layout.notna(), '').astype(str)
+
+def write_plate(plate_data: pd.DataFrame, path: str, file_format: str = None):
+    plate_data = plate_data.copy()
+    plate_data.index = plate_data.index.rename('0')
+    write_table(plate_data, path, index = True, file_format = file_format)
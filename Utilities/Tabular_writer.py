@@ -0,0 +1,50 @@
+import os
+import csv
+from typing import Union
+import numpy as np
+import pandas as pd
+
+# Unix line endings like the hand-rolled writers these replace; fields holding commas, quotes or newlines are quoted
+LINE_TERMINATOR = '\n'
+QUOTING = csv.QUOTE_MINIMAL
+
+
+def column_values(column) -> list:
+    # Arrays and Series are unboxed to Python scalars in one C-level pass, which the csv module formats as str() would
+    if isinstance(column, (np.ndarray, pd.Series, pd.Index)):
+        return column.tolist()
+    return list(column)
+
+def existing_header(path: str) -> list:
+    # The header of a non-empty file at path, or None when there is nothing to append to
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    with open(path, 'r', newline = '', encoding = 'UTF-8') as csv_file:
+        return next(csv.reader(csv_file), None)
+
+def write_rows(path: str, rows, header: list = None, append: bool = False):
+    # Rows go through csv.writer in bulk; appending skips the header once it matches the file's own
+    header = None if header is None else [str(x) for x in header]
+    mode = 'w'
+    if append:
+        current_header = existing_header(path)
+        if current_header is not None:
+            if header is not None and current_header != header:
+                raise ValueError(f'Cannot append columns {header} to {path}, which has columns {current_header}')
+            header = None
+            mode = 'a'
+    with open(path, mode, newline = '', encoding = 'UTF-8') as csv_file:
+        writer = csv.writer(csv_file, lineterminator = LINE_TERMINATOR, quoting = QUOTING)
+        if header is not None:
+            writer.writerow(header)
+        writer.writerows(rows)
+
+def write_columns(path: str, columns: Union[dict, pd.DataFrame], append: bool = False):
+    # Column blocks (a dict of equal-length sequences or a DataFrame) are transposed lazily into rows
+    if isinstance(columns, pd.DataFrame):
+        columns = {key: columns.loc[:, key] for key in columns.columns}
+    blocks = [column_values(x) for x in columns.values()]
+    lengths = set(len(x) for x in blocks)
+    if len(lengths) > 1:
+        raise ValueError(f'Columns of {path} have different lengths: {sorted(lengths)}')
+    write_rows(path, zip(*blocks), header = list(columns.keys()), append = append)
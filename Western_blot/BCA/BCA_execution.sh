@@ -1,9 +1,9 @@
 #!/bin/bash
 
-python Submodules/BCA-Assay/BCA_assay.py \
--s Western_blot/BCA/standards_data.xlsx \
--u Western_blot/BCA/unknown_data_subset.xlsx \
+python Western_blot/BCA/BCA_quantitation.py \
+-f Western_blot/BCA/BCA_data.csv \
+-s Western_blot/BCA/Plating_scheme.csv \
+-u Western_blot/BCA/unknown_data_subset.csv \
 -p 10.0 \
--a \
--f 2.5 \
+-x 2.5 \
 -o Western_blot/BCA/bca_output_rep1.csv
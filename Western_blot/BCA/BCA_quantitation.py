@@ -0,0 +1,324 @@
+import os
+import sys
+import re
+import argparse
+import numpy as np
+import pandas as pd
+import Calculate_optimal_samples as cos
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from Utilities import Table_io as tio
+
+# Pierce BCA albumin standards (microgram/mL), keyed by the letter in the Standard_<letter> plate labels
+STANDARD_CONCENTRATIONS = {
+    'A': 2000.0,
+    'B': 1500.0,
+    'C': 1000.0,
+    'D': 750.0,
+    'E': 500.0,
+    'F': 250.0,
+    'G': 125.0,
+    'H': 25.0,
+    'I': 0.0
+    }
+
+STANDARD_REGEX = re.compile(r'^Standard_([A-Z])$')
+CURVE_MODELS = ['linear', 'quadratic', '4pl']
+REDUCING_AGENT_FRACTION = 0.1
+SAMPLE_BUFFER_FRACTION = 0.25
+
+
+def standard_design(plate_index: cos.PlateIndex, standard_concentrations: dict = None) -> tuple[np.ndarray, np.ndarray]:
+    # One row per standard present on the layout, ordered by concentration, marking its replicate wells
+    if standard_concentrations is None:
+        standard_concentrations = STANDARD_CONCENTRATIONS
+    standard_keys = {}
+    for label in plate_index.labels:
+        standard_match = STANDARD_REGEX.match(label)
+        if standard_match is not None and standard_match.group(1) in standard_concentrations:
+            standard_keys[label] = standard_concentrations[standard_match.group(1)]
+    if len(standard_keys) < 2:
+        raise ValueError('The plating scheme needs at least two Standard_<letter> wells to fit a standard curve')
+    standard_labels = sorted(standard_keys, key = lambda x: standard_keys[x])
+    concentrations = np.array([standard_keys[x] for x in standard_labels])
+    standard_mask = np.stack([plate_index.well_labels == x for x in standard_labels]).astype(float)
+    return concentrations, standard_mask
+
+def standard_responses(well_values: np.ndarray, standard_mask: np.ndarray) -> np.ndarray:
+    # Replicate wells are averaged with one matrix product for every plate in the stack
+    well_values = np.atleast_2d(well_values)
+    return (well_values @ standard_mask.T) / standard_mask.sum(axis = 1)
+
+def blank_correct(responses: np.ndarray, concentrations: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    blank_indices = np.flatnonzero(concentrations == 0)
+    if len(blank_indices) == 0:
+        return responses, np.zeros(responses.shape[0])
+    blanks = responses[:, blank_indices].mean(axis = 1)
+    return responses - blanks[:, np.newaxis], blanks
+
+def fit_polynomial(concentrations: np.ndarray, responses: np.ndarray, degree: int) -> np.ndarray:
+    # Every plate shares the same design matrix, so a single lstsq call fits them all
+    design_matrix = np.vander(concentrations, degree + 1)
+    coefficients, _, _, _ = np.linalg.lstsq(design_matrix, responses.T, rcond = None)
+    return coefficients.T
+
+def four_parameter_logistic(params: np.ndarray, concentrations: np.ndarray) -> np.ndarray:
+    # params columns: response at zero, response at saturation, log midpoint, Hill slope
+    zero_response, max_response, log_midpoint, hill_slope = [params[:, i, np.newaxis] for i in range(4)]
+    ratio = np.power(concentrations / np.exp(log_midpoint), hill_slope)
+    return max_response + (zero_response - max_response) / (1.0 + ratio)
+
+def four_parameter_jacobian(params: np.ndarray, concentrations: np.ndarray) -> np.ndarray:
+    zero_response, max_response, log_midpoint, hill_slope = [params[:, i, np.newaxis] for i in range(4)]
+    ratio = np.power(concentrations / np.exp(log_midpoint), hill_slope)
+    inverse = 1.0 / (1.0 + ratio)
+    log_ratio = np.where(concentrations > 0, np.log(np.where(concentrations > 0, concentrations, 1.0)) - log_midpoint, 0.0)
+    scale = (zero_response - max_response) * inverse ** 2 * ratio
+    return np.stack([inverse, 1.0 - inverse, scale * hill_slope, -scale * log_ratio], axis = -1)
+
+def fit_four_parameter_logistic(concentrations: np.ndarray, responses: np.ndarray, iterations: int = 500) -> np.ndarray:
+    # Levenberg-Marquardt run on all plates at once; each plate keeps its own damping
+    number_of_plates = responses.shape[0]
+    params = np.column_stack([
+        responses[:, 0],
+        2.0 * responses[:, -1] - responses[:, 0],
+        np.full(number_of_plates, np.log(concentrations.max())),
+        np.ones(number_of_plates)
+        ])
+    damping = np.full(number_of_plates, 1e-3)
+    residuals = responses - four_parameter_logistic(params, concentrations)
+    sum_of_squares = (residuals ** 2).sum(axis = 1)
+    for _ in range(iterations):
+        jacobian = four_parameter_jacobian(params, concentrations)
+        normal_matrix = jacobian.transpose(0, 2, 1) @ jacobian
+        gradient = (jacobian.transpose(0, 2, 1) @ residuals[..., np.newaxis])[..., 0]
+        damped_matrix = normal_matrix + damping[:, np.newaxis, np.newaxis] * np.eye(4) * np.diagonal(normal_matrix, axis1 = 1, axis2 = 2)[:, np.newaxis, :]
+        step = np.linalg.solve(damped_matrix + 1e-12 * np.eye(4), gradient[..., np.newaxis])[..., 0]
+        trial_params = params + step
+        trial_residuals = responses - four_parameter_logistic(trial_params, concentrations)
+        trial_sum_of_squares = (trial_residuals ** 2).sum(axis = 1)
+        improved = np.isfinite(trial_sum_of_squares) & (trial_sum_of_squares < sum_of_squares)
+        params = np.where(improved[:, np.newaxis], trial_params, params)
+        residuals = np.where(improved[:, np.newaxis], trial_residuals, residuals)
+        sum_of_squares = np.where(improved, trial_sum_of_squares, sum_of_squares)
+        damping = np.clip(np.where(improved, damping / 10.0, damping * 10.0), 1e-12, 1e12)
+    return params
+
+def fit_standard_curves(concentrations: np.ndarray, responses: np.ndarray, model: str = 'linear') -> np.ndarray:
+    responses = np.atleast_2d(responses)
+    if model == 'linear':
+        return fit_polynomial(concentrations, responses, degree = 1)
+    if model == 'quadratic':
+        return fit_polynomial(concentrations, responses, degree = 2)
+    if model == '4pl':
+        return fit_four_parameter_logistic(concentrations, responses)
+    raise ValueError(f'{model} is not one of {CURVE_MODELS}')
+
+def predict_responses(params: np.ndarray, concentrations: np.ndarray, model: str = 'linear') -> np.ndarray:
+    if model == '4pl':
+        return four_parameter_logistic(params, concentrations)
+    return params @ np.vander(concentrations, params.shape[1]).T
+
+def invert_curves(params: np.ndarray, absorbances: np.ndarray, model: str = 'linear') -> np.ndarray:
+    # Absorbances are (plates, unknowns); readings outside a curve's range come back as NaN
+    absorbances = np.atleast_2d(absorbances)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        if model == 'linear':
+            return (absorbances - params[:, 1, np.newaxis]) / params[:, 0, np.newaxis]
+        if model == 'quadratic':
+            # Root on the rising branch, in the conjugate form that stays finite as the curvature goes to zero
+            quadratic, linear, intercept = [params[:, i, np.newaxis] for i in range(3)]
+            offset = absorbances - intercept
+            return 2.0 * offset / (linear + np.sqrt(linear ** 2 + 4.0 * quadratic * offset))
+        if model == '4pl':
+            zero_response, max_response, log_midpoint, hill_slope = [params[:, i, np.newaxis] for i in range(4)]
+            return np.exp(log_midpoint) * np.power((zero_response - max_response) / (absorbances - max_response) - 1.0, 1.0 / hill_slope)
+    raise ValueError(f'{model} is not one of {CURVE_MODELS}')
+
+def r_squared(responses: np.ndarray, fitted_responses: np.ndarray) -> np.ndarray:
+    residual_sum = ((responses - fitted_responses) ** 2).sum(axis = 1)
+    total_sum = ((responses - responses.mean(axis = 1, keepdims = True)) ** 2).sum(axis = 1)
+    return 1.0 - residual_sum / total_sum
+
+def quantify_plates(
+    well_values: np.ndarray, plate_index: cos.PlateIndex, sample_labels: list, model: str = 'linear',
+    standard_concentrations: dict = None, blank_unknowns: bool = False
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Standards are blank-corrected before fitting; unknowns are read as measured unless blank_unknowns is set,
+        # which is how the existing bca_output tables were produced
+        well_values = np.atleast_2d(well_values)
+        concentrations, standard_mask = standard_design(plate_index, standard_concentrations)
+        responses, blanks = blank_correct(standard_responses(well_values, standard_mask), concentrations)
+        params = fit_standard_curves(concentrations, responses, model = model)
+        fit_quality = r_squared(responses, predict_responses(params, concentrations, model = model))
+        sample_wells = np.array([np.flatnonzero(plate_index.well_labels == x)[0] for x in sample_labels], dtype = int)
+        absorbances = well_values[:, sample_wells]
+        if blank_unknowns is True:
+            absorbances = absorbances - blanks[:, np.newaxis]
+        return invert_curves(params, absorbances, model = model), fit_quality, params
+
+def master_mix_table(
+    sample_labels: list, protein_concentrations: np.ndarray, total_protein: float = 10.0,
+    master_mix_factor: float = 1.0, total_volume: float = None
+    ) -> tuple[pd.DataFrame, float]:
+        # Volumes are microliters per lane scaled by the master-mix factor; by default the lane volume is
+        # set by the most dilute sample so it can still be loaded without water
+        protein_volumes = total_protein / np.asarray(protein_concentrations, dtype = float) * 1000.0
+        if total_volume is None:
+            total_volume = np.max(protein_volumes) / (1.0 - REDUCING_AGENT_FRACTION - SAMPLE_BUFFER_FRACTION)
+        reducing_agent = np.full(len(sample_labels), REDUCING_AGENT_FRACTION * total_volume * master_mix_factor)
+        sample_buffer = np.full(len(sample_labels), SAMPLE_BUFFER_FRACTION * total_volume * master_mix_factor)
+        protein = protein_volumes * master_mix_factor
+        water = np.maximum(total_volume * master_mix_factor - protein - reducing_agent - sample_buffer, 0.0)
+        master_mix = pd.DataFrame({
+            'Sample': list(sample_labels),
+            'Protein': protein,
+            'Reducing Agent': reducing_agent,
+            'Sample Buffer': sample_buffer,
+            'DI Water': water
+            })
+        return master_mix, float(total_volume)
+
+def write_bca_output(
+    output_path: str, master_mix: pd.DataFrame, protein_concentrations: np.ndarray, fit_quality: float,
+    total_protein: float, total_volume: float, master_mix_factor: float
+    ):
+        # Same layout as the bca_output*.csv tables already in this directory
+        lines = [f'Gel Loading Master Mixes ({master_mix_factor}x microliters)', '', '', ','.join(master_mix.columns)]
+        for row in master_mix.itertuples(index = False):
+            lines.append(','.join([str(row[0])] + [str(float(x)) for x in row[1:]]))
+        lines.extend(['', '', f'Total Protein:,{float(total_protein)}', f'Total Volume:,{float(total_volume)}', '', ''])
+        lines.append('Protein Concentration (microgram/mL):')
+        lines.append(''.join([f'{float(x)},' for x in protein_concentrations]))
+        lines.extend(['', '', f'Rsquared:,{float(fit_quality)}'])
+        with open(output_path, 'w', encoding = 'UTF-8') as output_file:
+            output_file.write('\n'.join(lines))
+
+def read_sample_labels(unknowns_path: str) -> list:
+    # Only the sample columns are taken from an unknowns table; absorbances always come from the plate read
+    return [x for x in tio.read_columns(unknowns_path) if x != 'Replicate']
+
+def main(
+    absorbance_filepath: str, sample_filepath: str, output_path: str, unknowns_path: str = None, model: str = 'linear',
+    total_protein: float = 10.0, master_mix_factor: float = 1.0, total_volume: float = None,
+    max_keys: list = None, blank_unknowns: bool = False
+    ) -> pd.DataFrame:
+        raw_data = tio.read_plate(absorbance_filepath)
+        sample_keys = tio.read_layout(sample_filepath)
+        bca_data = cos.BCAdata(raw_data, sample_keys)
+        if unknowns_path is None:
+            sample_labels = bca_data.main_calculations(sample_regexs = [re.compile(x) for x in cos.SAMPLE_REGEXS], max_keys = max_keys)
+            sample_labels = [x for x in sample_labels if x is not None]
+        else:
+            sample_labels = read_sample_labels(unknowns_path)
+        protein_concentrations, fit_quality, _ = quantify_plates(
+            well_values = bca_data.well_values,
+            plate_index = bca_data.plate_index,
+            sample_labels = sample_labels,
+            model = model,
+            blank_unknowns = blank_unknowns
+            )
+        master_mix, total_volume = master_mix_table(
+            sample_labels = sample_labels,
+            protein_concentrations = protein_concentrations[0],
+            total_protein = total_protein,
+            master_mix_factor = master_mix_factor,
+            total_volume = total_volume
+            )
+        write_bca_output(
+            output_path = output_path,
+            master_mix = master_mix,
+            protein_concentrations = protein_concentrations[0],
+            fit_quality = fit_quality[0],
+            total_protein = total_protein,
+            total_volume = total_volume,
+            master_mix_factor = master_mix_factor
+            )
+        print(f'{model} standard curve R-squared: {fit_quality[0]}')
+        return master_mix
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-f',
+        '--filepath',
+        default = 'Western_blot/BCA/BCA_data.csv',
+        help = 'Path to raw BCA plate read'
+        )
+
+    parser.add_argument(
+        '-s',
+        '--sample_key',
+        default = 'Western_blot/BCA/Plating_scheme.csv',
+        help = 'Path to plating scheme for standards and samples'
+        )
+
+    parser.add_argument(
+        '-u',
+        '--unknowns',
+        default = None,
+        help = 'Optional unknowns table whose sample columns select the samples to quantify (defaults to the optimal dilutions)'
+        )
+
+    parser.add_argument(
+        '-c',
+        '--curve',
+        default = 'linear',
+        choices = CURVE_MODELS,
+        help = 'Standard curve model'
+        )
+
+    parser.add_argument(
+        '-p',
+        '--total_protein',
+        default = 10.0,
+        type = float,
+        help = 'Micrograms of protein loaded per lane'
+        )
+
+    parser.add_argument(
+        '-x',
+        '--master_mix_factor',
+        default = 1.0,
+        type = float,
+        help = 'Multiplier applied to every per-lane volume in the master mixes'
+        )
+
+    parser.add_argument(
+        '-v',
+        '--total_volume',
+        default = None,
+        type = float,
+        help = 'Per-lane volume in microliters (defaults to the smallest volume that fits the most dilute sample)'
+        )
+
+    parser.add_argument(
+        '-b',
+        '--blank_unknowns',
+        action = 'store_true',
+        help = 'Subtract the zero standard from the unknowns as well as the standards'
+        )
+
+    parser.add_argument(
+        '-o',
+        '--output_path',
+        default = 'Western_blot/BCA/bca_output.csv',
+        help = 'Output path for the master-mix table'
+        )
+
+    args = parser.parse_args()
+
+    main(
+        absorbance_filepath = args.filepath,
+        sample_filepath = args.sample_key,
+        output_path = args.output_path,
+        unknowns_path = args.unknowns,
+        model = args.curve,
+        total_protein = args.total_protein,
+        master_mix_factor = args.master_mix_factor,
+        total_volume = args.total_volume,
+        blank_unknowns = args.blank_unknowns
+        )
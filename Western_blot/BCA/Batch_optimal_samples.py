@@ -0,0 +1,202 @@
+import os
+import sys
+import re
+import glob
+import argparse
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import Calculate_optimal_samples as cos
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from Utilities import Table_io as tio
+
+LAYOUT_SUFFIX = '_Plating_scheme.csv'
+# Plate reads in a directory are named BCA_data*.<ext> (BCA_data.csv, BCA_data_plate2.csv, ...); workbooks, outputs
+# and standards kept beside them are skipped
+PLATE_GLOB = 'BCA_data*'
+OUTPUT_COLUMNS = ['Plate', 'Layout', 'Sample', 'Optimal_sample', 'Dilution', 'Absorbance', 'Max_absorbance']
+
+_layout_cache = {}
+
+
+def discover_plates(plate_pattern: str, layout_suffix: str = LAYOUT_SUFFIX, plate_glob: str = PLATE_GLOB) -> list[str]:
+    if os.path.isdir(plate_pattern):
+        plate_paths = sorted([x for x in glob.glob(os.path.join(plate_pattern, plate_glob)) if os.path.splitext(x)[1] in tio.TABLE_FORMATS])
+    else:
+        plate_paths = sorted(glob.glob(plate_pattern))
+    return [x for x in plate_paths if not os.path.splitext(x)[0].endswith(os.path.splitext(layout_suffix)[0]) and os.path.splitext(os.path.basename(x))[0] != 'Plating_scheme']
+
+def layout_for_plate(plate_path: str, default_layout: str, layout_suffix: str = LAYOUT_SUFFIX) -> str:
+    # A plate read can carry its own layout as <plate>_Plating_scheme.<ext> next to it, in any table format
+    layout_stem = os.path.splitext(plate_path)[0] + os.path.splitext(layout_suffix)[0]
+    for extension in tio.TABLE_FORMATS:
+        if os.path.exists(layout_stem + extension):
+            return layout_stem + extension
+    return default_layout
+
+def layout_index(layout_path: str, sample_regexs: list[str]):
+    # Each worker parses a layout and matches the sample regexes against it once, however many plates use it
+    if layout_path not in _layout_cache:
+        sample_keys = tio.read_layout(layout_path)
+        plate_index = cos.PlateIndex(sample_keys)
+        sample_mask = plate_index.regex_mask([re.compile(x) for x in sample_regexs])
+        _layout_cache[layout_path] = (plate_index, sample_mask)
+    return _layout_cache[layout_path]
+
+def read_plate(plate_path: str, plate_index: cos.PlateIndex, max_keys: list) -> tuple[np.ndarray, float]:
+    plate_data = tio.read_plate(plate_path)
+    row_entries = [max_keys[0][0], max_keys[1][0]]
+    col_entries = [max_keys[0][1], max_keys[1][1]]
+    max_value = np.mean(plate_data.loc[row_entries, col_entries].to_numpy())
+    return plate_index.well_values(plate_data), max_value
+
+def optimal_samples_job(job: dict) -> pd.DataFrame:
+    plate_index, sample_mask = layout_index(job['layout_path'], job['sample_regexs'])
+    plate_reads = [read_plate(x, plate_index, job['max_keys']) for x in job['plate_paths']]
+    well_values = np.stack([x[0] for x in plate_reads])
+    max_values = np.array([x[1] for x in plate_reads])
+    # One masked argmax over the whole (plates, samples, wells) stack
+    optimal_indices = plate_index.optimal_wells(well_values, sample_mask, max_values[:, np.newaxis, np.newaxis])
+    plate_numbers, sample_numbers = np.nonzero(optimal_indices >= 0)
+    well_indices = optimal_indices[plate_numbers, sample_numbers]
+    return pd.DataFrame({
+        'Plate': np.array(job['plate_paths'], dtype = object)[plate_numbers],
+        'Layout': job['layout_path'],
+        'Sample': np.array(job['sample_regexs'], dtype = object)[sample_numbers],
+        'Optimal_sample': plate_index.well_labels[well_indices],
+        'Dilution': plate_index.well_dilutions[well_indices],
+        'Absorbance': well_values[plate_numbers, well_indices],
+        'Max_absorbance': max_values[plate_numbers]
+        }, columns = OUTPUT_COLUMNS)
+
+class StreamingTableWriter:
+
+    def __init__(self, output_path: str, columns: list = OUTPUT_COLUMNS):
+        self.output_path = output_path
+        self.file_format = os.path.splitext(output_path)[1].lstrip('.').lower()
+        if self.file_format not in ['csv', 'parquet']:
+            raise ValueError(f'Cannot stream rows to {output_path}; use a .csv or .parquet output')
+        self.columns = columns
+        self.rows_written = 0
+        self.parquet_writer = None
+        if self.file_format == 'csv':
+            pd.DataFrame(columns = columns).to_csv(output_path, index = False)
+        else:
+            if importlib.util.find_spec('pyarrow') is None:
+                raise ImportError('Streaming to .parquet requires pyarrow; install it or write a .csv instead')
+
+    def write(self, table: pd.DataFrame):
+        if len(table) == 0:
+            return
+        if self.file_format == 'csv':
+            table.to_csv(self.output_path, mode = 'a', header = False, index = False)
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            arrow_table = pa.Table.from_pandas(table, preserve_index = False)
+            if self.parquet_writer is None:
+                self.parquet_writer = pq.ParquetWriter(self.output_path, arrow_table.schema)
+            self.parquet_writer.write_table(arrow_table)
+        self.rows_written += len(table)
+
+    def close(self):
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def main(
+    plate_pattern: str, layout_path: str, output_path: str, sample_regexs: list[str] = None,
+    max_keys: list = None, chunk_size: int = 16, processes: int = None, plate_glob: str = PLATE_GLOB
+    ) -> int:
+        if sample_regexs is None:
+            sample_regexs = cos.SAMPLE_REGEXS
+        if max_keys is None:
+            max_keys = [['A', '9'], ['B', '9']]
+        plate_paths = discover_plates(plate_pattern, plate_glob = plate_glob)
+        if len(plate_paths) == 0:
+            raise FileNotFoundError(f'No plate reads were found for {plate_pattern}')
+        # Plates sharing a layout are stacked into chunks so each job is one vectorized pass
+        plates_by_layout = {}
+        for plate_path in plate_paths:
+            plates_by_layout.setdefault(layout_for_plate(plate_path, layout_path), []).append(plate_path)
+        jobs = []
+        for plate_layout, layout_plates in plates_by_layout.items():
+            for i in range(0, len(layout_plates), chunk_size):
+                jobs.append({
+                    'layout_path': plate_layout,
+                    'plate_paths': layout_plates[i:i + chunk_size],
+                    'sample_regexs': list(sample_regexs),
+                    'max_keys': max_keys
+                    })
+        with StreamingTableWriter(output_path) as writer, ProcessPoolExecutor(max_workers = processes) as executor:
+            for chunk_results in executor.map(optimal_samples_job, jobs):
+                writer.write(chunk_results)
+        print(f'Wrote {writer.rows_written} optimal samples from {len(plate_paths)} plates into {output_path}')
+        return writer.rows_written
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-f',
+        '--plates',
+        default = 'Western_blot/BCA/BCA_data.csv',
+        help = 'Directory or glob of raw BCA plate reads'
+        )
+
+    parser.add_argument(
+        '-g',
+        '--plate_glob',
+        default = PLATE_GLOB,
+        help = 'Names of the plate reads when --plates is a directory'
+        )
+
+    parser.add_argument(
+        '-s',
+        '--sample_key',
+        default = 'Western_blot/BCA/Plating_scheme.csv',
+        help = f'Plating scheme shared by plates without their own <plate>{LAYOUT_SUFFIX}'
+        )
+
+    parser.add_argument(
+        '-o',
+        '--output_path',
+        default = 'Western_blot/BCA/optimal_samples.csv',
+        help = 'Output path for the streamed optimal-sample rows (.csv or .parquet)'
+        )
+
+    parser.add_argument(
+        '-c',
+        '--chunk_size',
+        default = 16,
+        type = int,
+        help = 'Number of plates stacked into each job'
+        )
+
+    parser.add_argument(
+        '-p',
+        '--processes',
+        default = None,
+        type = int,
+        help = 'Number of worker processes (defaults to all cores)'
+        )
+
+    args = parser.parse_args()
+
+    main(
+        plate_pattern = args.plates,
+        layout_path = args.sample_key,
+        output_path = args.output_path,
+        chunk_size = args.chunk_size,
+        processes = args.processes,
+        plate_glob = args.plate_glob
+        )
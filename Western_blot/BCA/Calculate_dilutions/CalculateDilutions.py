@@ -1,155 +1,66 @@
+import os
+import sys
 import argparse
-
-class csv_mapper:
-
-    def __init__(self, dictionary):
-        self.dictionary = dictionary
-
-    def write_to_csv(self, filename):
-        columns = list(self.dictionary.keys())
-        tsv_file = open(filename, 'w')
-        for i in range(len(self.dictionary[columns[0]]) + 1):
-            for t in range(len(columns)):
-                if i == 0:
-                    if t == (len(columns) - 1):
-                        tsv_file.write(str(columns[t]))
-                    else:
-                        tsv_file.write(str(columns[t]) + ',')
-                else:
-                    if t == (len(columns) - 1):
-                        tsv_file.write(self.dictionary[columns[t]][i - 1])
-                    else:
-                        tsv_file.write(self.dictionary[columns[t]][i - 1] + ',')
-            tsv_file.write('\n')
-
-class solution:
-    
-    def __init__(
-        self,
-        concentration,
-        volume
-        ):
-            self.concentration = concentration
-            self.volume = volume
-            
-def solution_list_maker(concentrations):
-    lst_of_solutions = []
-    for i in range(0, len(concentrations)):
-        lst_of_solutions.append(solution(
-            concentrations[i],
-            0
-            ))
-    return lst_of_solutions
-            
-def volume_calculator(
-    conc_1,
-    conc_2,
-    final_volume
-    ):
-        vol_to_add = (conc_2 * final_volume) / conc_1
-        return vol_to_add
-    
-def volume_of_solvent_calculator(
-    solution_1,
-    solution_2
-    ):
-        volume_of_solvent = solution_2.volume * (1 - (solution_2.concentration / solution_1.concentration))
-        return volume_of_solvent
-
-def dilution_calculator(
-    lst_of_solutions,
-    desired_volume = 100
-    ):
-        lst_of_solutions = sorted(
-            lst_of_solutions,
-            key = lambda x: x.concentration
-            )
-        for i in range(0, len(lst_of_solutions)):
-            if i == 0:
-                lst_of_solutions[i].volume = desired_volume
-            else:
-                volume_of_concentrate = volume_calculator(
-                    lst_of_solutions[i].concentration,
-                    lst_of_solutions[i - 1].concentration,
-                    lst_of_solutions[i - 1].volume
-                    )
-                lst_of_solutions[i].volume = desired_volume + volume_of_concentrate
-        return lst_of_solutions
-        
-def solution_display(
-    lst_of_sols,
-    stock_concentration
-    ):
-        for i in range(0, len(lst_of_sols)):
-            if i < len(lst_of_sols) - 1:
-                print(
-                    'Concentration: ' + str(lst_of_sols[i].concentration) + 
-                    '    Total volume: ' + str(lst_of_sols[i].volume) + 
-                    '    Volume of previous stock: ' + str(volume_calculator(
-                        lst_of_sols[i + 1].concentration,
-                        lst_of_sols[i].concentration,
-                        lst_of_sols[i].volume
-                        )) +
-                    '    Volume of solvent: ' + str(volume_of_solvent_calculator(
-                        lst_of_sols[i + 1],
-                        lst_of_sols[i]
-                        ))
-                    )
-            else:
-                print('Concentration: ' + str(lst_of_sols[i].concentration) + 
-                    '    Total volume: ' + str(lst_of_sols[i].volume) +
-                    '    Volume of previous stock: ' + str(volume_calculator(
-                        stock_concentration,
-                        lst_of_sols[i].concentration,
-                        lst_of_sols[i].volume
-                        )) +
-                    '    Volume of solvent: ' + str(volume_of_solvent_calculator(
-                        solution(
-                            stock_concentration,
-                            0
-                            ),
-                        lst_of_sols[i]
-                        ))
-                    )
-                
-def output_table_to_csv(
-    lst_of_solutions,
-    stock_concentration,
-    output_file = 'Table_of_solutions_output.csv'
-    ):
-        lst_of_solutions.reverse()
-        output_dict = {}
-        for i in range(len(lst_of_solutions)):
-            if i == 0:
-                output_dict['Concentration'] = [str(lst_of_solutions[i].concentration)]
-                output_dict['Volume of previous stock'] = [str(volume_calculator(
-                    conc_1 = stock_concentration,
-                    conc_2 = lst_of_solutions[i].concentration,
-                    final_volume = lst_of_solutions[i].volume
-                    ))]
-                output_dict['Volume of solvent'] = [str(volume_of_solvent_calculator(
-                    solution(
-                        concentration = stock_concentration,
-                        volume = 0
-                        ),
-                    lst_of_solutions[i]
-                    ))]
-                output_dict['Total volume'] = [str(lst_of_solutions[i].volume)]
-            else:
-                output_dict['Concentration'].append(str(lst_of_solutions[i].concentration))
-                output_dict['Volume of previous stock'].append(str(volume_calculator(
-                    conc_1 = lst_of_solutions[i - 1].concentration,
-                    conc_2 = lst_of_solutions[i].concentration,
-                    final_volume = lst_of_solutions[i].volume
-                    )))
-                output_dict['Volume of solvent'].append(str(volume_of_solvent_calculator(
-                    lst_of_solutions[i - 1],
-                    lst_of_solutions[i]
-                    )))
-                output_dict['Total volume'].append(str(lst_of_solutions[i].volume))
-        csv_class = csv_mapper(output_dict)
-        csv_class.write_to_csv(output_file)
-
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+from Utilities import Tabular_writer as tw
+
+
+def dilution_series(concentrations) -> np.ndarray:
+    # One row per series in ascending concentration; shorter series are padded with NaN at the end
+    concentrations = np.atleast_2d(np.asarray(concentrations, dtype = float))
+    if np.any(concentrations <= 0):
+        raise ValueError('Dilution concentrations must be positive')
+    return np.sort(concentrations, axis = 1)
+
+def plan_dilutions(concentrations, stock_concentrations = 1.0, final_volumes = 100.0) -> dict:
+    # Each solution keeps final_volume for use and hands the rest to the next, more dilute one, so the solute
+    # in solution i is final_volume * (c_0 + ... + c_i) and every total volume follows from one cumulative sum
+    concentrations = dilution_series(concentrations)
+    number_of_series = concentrations.shape[0]
+    stock_concentrations = np.broadcast_to(np.asarray(stock_concentrations, dtype = float), (number_of_series,))
+    final_volumes = np.broadcast_to(np.asarray(final_volumes, dtype = float), (number_of_series,))
+    if np.any(np.nanmax(concentrations, axis = 1) > stock_concentrations):
+        raise ValueError('Dilutions cannot be more concentrated than their stock')
+    total_volumes = final_volumes[:, np.newaxis] * np.nancumsum(concentrations, axis = 1) / concentrations
+    # Each solution is made from the next more concentrated one, and the most concentrated from the stock
+    parent_concentrations = np.concatenate([concentrations[:, 1:], np.full((number_of_series, 1), np.nan)], axis = 1)
+    parent_concentrations = np.where(np.isnan(parent_concentrations), stock_concentrations[:, np.newaxis], parent_concentrations)
+    carry_over_volumes = total_volumes * concentrations / parent_concentrations
+    return {
+        'Concentration': concentrations,
+        'Volume of previous stock': carry_over_volumes,
+        'Volume of solvent': total_volumes - carry_over_volumes,
+        'Total volume': total_volumes
+        }
+
+def plan_table(concentrations, stock_concentrations = 1.0, final_volumes = 100.0, series_labels: list = None) -> pd.DataFrame:
+    # Columnar plan, most concentrated step first within each series as it is pipetted
+    plan = plan_dilutions(concentrations, stock_concentrations = stock_concentrations, final_volumes = final_volumes)
+    steps = {key: values[:, ::-1] for key, values in plan.items()}
+    valid = ~np.isnan(steps['Concentration'])
+    table = pd.DataFrame({key: values[valid] for key, values in steps.items()})
+    if series_labels is not None:
+        series_index = np.broadcast_to(np.arange(valid.shape[0])[:, np.newaxis], valid.shape)[valid]
+        table.insert(0, 'Series', np.asarray(series_labels, dtype = object)[series_index])
+    return table
+
+def read_series_table(path: str, stock_concentration: float = 1.0, final_volume: float = 100.0) -> tuple:
+    # Long table of Series and Concentration, with optional per-series Stock_concentration and Final_volume columns
+    series_table = pd.read_csv(path)
+    codes, series_labels = pd.factorize(series_table.loc[:, 'Series'])
+    positions = series_table.groupby(codes).cumcount().to_numpy()
+    concentrations = np.full((len(series_labels), positions.max() + 1), np.nan)
+    concentrations[codes, positions] = series_table.loc[:, 'Concentration'].to_numpy(dtype = float)
+    per_series = series_table.groupby(codes).first()
+    stock_concentrations = per_series['Stock_concentration'].to_numpy(dtype = float) if 'Stock_concentration' in per_series else stock_concentration
+    final_volumes = per_series['Final_volume'].to_numpy(dtype = float) if 'Final_volume' in per_series else final_volume
+    return list(series_labels), concentrations, stock_concentrations, final_volumes
+
+def write_plan(plan: pd.DataFrame, output_path: str, append: bool = False):
+    tw.write_columns(output_path, plan, append = append)
 
 
 if __name__ == '__main__':
@@ -168,8 +79,24 @@ if __name__ == '__main__':
         '-d',
         '--dilutions',
         default = [0.5, 0.2],
-        type = list,
-        help = 'List of dilutions desired'
+        nargs = '+',
+        type = float,
+        help = 'Dilutions desired, as fractions of the stock concentration'
+        )
+
+    parser.add_argument(
+        '-s',
+        '--stock_concentration',
+        default = 1.0,
+        type = float,
+        help = 'Concentration of the stock the series starts from'
+        )
+
+    parser.add_argument(
+        '-b',
+        '--batch_table',
+        default = None,
+        help = 'Plan many series at once from a .csv with Series and Concentration columns (optionally Stock_concentration and Final_volume per series)'
         )
     
     parser.add_argument(
@@ -178,25 +105,33 @@ if __name__ == '__main__':
         default = './Western_blot/BCA/Calculate_dilutions/Serial_dilutions.csv'
         )
 
-    args = parser.parse_args()
-
-    dilutions = args.dilutions
-
-    for dilution in dilutions:
-        if not isinstance(dilution, float):
-            raise TypeError(f'{dilution} must be of dtype float')
+    parser.add_argument(
+        '-a',
+        '--append',
+        action = 'store_true',
+        help = 'Append the plan to an existing output with the same columns instead of overwriting it'
+        )
 
-    lst_of_sols = solution_list_maker(dilutions)
+    args = parser.parse_args()
 
-    # Calculate necessary volumes for serial dilutions
-    lst_of_sols = dilution_calculator(
-        lst_of_sols,
-        desired_volume = args.limiting_vol
-        )
+    if args.batch_table is None:
+        plan = plan_table(
+            args.dilutions,
+            stock_concentrations = args.stock_concentration,
+            final_volumes = args.limiting_vol
+            )
+    else:
+        series_labels, concentrations, stock_concentrations, final_volumes = read_series_table(
+            args.batch_table,
+            stock_concentration = args.stock_concentration,
+            final_volume = args.limiting_vol
+            )
+        plan = plan_table(
+            concentrations,
+            stock_concentrations = stock_concentrations,
+            final_volumes = final_volumes,
+            series_labels = series_labels
+            )
 
     # Writing to .csv file
-    output_table_to_csv(
-        lst_of_solutions = lst_of_sols,
-        stock_concentration = 1.0,
-        output_file = args.output_path
-        )
+    write_plan(plan, args.output_path, append = args.append)
@@ -0,0 +1,268 @@
+import os
+import sys
+import argparse
+from itertools import product
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
+from Utilities import Tabular_writer as tw
+
+# Candidate schemes grow as k! with the number of targets; 6 targets (720 schemes) still plan hundreds of samples
+# in well under a second
+MAX_TARGETS = 6
+STOCK = -1
+VOLUME_TOLERANCE = 1e-9
+# Volume retained in the tip on every aspiration, in the units of the other volumes
+DEFAULT_TRANSFER_LOSS = 0.5
+# Samples are evaluated in chunks of at most this many sample x scheme x target volumes (8 MB per float64 array)
+MAX_CHUNK_ELEMENTS = 2 ** 20
+
+
+def candidate_schemes(number_of_targets: int) -> np.ndarray:
+    # Targets are ordered most concentrated first; each is made from the stock (-1) or from any more
+    # concentrated target, which spans fully parallel, fully serial and every branching in between
+    if number_of_targets > MAX_TARGETS:
+        raise ValueError(f'At most {MAX_TARGETS} target concentrations can be optimized at once')
+    return np.array(list(product(*[range(STOCK, j) for j in range(number_of_targets)])), dtype = int).reshape(-1, number_of_targets)
+
+def scheme_depths(schemes: np.ndarray) -> np.ndarray:
+    # Longest chain of transfers from the stock in each scheme
+    depths = np.zeros(schemes.shape, dtype = int)
+    for j in range(schemes.shape[1]):
+        parents = schemes[:, j]
+        depths[:, j] = np.where(parents == STOCK, 1, np.take_along_axis(depths, np.maximum(parents, 0)[:, np.newaxis], axis = 1)[:, 0] + 1)
+    return depths.max(axis = 1)
+
+def aspirations(volumes: np.ndarray, max_volume: float) -> np.ndarray:
+    # Volumes above the largest pipette take several aspirations; nothing is pipetted for a zero volume
+    return np.where(volumes > VOLUME_TOLERANCE, np.ceil(volumes / max_volume - VOLUME_TOLERANCE), 0.0)
+
+def evaluate_schemes(
+    stock_concentrations: np.ndarray, targets: np.ndarray, schemes: np.ndarray, final_volumes: np.ndarray,
+    dead_volume: float = 0.0, transfer_loss: float = DEFAULT_TRANSFER_LOSS, max_volume: float = np.inf
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        # Volumes for every sample x scheme x target at once; targets is samples x targets. Each tube keeps its
+        # final volume and dead volume and supplies what its children draw: their source volume plus the
+        # transfer loss of every aspiration. Every scheme makes the same tubes, so without losses all of them
+        # would use the same stock; a loss drawn from a dilute parent costs less stock than one drawn from the
+        # stock, which is what serial chains save.
+        number_of_samples, number_of_targets = targets.shape
+        shape = (number_of_samples, len(schemes), number_of_targets)
+        total_volumes = np.zeros(shape)
+        source_volumes = np.zeros(shape)
+        drawn_volumes = np.zeros(shape)
+        source_concentrations = np.where(
+            schemes == STOCK,
+            stock_concentrations[:, np.newaxis, np.newaxis],
+            targets[:, np.maximum(schemes, 0)]
+            )
+        for j in range(number_of_targets - 1, -1, -1):
+            children = schemes[:, j + 1:] == j
+            carried = np.sum(np.where(children, drawn_volumes[..., j + 1:], 0.0), axis = -1)
+            total_volumes[..., j] = final_volumes[:, np.newaxis] + dead_volume + carried
+            source_volumes[..., j] = total_volumes[..., j] * targets[:, np.newaxis, j] / source_concentrations[..., j]
+            drawn_volumes[..., j] = source_volumes[..., j] + transfer_loss * aspirations(source_volumes[..., j], max_volume)
+        return source_volumes, total_volumes - source_volumes, total_volumes, drawn_volumes
+
+def select_schemes(
+    source_volumes: np.ndarray, solvent_volumes: np.ndarray, drawn_volumes: np.ndarray, schemes: np.ndarray,
+    available_volumes: np.ndarray, min_volume: float, max_volume: float
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        # Returns each sample's chosen scheme index, feasibility, stock used and number of pipetting steps
+        stock_used = np.sum(np.where(schemes == STOCK, drawn_volumes, 0.0), axis = -1)
+        volumes = np.concatenate([source_volumes, solvent_volumes], axis = -1)
+        pipetted = volumes > VOLUME_TOLERANCE
+        # Nonzero volumes below the smallest pipette cannot be pipetted
+        transfers = np.sum(aspirations(volumes, max_volume), axis = -1).astype(int)
+        feasible = (
+            np.all(volumes >= -VOLUME_TOLERANCE, axis = -1)
+            & np.all(~pipetted | (volumes >= min_volume - VOLUME_TOLERANCE), axis = -1)
+            & (stock_used <= available_volumes[:, np.newaxis] + VOLUME_TOLERANCE)
+            )
+        # Lexicographic choice: feasible first, then least stock, fewest transfers and the shallowest chain
+        any_feasible = feasible.any(axis = 1)
+        candidates = np.where(any_feasible[:, np.newaxis], feasible, True)
+        least_stock = np.min(np.where(candidates, stock_used, np.inf), axis = 1)
+        candidates &= np.isclose(stock_used, least_stock[:, np.newaxis], rtol = 1e-9, atol = VOLUME_TOLERANCE)
+        fewest_transfers = np.min(np.where(candidates, transfers, np.iinfo(int).max), axis = 1)
+        candidates &= transfers == fewest_transfers[:, np.newaxis]
+        depths = scheme_depths(schemes)
+        candidates &= depths == np.min(np.where(candidates, depths, np.iinfo(int).max), axis = 1)[:, np.newaxis]
+        chosen = np.argmax(candidates, axis = 1)
+        rows = np.arange(len(chosen))
+        return chosen, any_feasible, stock_used[rows, chosen], transfers[rows, chosen]
+
+def optimize_dilutions(
+    samples: list, stock_concentrations, targets, available_volumes = np.inf, final_volumes = 100.0,
+    min_volume: float = 1.0, max_volume: float = 200.0, dead_volume: float = 0.0,
+    transfer_loss: float = DEFAULT_TRANSFER_LOSS
+    ) -> pd.DataFrame:
+        # targets is one list shared by every sample or one row of targets per sample
+        stock_concentrations = np.asarray(stock_concentrations, dtype = float)
+        number_of_samples = len(stock_concentrations)
+        available_volumes = np.broadcast_to(np.asarray(available_volumes, dtype = float), (number_of_samples,))
+        final_volumes = np.broadcast_to(np.asarray(final_volumes, dtype = float), (number_of_samples,))
+        targets = np.atleast_2d(np.asarray(targets, dtype = float))
+        targets = np.sort(np.broadcast_to(targets, (number_of_samples, targets.shape[1])), axis = 1)[:, ::-1]
+        if np.any(targets <= 0):
+            raise ValueError('Target concentrations must be positive')
+        number_of_targets = targets.shape[1]
+        schemes = candidate_schemes(number_of_targets)
+        chosen = np.zeros(number_of_samples, dtype = int)
+        feasible = np.zeros(number_of_samples, dtype = bool)
+        stock_used = np.zeros(number_of_samples)
+        transfers = np.zeros(number_of_samples, dtype = int)
+        source_volumes = np.zeros(targets.shape)
+        solvent_volumes = np.zeros(targets.shape)
+        total_volumes = np.zeros(targets.shape)
+        # Chunks of samples keep the sample x scheme x target arrays to a fixed size however many samples there are
+        chunk_size = max(1, MAX_CHUNK_ELEMENTS // (len(schemes) * number_of_targets))
+        for start in range(0, number_of_samples, chunk_size):
+            chunk = slice(start, start + chunk_size)
+            chunk_sources, chunk_solvents, chunk_totals, chunk_drawn = evaluate_schemes(
+                stock_concentrations[chunk], targets[chunk], schemes, final_volumes[chunk],
+                dead_volume = dead_volume, transfer_loss = transfer_loss, max_volume = max_volume
+                )
+            chosen[chunk], feasible[chunk], stock_used[chunk], transfers[chunk] = select_schemes(
+                chunk_sources, chunk_solvents, chunk_drawn, schemes, available_volumes[chunk], min_volume, max_volume
+                )
+            rows = np.arange(len(chunk_sources))
+            source_volumes[chunk] = chunk_sources[rows, chosen[chunk]]
+            solvent_volumes[chunk] = chunk_solvents[rows, chosen[chunk]]
+            total_volumes[chunk] = chunk_totals[rows, chosen[chunk]]
+        chosen_schemes = schemes[chosen]
+        source_labels = np.take_along_axis(targets, np.maximum(chosen_schemes, 0), axis = 1).astype(str).astype(object)
+        return pd.DataFrame({
+            'Sample': np.repeat(np.asarray(samples, dtype = object), number_of_targets),
+            'Concentration': targets.ravel(),
+            'Source': np.where(chosen_schemes == STOCK, 'Stock', source_labels).ravel(),
+            'Volume_from_source': source_volumes.ravel(),
+            'Volume_of_solvent': solvent_volumes.ravel(),
+            'Total_volume': total_volumes.ravel(),
+            'Feasible': np.repeat(feasible, number_of_targets),
+            'Stock_used': np.repeat(stock_used, number_of_targets),
+            'Transfers': np.repeat(transfers, number_of_targets)
+            })
+
+def main(
+    samples_path: str, targets: list, output_path: str, relative: bool = False, final_volume: float = 100.0,
+    min_volume: float = 1.0, max_volume: float = 200.0, dead_volume: float = 0.0,
+    transfer_loss: float = DEFAULT_TRANSFER_LOSS, append: bool = False
+    ) -> pd.DataFrame:
+        # Samples table: Sample and Concentration (of the stock), optionally Available_volume and Final_volume
+        sample_table = pd.read_csv(samples_path)
+        stock_concentrations = sample_table.loc[:, 'Concentration'].to_numpy(dtype = float)
+        available_volumes = sample_table.loc[:, 'Available_volume'].to_numpy(dtype = float) if 'Available_volume' in sample_table else np.inf
+        final_volumes = sample_table.loc[:, 'Final_volume'].to_numpy(dtype = float) if 'Final_volume' in sample_table else final_volume
+        targets = np.asarray(targets, dtype = float)
+        if relative:
+            targets = stock_concentrations[:, np.newaxis] * targets
+        plan = optimize_dilutions(
+            samples = list(sample_table.loc[:, 'Sample']),
+            stock_concentrations = stock_concentrations,
+            targets = targets,
+            available_volumes = available_volumes,
+            final_volumes = final_volumes,
+            min_volume = min_volume,
+            max_volume = max_volume,
+            dead_volume = dead_volume,
+            transfer_loss = transfer_loss
+            )
+        tw.write_columns(output_path, plan, append = append)
+        infeasible = list(pd.unique(plan.loc[~plan.loc[:, 'Feasible'], 'Sample']))
+        if len(infeasible) > 0:
+            print(f'No scheme meets the pipette and stock limits for: {infeasible}')
+        print(f'Planned {targets.shape[-1]} dilutions for {len(sample_table)} samples into {output_path}')
+        return plan
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-i',
+        '--samples_path',
+        required = True,
+        help = 'Path to a .csv with Sample and stock Concentration columns, and optionally Available_volume and Final_volume'
+        )
+
+    parser.add_argument(
+        '-t',
+        '--targets',
+        required = True,
+        nargs = '+',
+        type = float,
+        help = 'Target concentrations, in the units of the stock concentrations'
+        )
+
+    parser.add_argument(
+        '-r',
+        '--relative',
+        action = 'store_true',
+        help = 'Read the targets as fractions of each sample\'s stock concentration'
+        )
+
+    parser.add_argument(
+        '-l',
+        '--limiting_vol',
+        default = 100.0,
+        type = float,
+        help = 'Volume of every target solution left over for use, unless the samples table gives Final_volume'
+        )
+
+    parser.add_argument(
+        '--min_volume',
+        default = 1.0,
+        type = float,
+        help = 'Smallest volume that can be pipetted accurately'
+        )
+
+    parser.add_argument(
+        '--max_volume',
+        default = 200.0,
+        type = float,
+        help = 'Largest volume of a single pipetting step; larger volumes count as several transfers'
+        )
+
+    parser.add_argument(
+        '--dead_volume',
+        default = 0.0,
+        type = float,
+        help = 'Volume left unrecoverable in every tube; it raises every tube\'s volume but not the choice of scheme'
+        )
+
+    parser.add_argument(
+        '--transfer_loss',
+        default = DEFAULT_TRANSFER_LOSS,
+        type = float,
+        help = 'Volume retained in the tip on every aspiration; losses drawn from dilute tubes cost less stock than losses drawn from the stock'
+        )
+
+    parser.add_argument(
+        '-o',
+        '--output_path',
+        default = './Western_blot/BCA/Calculate_dilutions/Optimized_dilutions.csv'
+        )
+
+    parser.add_argument(
+        '-a',
+        '--append',
+        action = 'store_true',
+        help = 'Append the plan to an existing output with the same columns instead of overwriting it'
+        )
+
+    args = parser.parse_args()
+
+    main(
+        samples_path = args.samples_path,
+        targets = args.targets,
+        output_path = args.output_path,
+        relative = args.relative,
+        final_volume = args.limiting_vol,
+        min_volume = args.min_volume,
+        max_volume = args.max_volume,
+        dead_volume = args.dead_volume,
+        transfer_loss = args.transfer_loss,
+        append = args.append
+        )
@@ -1,13 +1,104 @@
+import os
+import sys
 import argparse
 import re
 import numpy as np
 import pandas as pd
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from Utilities import Table_io as tio
+from Utilities import Result_cache as rc
+
+SAMPLE_REGEXS = [
+    r'FUCRW-M1-1-E',
+    r'FUCRW-M1-1-F',
+    r'FUCRW-M1-2-E',
+    r'FUCRW-M1-2-F',
+    r'FUCRW-M2-1-E',
+    r'FUCRW-M2-1-F',
+    r'FUCRW-M2-2-E',
+    r'FUCRW-M2-2-F',
+    r'MYCN-M1-1-E',
+    r'MYCN-M1-1-F',
+    r'MYCN-M1-2-E',
+    r'MYCN-M1-2-F',
+    r'MYCN-M2-1-E',
+    r'MYCN-M2-1-F',
+    r'MYCN-M2-2-E',
+    r'MYCN-M2-2-F',
+    r'IDH1-M1-1-E',
+    r'IDH1-M1-1-F',
+    r'IDH1-M1-2-E',
+    r'IDH1-M1-2-F',
+    r'IDH1-M2-1-E',
+    r'IDH1-M2-1-F',
+    r'IDH1-M2-2-E',
+    r'IDH1-M2-2-F',
+    r'MYCN;IDH1-M1-1-E',
+    r'MYCN;IDH1-M1-1-F',
+    r'MYCN;IDH1-M1-2-E',
+    r'MYCN;IDH1-M1-2-F',
+    r'MYCN;IDH1-M2-1-E',
+    r'MYCN;IDH1-M2-1-F',
+    r'MYCN;IDH1-M2-2-E',
+    r'MYCN;IDH1-M2-2-F'
+    ]
+
+DILUTION_REGEX = re.compile(r' \(1/([0-9]+)\)$')
+
+class PlateIndex:
+
+    def __init__(self, sample_id_dataframe):
+        # Flattening the plating scheme once in row-major order; every lookup afterwards is an array operation
+        self.row_index = sample_id_dataframe.index
+        self.col_index = sample_id_dataframe.columns
+        self.row_keys = np.repeat(self.row_index.to_numpy(), len(self.col_index))
+        self.col_keys = np.tile(self.col_index.to_numpy(), len(self.row_index))
+        self.well_labels = sample_id_dataframe.to_numpy(dtype = object).ravel()
+        self.label_codes, self.labels = pd.factorize(self.well_labels)
+        self.labels = np.asarray(self.labels, dtype = object)
+        label_samples = []
+        label_dilutions = []
+        for label in self.labels:
+            dilution_match = DILUTION_REGEX.search(label)
+            if dilution_match is None:
+                label_samples.append(label)
+                label_dilutions.append(1.0)
+            else:
+                label_samples.append(label[:dilution_match.start()])
+                label_dilutions.append(1.0 / float(dilution_match.group(1)))
+        self.label_samples = np.array(label_samples, dtype = object)
+        self.well_samples = self.label_samples[self.label_codes]
+        self.well_dilutions = np.array(label_dilutions)[self.label_codes]
+
+    @property
+    def number_of_wells(self):
+        return len(self.well_labels)
+
+    def regex_mask(self, sample_regexs):
+        # Regexes are matched against the distinct labels only, then broadcast back out to wells
+        label_mask = np.array([[bool(regex.match(label)) for label in self.labels] for regex in sample_regexs], dtype = bool)
+        return label_mask.reshape(len(sample_regexs), len(self.labels))[:, self.label_codes]
+
+    def well_values(self, numeric_dataframe):
+        # Absorbances laid out in the same row-major well order as the index
+        return numeric_dataframe.loc[self.row_index, self.col_index].to_numpy(dtype = float).ravel()
+
+    def optimal_wells(self, well_values, sample_mask, max_val):
+        # well_values may be one plate (wells,) or a stack (plates, wells); returns -1 where nothing is under max_val
+        well_values = np.asarray(well_values, dtype = float)
+        candidates = np.where(sample_mask & (well_values[..., np.newaxis, :] <= max_val), well_values[..., np.newaxis, :], -np.inf)
+        optimal_indices = np.argmax(candidates, axis = -1)
+        has_candidate = np.isfinite(np.take_along_axis(candidates, optimal_indices[..., np.newaxis], axis = -1)[..., 0])
+        return np.where(has_candidate, optimal_indices, -1)
+
 class BCAdata:
 
-    def __init__(self, numeric_dataframe, sample_id_dataframe):
+    def __init__(self, numeric_dataframe, sample_id_dataframe, plate_index = None):
         self.numeric_dataframe = numeric_dataframe
         self.sample_id_dataframe = sample_id_dataframe
+        self.plate_index = PlateIndex(sample_id_dataframe) if plate_index is None else plate_index
+        self.well_values = self.plate_index.well_values(numeric_dataframe)
 
     def obtain_max_value(self, max_keys = None):
         if max_keys is None:
@@ -18,22 +109,16 @@ class BCAdata:
         return max_value
 
     def return_optimal_sample_id(self, sample_regex, max_val):
-        mask = self.sample_id_dataframe.applymap(lambda x: bool(sample_regex.match(x)))
-        matching_indices = mask[mask].stack().index.tolist()
-        if len(matching_indices) == 0:
-            return
-        subset_data = []
-        for index in matching_indices:
-            row_index, col_index = index
-            subset_data.append(self.numeric_dataframe.loc[row_index, col_index])
-        subset_numeric_data = pd.DataFrame(subset_data, index = matching_indices, columns = ['Value'])
-        optimal_row, optimal_col = subset_numeric_data.loc[subset_numeric_data['Value'] <= max_val, 'Value'].idxmax()
-        optimal_sample_id = self.sample_id_dataframe.loc[optimal_row, optimal_col]
-        return optimal_sample_id
+        return self.return_optimal_sample_ids(sample_regexs = [sample_regex], max_val = max_val)[0]
+
+    def return_optimal_sample_ids(self, sample_regexs, max_val):
+        sample_mask = self.plate_index.regex_mask(sample_regexs)
+        optimal_indices = self.plate_index.optimal_wells(self.well_values, sample_mask, max_val)
+        return [self.plate_index.well_labels[i] if i >= 0 else None for i in optimal_indices]
     
     def main_calculations(self, sample_regexs, max_keys = None):
         max_absorbance = self.obtain_max_value(max_keys = max_keys)
-        optimal_samples = [self.return_optimal_sample_id(sample_regex = reg_val, max_val = max_absorbance) for reg_val in sample_regexs]
+        optimal_samples = self.return_optimal_sample_ids(sample_regexs = sample_regexs, max_val = max_absorbance)
         return optimal_samples
     
     def generate_unknowns_data(self, optimum_samples = None, sample_regexs = None, max_keys = None):
@@ -42,32 +127,39 @@ class BCAdata:
                 raise ValueError(f'{sample_regexs} must be specified to do automatic sample optimization')
             optimum_samples = self.main_calculations(sample_regexs = sample_regexs, max_keys = max_keys)
             optimum_samples = [x for x in optimum_samples if x is not None]
-        mask = self.sample_id_dataframe.isin(optimum_samples)
-        index_values = self.sample_id_dataframe[mask].stack().index.tolist()
+        well_indices = np.flatnonzero(np.isin(self.plate_index.well_labels, np.array(optimum_samples, dtype = object)))
         subset_data = {}
-        for val in index_values:
-            row_index, col_index = val
-            subset_data[self.sample_id_dataframe.loc[row_index, col_index]] = [self.numeric_dataframe.loc[row_index, col_index]]
+        for i in well_indices:
+            subset_data[self.plate_index.well_labels[i]] = [self.well_values[i]]
         return subset_data
     
-def main(absorbance_filepath, sample_filepath, sample_regexs, max_keys = None, output_path = 'unknowns_data.xlsx'):
-    raw_data = pd.read_csv(absorbance_filepath)
-    raw_data = raw_data.set_index(keys = '0')
-    sample_keys = pd.read_csv(sample_filepath)
-    sample_keys = sample_keys.set_index(keys = '0')
-    sample_keys = sample_keys.fillna('') 
+def optimal_unknowns(absorbance_filepath, sample_filepath, sample_regexs, max_keys = None):
+    raw_data = tio.read_plate(absorbance_filepath)
+    sample_keys = tio.read_layout(sample_filepath)
     bca_test = BCAdata(raw_data, sample_keys)
     optimal_samples = bca_test.main_calculations(sample_regexs = sample_regexs, max_keys = max_keys)
     optimal_samples = [x for x in optimal_samples if x is not None]
-    print(f'Optimal samples are as follows: {optimal_samples}')
     unknowns_data = bca_test.generate_unknowns_data(optimum_samples = optimal_samples, max_keys = max_keys) 
     ordered_unknowns_data = {'Replicate': [int(1)]}
     for key in optimal_samples:
         if key in unknowns_data:
             ordered_unknowns_data[key] = unknowns_data[key]
-    ordered_unknowns_data = pd.DataFrame(ordered_unknowns_data)
-    ordered_unknowns_data.to_excel(output_path, index = False)
-        
+    return optimal_samples, pd.DataFrame(ordered_unknowns_data)
+
+def main(absorbance_filepath, sample_filepath, sample_regexs, max_keys = None, output_path = 'unknowns_data.csv', export_xlsx = False, result_cache = None):
+    if result_cache is None:
+        result_cache = rc.ResultCache(enabled = False)
+    # Keyed on the plate and layout contents and the sample patterns, not on where the files sit
+    optimal_samples, ordered_unknowns_data = result_cache.cached(
+        'optimal_unknowns',
+        lambda: optimal_unknowns(absorbance_filepath, sample_filepath, sample_regexs, max_keys = max_keys),
+        input_paths = [absorbance_filepath, sample_filepath, __file__],
+        parameters = {'sample_regexs': [x.pattern if hasattr(x, 'pattern') else x for x in sample_regexs], 'max_keys': max_keys}
+        )
+    print(f'Optimal samples are as follows: {optimal_samples}')
+    tio.write_table(ordered_unknowns_data, output_path)
+    if export_xlsx is True:
+        tio.write_table(ordered_unknowns_data, tio.with_format(output_path, 'xlsx'))
 
 if __name__ == '__main__':
 
@@ -98,47 +190,38 @@ if __name__ == '__main__':
     parser.add_argument(
         '-o',
         '--output_path',
-        default = 'Western_blot/BCA/unknown_data.xlsx',
-        help = 'Output path for uknowns_data.xlsx'
+        default = 'Western_blot/BCA/unknown_data.csv',
+        help = 'Output path for uknowns_data (.csv, .parquet or .feather)'
+        )
+
+    parser.add_argument(
+        '-x',
+        '--export_xlsx',
+        action = 'store_true',
+        help = 'Also write an .xlsx copy of the unknowns table next to the output'
+        )
+
+    parser.add_argument(
+        '--cache_dir',
+        default = rc.DEFAULT_CACHE_DIR,
+        help = 'Directory for cached optimal samples, keyed by the plate and layout contents'
+        )
+
+    parser.add_argument(
+        '--cache_size',
+        default = rc.DEFAULT_MAX_BYTES // 2 ** 20,
+        type = int,
+        help = 'Size in MB the cache is trimmed to, least recently used results first'
+        )
+
+    parser.add_argument(
+        '--no_cache',
+        action = 'store_true',
+        help = 'Recompute every result instead of reusing cached ones'
         )
 
     args = parser.parse_args()
 
-    SAMPLE_REGEXS = [
-        r'FUCRW-M1-1-E',
-        r'FUCRW-M1-1-F',
-        r'FUCRW-M1-2-E',
-        r'FUCRW-M1-2-F',
-        r'FUCRW-M2-1-E',
-        r'FUCRW-M2-1-F',
-        r'FUCRW-M2-2-E',
-        r'FUCRW-M2-2-F',
-        r'MYCN-M1-1-E',
-        r'MYCN-M1-1-F',
-        r'MYCN-M1-2-E',
-        r'MYCN-M1-2-F',
-        r'MYCN-M2-1-E',
-        r'MYCN-M2-1-F',
-        r'MYCN-M2-2-E',
-        r'MYCN-M2-2-F',
-        r'IDH1-M1-1-E',
-        r'IDH1-M1-1-F',
-        r'IDH1-M1-2-E',
-        r'IDH1-M1-2-F',
-        r'IDH1-M2-1-E',
-        r'IDH1-M2-1-F',
-        r'IDH1-M2-2-E',
-        r'IDH1-M2-2-F',
-        r'MYCN;IDH1-M1-1-E',
-        r'MYCN;IDH1-M1-1-F',
-        r'MYCN;IDH1-M1-2-E',
-        r'MYCN;IDH1-M1-2-F',
-        r'MYCN;IDH1-M2-1-E',
-        r'MYCN;IDH1-M2-1-F',
-        r'MYCN;IDH1-M2-2-E',
-        r'MYCN;IDH1-M2-2-F'
-        ]
-    
     sample_regexs = [re.compile(val) for val in SAMPLE_REGEXS]
 
     main(
@@ -146,5 +229,7 @@ if __name__ == '__main__':
         sample_filepath = args.sample_key,
         sample_regexs = sample_regexs,
         max_keys = args.max_keys,
-        output_path = args.output_path
+        output_path = args.output_path,
+        export_xlsx = args.export_xlsx,
+        result_cache = rc.ResultCache(cache_dir = args.cache_dir, max_bytes = args.cache_size * 2 ** 20, enabled = not args.no_cache)
         )
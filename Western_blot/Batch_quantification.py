@@ -0,0 +1,111 @@
+import os
+import sys
+import glob
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Rep0'))
+import Quantification as qf
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from Utilities import Table_io as tio
+
+CONFIG_NAME = 'Quantification_config.json'
+MEMBRANE_DEFAULTS = {
+    'normalization_key': 'Actin',
+    'blank_key': 'Blank',
+    'control_indecies': 0,
+    'vectorized': True,
+    'total_protein': None
+    }
+
+
+def discover_membranes(root_dir: str, config_name: str = CONFIG_NAME) -> list[dict]:
+    membranes = []
+    config_paths = sorted(glob.glob(os.path.join(root_dir, '**', config_name), recursive = True))
+    for config_path in config_paths:
+        config_dir = os.path.dirname(config_path)
+        with open(config_path, 'r', encoding = 'UTF-8') as config_file:
+            config = json.load(config_file)
+        replicate = config.get('replicate', os.path.basename(config_dir))
+        for membrane_config in config['membranes']:
+            membrane = dict(MEMBRANE_DEFAULTS, **membrane_config)
+            membrane['filepath'] = os.path.join(config_dir, membrane_config['filepath'])
+            if membrane['total_protein'] is not None:
+                membrane['total_protein'] = os.path.join(config_dir, membrane['total_protein'])
+            membrane['replicate'] = replicate
+            membrane['membrane'] = membrane_config.get('membrane', os.path.splitext(membrane_config['filepath'])[0])
+            membranes.append(membrane)
+    return membranes
+
+def quantify_membrane_job(membrane: dict) -> pd.DataFrame:
+    normalization_factors = None
+    if membrane['total_protein'] is not None:
+        normalization_factors = tio.read_table(membrane['total_protein'], index_col = 0).loc[:, 'Factor']
+    ij_relative = qf.quantify_membrane(
+        filepath = membrane['filepath'],
+        normalization_key = membrane['normalization_key'],
+        blank_key = membrane['blank_key'],
+        control_indecies = membrane['control_indecies'],
+        vectorized = membrane['vectorized'],
+        normalization_factors = normalization_factors
+        )
+    feature_labels = [x for x in list(ij_relative.columns) if x != membrane['normalization_key'] or normalization_factors is not None]
+    tidy_data = ij_relative.loc[:, feature_labels].reset_index().melt(
+        id_vars = 'Sample',
+        var_name = 'Target',
+        value_name = 'Relative_expression'
+        )
+    tidy_data.insert(0, 'Replicate', membrane['replicate'])
+    tidy_data.insert(1, 'Membrane', membrane['membrane'])
+    tidy_data.insert(3, 'Condition', [qf.sample_condition(x) for x in list(tidy_data.loc[:, 'Sample'])])
+    tidy_data['Normalization'] = membrane['normalization_key'] if normalization_factors is None else 'Total_protein'
+    return tidy_data
+
+def main(root_dir: str, output_path: str, processes: int = None, config_name: str = CONFIG_NAME) -> pd.DataFrame:
+    membranes = discover_membranes(root_dir = root_dir, config_name = config_name)
+    if len(membranes) == 0:
+        raise FileNotFoundError(f'No {config_name} files were found under {root_dir}')
+    with ProcessPoolExecutor(max_workers = processes) as executor:
+        results = list(executor.map(quantify_membrane_job, membranes))
+    combined_results = pd.concat(results, axis = 0, ignore_index = True)
+    tio.write_table(combined_results, output_path)
+    print(f'Quantified {len(membranes)} membranes into {output_path}')
+    return combined_results
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-d',
+        '--root_dir',
+        default = 'Western_blot',
+        help = 'Directory searched recursively for per-replicate Quantification_config.json files'
+        )
+
+    parser.add_argument(
+        '-o',
+        '--output_path',
+        default = 'Western_blot/Quantification_results.csv',
+        help = 'Output path for the combined tidy results table (.csv, .parquet, .feather or .xlsx)'
+        )
+
+    parser.add_argument(
+        '-p',
+        '--processes',
+        default = None,
+        type = int,
+        help = 'Number of worker processes (defaults to all cores)'
+        )
+
+    args = parser.parse_args()
+
+    main(
+        root_dir = args.root_dir,
+        output_path = args.output_path,
+        processes = args.processes
+        )
@@ -0,0 +1,140 @@
+import os
+import sys
+import time
+import struct
+import resource
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import Tiled_reader as tr
+import Densitometry as ds
+
+HEADER_SIZE = 8
+IFD_ENTRIES = 9
+
+
+def write_synthetic_scan(filepath: str, side: int, band_rows: int = 1024) -> np.ndarray:
+    # Minimal little-endian, single-strip, uncompressed 16-bit TIFF, filled band by band so generation stays bounded too
+    pixel_offset = HEADER_SIZE + 2 + IFD_ENTRIES * 12 + 4
+    byte_count = side * side * 2
+    if byte_count >= 2 ** 32:
+        raise ValueError('Synthetic scans must stay under 4 GB (side < 46341) to fit a classic TIFF strip')
+    entries = [
+        (256, 4, 1, side),
+        (257, 4, 1, side),
+        (258, 3, 1, 16),
+        (259, 3, 1, 1),
+        (262, 3, 1, 1),
+        (273, 4, 1, pixel_offset),
+        (277, 3, 1, 1),
+        (278, 4, 1, side),
+        (279, 4, 1, byte_count)
+        ]
+    with open(filepath, 'wb') as scan_file:
+        scan_file.write(b'II' + struct.pack('<HI', 42, HEADER_SIZE))
+        scan_file.write(struct.pack('<H', len(entries)))
+        for tag, field_type, count, value in entries:
+            packed_value = struct.pack('<HH', value, 0) if field_type == 3 else struct.pack('<I', value)
+            scan_file.write(struct.pack('<HHI', tag, field_type, count) + packed_value)
+        scan_file.write(struct.pack('<I', 0))
+        scan_file.truncate(pixel_offset + byte_count)
+    # Dark bands on a bright, slowly varying background, like an uninverted membrane export
+    lane_width = side // 24
+    band_height = side // 10
+    columns = np.arange(side)
+    lane_profile = np.clip(1.0 - np.abs((columns % lane_width) - lane_width / 2.0) / (lane_width / 3.0), 0.0, 1.0)
+    for y0 in range(0, side, band_rows):
+        y1 = min(y0 + band_rows, side)
+        rows = np.arange(y0, y1)
+        band_profile = np.exp(-((rows % band_height) - band_height / 2.0) ** 2 / (2.0 * (band_height / 12.0) ** 2))
+        values = 60000.0 - 2000.0 * columns[np.newaxis, :] / side - 30000.0 * band_profile[:, np.newaxis] * lane_profile[np.newaxis, :]
+        band = np.memmap(filepath, dtype = '<u2', mode = 'r+', offset = pixel_offset + y0 * side * 2, shape = (y1 - y0, side))
+        band[:] = values.astype(np.uint16)
+        band.flush()
+        del band
+    lanes, bands = np.meshgrid(np.arange(24), np.arange(10))
+    return np.column_stack([
+        lanes.ravel() * lane_width + lane_width // 6,
+        bands.ravel() * band_height + band_height // 3,
+        np.full(lanes.size, 2 * lane_width // 3),
+        np.full(lanes.size, band_height // 3)
+        ])
+
+def peak_rss_megabytes() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def baseline_job(filepath: str, rois: np.ndarray, tile_size: int) -> tuple[float, float, np.ndarray]:
+    return 0.0, peak_rss_megabytes(), None
+
+def tiled_job(filepath: str, rois: np.ndarray, tile_size: int) -> tuple[float, float, np.ndarray]:
+    start_time = time.perf_counter()
+    scan = tr.TiledScan(filepath, tile_size = tile_size)
+    measurements = ds.measure_tiled_rois(scan, rois, background_width = 10)
+    return time.perf_counter() - start_time, peak_rss_megabytes(), measurements
+
+def in_memory_job(filepath: str, rois: np.ndarray, tile_size: int) -> tuple[float, float, np.ndarray]:
+    start_time = time.perf_counter()
+    intensity = tr.scan_intensity(np.array(tr.load_scan(filepath)))
+    measurements = ds.measure_rois(intensity, rois, background_width = 10)
+    return time.perf_counter() - start_time, peak_rss_megabytes(), measurements
+
+def run_in_fresh_process(job, filepath: str, rois: np.ndarray, tile_size: int):
+    # Peak RSS is per process, so every measurement gets its own interpreter
+    with ProcessPoolExecutor(max_workers = 1) as executor:
+        return executor.submit(job, filepath, rois, tile_size).result()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-s',
+        '--side',
+        default = 32768,
+        type = int,
+        help = 'Edge length of the synthetic square 16-bit scan (32768 is ~1.07 gigapixels, 2 GB on disk)'
+        )
+
+    parser.add_argument(
+        '-t',
+        '--tile_size',
+        default = tr.DEFAULT_TILE_SIZE,
+        type = int,
+        help = 'Tile edge length used by the tiled reader'
+        )
+
+    parser.add_argument(
+        '-m',
+        '--in_memory_limit',
+        default = 8192,
+        type = int,
+        help = 'Largest side also measured by loading the whole scan, for comparison'
+        )
+
+    parser.add_argument(
+        '-d',
+        '--directory',
+        default = None,
+        help = 'Directory for the temporary synthetic scan (defaults to the system temp directory)'
+        )
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir = args.directory) as temporary_directory:
+        filepath = os.path.join(temporary_directory, 'synthetic_scan.tif')
+        start_time = time.perf_counter()
+        rois = write_synthetic_scan(filepath, args.side)
+        megapixels = args.side ** 2 / 1e6
+        print(f'Synthetic scan: {args.side} x {args.side} ({megapixels:.0f} Mpx, {os.path.getsize(filepath) / 2 ** 20:.0f} MB) written in {time.perf_counter() - start_time:.1f} s')
+        _, baseline_rss, _ = run_in_fresh_process(baseline_job, filepath, rois, args.tile_size)
+        print(f'Interpreter baseline peak RSS: {baseline_rss:.0f} MB')
+        elapsed, peak_rss, tiled_measurements = run_in_fresh_process(tiled_job, filepath, rois, args.tile_size)
+        print(f'Tiled ({args.tile_size} px tiles): {elapsed:.2f} s, {megapixels / elapsed:.0f} Mpx/s, peak RSS {peak_rss:.0f} MB')
+        if args.side <= args.in_memory_limit:
+            elapsed, peak_rss, memory_measurements = run_in_fresh_process(in_memory_job, filepath, rois, args.tile_size)
+            print(f'Whole scan in memory: {elapsed:.2f} s, {megapixels / elapsed:.0f} Mpx/s, peak RSS {peak_rss:.0f} MB')
+            print(f'Max relative difference between readers: {np.max(np.abs(tiled_measurements - memory_measurements)) / np.max(np.abs(memory_measurements)):.2e}')
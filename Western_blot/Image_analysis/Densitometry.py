@@ -0,0 +1,229 @@
+import os
+import sys
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from Utilities import Table_io as tio
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import Tiled_reader as tr
+
+ROI_COLUMNS = ['Sample', 'Target', 'Image', 'x', 'y', 'width', 'height']
+
+
+def measure_rectangles(sum_rectangles, shape: tuple, rois: np.ndarray, background_width: int = 5) -> np.ndarray:
+    # rois is (n, 4) of x, y, width, height; the background is the mean of a ring background_width pixels wide.
+    # sum_rectangles(y0, x0, y1, x1) is called once for the ROIs and their outer rectangles together, and may
+    # return a leading axis (one row per image of a stack)
+    height, width = shape
+    rois = np.asarray(rois, dtype = int).reshape(-1, 4)
+    x0 = np.clip(rois[:, 0], 0, width)
+    y0 = np.clip(rois[:, 1], 0, height)
+    x1 = np.clip(rois[:, 0] + rois[:, 2], 0, width)
+    y1 = np.clip(rois[:, 1] + rois[:, 3], 0, height)
+    roi_areas = (y1 - y0) * (x1 - x0)
+    if background_width <= 0:
+        return sum_rectangles(y0, x0, y1, x1)
+    outer_x0 = np.clip(x0 - background_width, 0, width)
+    outer_y0 = np.clip(y0 - background_width, 0, height)
+    outer_x1 = np.clip(x1 + background_width, 0, width)
+    outer_y1 = np.clip(y1 + background_width, 0, height)
+    all_sums = sum_rectangles(
+        np.concatenate([y0, outer_y0]),
+        np.concatenate([x0, outer_x0]),
+        np.concatenate([y1, outer_y1]),
+        np.concatenate([x1, outer_x1])
+        )
+    roi_sums, outer_sums = all_sums[..., :len(rois)], all_sums[..., len(rois):]
+    ring_sums = outer_sums - roi_sums
+    ring_areas = (outer_y1 - outer_y0) * (outer_x1 - outer_x0) - roi_areas
+    background = np.divide(ring_sums, ring_areas, out = np.zeros(ring_sums.shape), where = ring_areas > 0)
+    return roi_sums - background * roi_areas
+
+def measure_rois(intensity: np.ndarray, rois: np.ndarray, background_width: int = 5, table: np.ndarray = None) -> np.ndarray:
+    if table is None:
+        table = tr.integral_image(intensity)
+    return measure_rectangles(
+        sum_rectangles = lambda y0, x0, y1, x1: tr.rectangle_sums(table, y0, x0, y1, x1),
+        shape = intensity.shape,
+        rois = rois,
+        background_width = background_width
+        )
+
+def measure_tiled_rois(scan: tr.TiledScan, rois: np.ndarray, background_width: int = 5, background_percentile: float = None) -> np.ndarray:
+    # Same measurement streamed tile by tile; with a percentile the ring is replaced by per-tile background
+    if background_percentile is not None:
+        return measure_rectangles(
+            sum_rectangles = lambda y0, x0, y1, x1: scan.rectangle_sums(y0, x0, y1, x1, background_percentile = background_percentile),
+            shape = scan.shape,
+            rois = rois,
+            background_width = 0
+            )
+    return measure_rectangles(
+        sum_rectangles = scan.rectangle_sums,
+        shape = scan.shape,
+        rois = rois,
+        background_width = background_width
+        )
+
+def read_rois(roi_path: str) -> pd.DataFrame:
+    rois = tio.read_table(roi_path)
+    missing_columns = [x for x in ROI_COLUMNS if x not in rois.columns]
+    if len(missing_columns) > 0:
+        raise ValueError(f'{roi_path} is missing ROI columns {missing_columns}')
+    rois = rois.copy()
+    # Image paths in an ROI table are relative to the table itself
+    rois['Image'] = [x if os.path.isabs(x) else os.path.join(os.path.dirname(roi_path), x) for x in rois.loc[:, 'Image']]
+    return rois
+
+def measure_image_job(job: dict) -> np.ndarray:
+    # Scans stored uncompressed are streamed in tiles; decoded formats have to be measured in memory
+    if tr.raw_page_layouts(job['image_path'])[0] is not None:
+        scan = tr.TiledScan(job['image_path'], tile_size = job['tile_size'], channel = job['channel'], invert = job['invert'])
+        return measure_tiled_rois(scan, job['rois'], background_width = job['background_width'], background_percentile = job['background_percentile'])
+    intensity = tr.scan_intensity(tr.load_scan(job['image_path']), channel = job['channel'], invert = job['invert'])
+    if job['background_percentile'] is not None:
+        intensity = tr.subtract_tile_backgrounds(intensity, tile_size = job['tile_size'], percentile = job['background_percentile'])
+        return measure_rois(intensity, job['rois'], background_width = 0)
+    return measure_rois(intensity, job['rois'], background_width = job['background_width'])
+
+def densitometry_table(rois: pd.DataFrame, measurements: np.ndarray) -> pd.DataFrame:
+    # Samples x targets in first-seen order, the layout IJ_data reads with Sample as its index
+    measured = rois.loc[:, ['Sample', 'Target']].assign(Intensity = measurements)
+    table = measured.pivot_table(index = 'Sample', columns = 'Target', values = 'Intensity', aggfunc = 'sum', sort = False)
+    table = table.loc[:, list(pd.unique(measured.loc[:, 'Target']))]
+    table.columns.name = None
+    return table
+
+def quantify_rois(
+    rois: pd.DataFrame, background_width: int = 5, channel: int = None, invert: bool = None, processes: int = None,
+    tile_size: int = tr.DEFAULT_TILE_SIZE, background_percentile: float = None
+    ) -> pd.DataFrame:
+        # Each scan is loaded once and all of its ROIs are measured in one vectorized pass
+        image_groups = rois.groupby('Image', sort = False).indices
+        jobs = [{
+            'image_path': image_path,
+            'rois': rois.iloc[row_indices].loc[:, ['x', 'y', 'width', 'height']].to_numpy(dtype = int),
+            'background_width': background_width,
+            'background_percentile': background_percentile,
+            'tile_size': tile_size,
+            'channel': channel,
+            'invert': invert
+            } for image_path, row_indices in image_groups.items()]
+        if processes == 1 or len(jobs) == 1:
+            results = [measure_image_job(x) for x in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers = processes) as executor:
+                results = list(executor.map(measure_image_job, jobs))
+        measurements = np.zeros(len(rois))
+        for row_indices, result in zip(image_groups.values(), results):
+            measurements[row_indices] = result
+        return densitometry_table(rois, measurements)
+
+def main(
+    roi_pattern: str, output_path: str = None, background_width: int = 5, channel: int = None,
+    invert: bool = None, processes: int = None, tile_size: int = tr.DEFAULT_TILE_SIZE, background_percentile: float = None
+    ) -> dict:
+        roi_paths = sorted(glob.glob(roi_pattern))
+        if len(roi_paths) == 0:
+            raise FileNotFoundError(f'No ROI tables were found for {roi_pattern}')
+        if output_path is not None and len(roi_paths) > 1:
+            raise ValueError('--output_path can only be used with a single ROI table')
+        tables = {}
+        for roi_path in roi_paths:
+            table = quantify_rois(
+                rois = read_rois(roi_path),
+                background_width = background_width,
+                channel = channel,
+                invert = invert,
+                processes = processes,
+                tile_size = tile_size,
+                background_percentile = background_percentile
+                )
+            table_path = output_path if output_path is not None else os.path.splitext(roi_path)[0] + '_densitometry.csv'
+            tio.write_table(table, table_path, index = True)
+            print(f'Measured {table.shape[0]} samples x {table.shape[1]} targets into {table_path}')
+            tables[roi_path] = table
+        return tables
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-r',
+        '--rois',
+        required = True,
+        help = f'ROI table or glob of ROI tables with columns {", ".join(ROI_COLUMNS)} (pixels; Image relative to the table)'
+        )
+
+    parser.add_argument(
+        '-o',
+        '--output_path',
+        default = None,
+        help = 'Output path for a single ROI table (defaults to <rois>_densitometry.csv)'
+        )
+
+    parser.add_argument(
+        '-b',
+        '--background_width',
+        default = 5,
+        type = int,
+        help = 'Width in pixels of the ring around each ROI used for local background (0 disables subtraction)'
+        )
+
+    parser.add_argument(
+        '--background_percentile',
+        default = None,
+        type = float,
+        help = 'Use this percentile of each tile as its background instead of the ROI rings'
+        )
+
+    parser.add_argument(
+        '-t',
+        '--tile_size',
+        default = tr.DEFAULT_TILE_SIZE,
+        type = int,
+        help = 'Edge length in pixels of the tiles uncompressed scans are streamed in'
+        )
+
+    parser.add_argument(
+        '-c',
+        '--channel',
+        default = None,
+        type = int,
+        help = 'Colour channel to measure on RGB exports (defaults to the mean of all channels)'
+        )
+
+    parser.add_argument(
+        '--invert',
+        default = None,
+        action = argparse.BooleanOptionalAction,
+        help = 'Invert intensities before measuring (defaults to inverting light-background scans)'
+        )
+
+    parser.add_argument(
+        '-p',
+        '--processes',
+        default = None,
+        type = int,
+        help = 'Number of worker processes (defaults to all cores)'
+        )
+
+    args = parser.parse_args()
+
+    main(
+        roi_pattern = args.rois,
+        output_path = args.output_path,
+        background_width = args.background_width,
+        channel = args.channel,
+        invert = args.invert,
+        processes = args.processes,
+        tile_size = args.tile_size,
+        background_percentile = args.background_percentile
+        )
@@ -0,0 +1,316 @@
+import os
+import re
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from Utilities import Table_io as tio
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import Tiled_reader as tr
+import Densitometry as ds
+
+# Exposure times are read from file names such as PSA_MYCN_IDH1_3sec.jpg or ..._2min.tif
+EXPOSURE_REGEX = re.compile(r'_([0-9]+(?:\.[0-9]+)?)(ms|sec|s|min)$')
+EXPOSURE_UNITS = {'ms': 0.001, 'sec': 1.0, 's': 1.0, 'min': 60.0}
+SELECTION_METHODS = ['longest', 'linear']
+SATURATION_FRACTION = 0.98
+REGISTRATION_STRIDE = 4
+
+
+def exposure_seconds(image_path: str) -> float:
+    match = EXPOSURE_REGEX.search(os.path.splitext(os.path.basename(image_path))[0])
+    if match is None:
+        raise ValueError(f'No exposure time in the name of {image_path}; pass the exposures explicitly')
+    return float(match.group(1)) * EXPOSURE_UNITS[match.group(2)]
+
+def crop_box(rois: np.ndarray, background_width: int, shape: tuple, margin: int = 0) -> tuple:
+    # Only the pixels under the ROIs, their background rings and the registration margin are converted
+    pad = background_width + margin
+    y0 = max(int(rois[:, 1].min()) - pad, 0)
+    x0 = max(int(rois[:, 0].min()) - pad, 0)
+    y1 = min(int((rois[:, 1] + rois[:, 3]).max()) + pad, shape[0])
+    x1 = min(int((rois[:, 0] + rois[:, 2]).max()) + pad, shape[1])
+    return y0, x0, y1, x1
+
+def registration_shifts(previews: np.ndarray) -> np.ndarray:
+    # Phase correlation of every preview against the first in one batched FFT; films photographed one by
+    # one drift by a few pixels, which the ROIs' background rings would otherwise absorb as signal
+    centered = previews - previews.mean(axis = (-2, -1), keepdims = True)
+    spectra = np.fft.rfft2(centered)
+    cross_power = spectra[0] * np.conj(spectra)
+    cross_power /= np.maximum(np.abs(cross_power), 1e-12)
+    correlation = np.fft.irfft2(cross_power, s = previews.shape[-2:])
+    peaks = np.argmax(correlation.reshape(len(previews), -1), axis = 1)
+    shifts = np.column_stack(np.unravel_index(peaks, previews.shape[-2:]))
+    # Wrap lags past the midpoint round to negative shifts
+    shifts = np.where(shifts > np.array(previews.shape[-2:]) // 2, shifts - np.array(previews.shape[-2:]), shifts)
+    return -shifts * REGISTRATION_STRIDE
+
+def stack_series(
+    scans: list, box: tuple, channel: int = None, invert: bool = None, register: bool = False
+    ) -> tuple[np.ndarray, float]:
+        # The whole series becomes one (exposures, rows, columns) stack of the cropped window; scans that are
+        # memory mapped are only read inside the window
+        shapes = set(x.shape[:2] for x in scans)
+        if len(shapes) > 1:
+            raise ValueError(f'Exposures in a series must share one size, got {sorted(shapes)}')
+        height, width = scans[0].shape[:2]
+        if np.issubdtype(scans[0].dtype, np.integer):
+            max_value = float(np.iinfo(scans[0].dtype).max)
+        else:
+            max_value = float(max(np.nanmax(x[::tr.SAMPLE_STRIDE, ::tr.SAMPLE_STRIDE]) for x in scans))
+        if invert is None:
+            # One decision for the whole series, taken on the first exposure's full frame rather than the crop
+            preview = tr.scan_intensity(scans[0][::tr.SAMPLE_STRIDE, ::tr.SAMPLE_STRIDE], channel = channel, invert = False, max_value = max_value)
+            invert = bool(np.median(preview) > max_value / 2.0)
+        shifts = np.zeros((len(scans), 2), dtype = int)
+        if register:
+            previews = np.stack([
+                tr.scan_intensity(x[::REGISTRATION_STRIDE, ::REGISTRATION_STRIDE], channel = channel, invert = invert, max_value = max_value)
+                for x in scans
+                ])
+            shifts = registration_shifts(previews)
+        y0, x0, y1, x1 = box
+        stack = np.empty((len(scans), y1 - y0, x1 - x0))
+        for i, (scan, (dy, dx)) in enumerate(zip(scans, shifts)):
+            # Shifted windows are kept inside the frame so every exposure contributes the same pixels
+            dy = int(np.clip(dy, -y0, height - y1))
+            dx = int(np.clip(dx, -x0, width - x1))
+            stack[i] = tr.scan_intensity(scan[y0 + dy:y1 + dy, x0 + dx:x1 + dx], channel = channel, invert = invert, max_value = max_value)
+        return stack, max_value
+
+def measure_series(stack: np.ndarray, rois: np.ndarray, saturation_level: float, background_width: int = 5) -> tuple[np.ndarray, np.ndarray]:
+    # Signals and saturated-pixel counts for every exposure x ROI from two stacked summed-area tables
+    signal_table = tr.integral_image(stack)
+    signals = ds.measure_rectangles(
+        sum_rectangles = lambda y0, x0, y1, x1: tr.rectangle_sums(signal_table, y0, x0, y1, x1),
+        shape = stack.shape[-2:],
+        rois = rois,
+        background_width = background_width
+        )
+    saturation_table = tr.integral_image(stack >= saturation_level)
+    saturated_pixels = ds.measure_rectangles(
+        sum_rectangles = lambda y0, x0, y1, x1: tr.rectangle_sums(saturation_table, y0, x0, y1, x1),
+        shape = stack.shape[-2:],
+        rois = rois,
+        background_width = 0
+        )
+    return signals, saturated_pixels.astype(int)
+
+def select_exposures(
+    exposures: np.ndarray, signals: np.ndarray, saturated: np.ndarray, method: str = 'longest', reference_exposure: float = None
+    ) -> pd.DataFrame:
+        # The blot version of BCAdata's largest value under the max: per band, the longest exposure with no
+        # saturated pixels, or a zero-intercept line through the unsaturated exposures. Either way the value is
+        # put on the reference exposure's scale so that bands read from different exposures stay comparable
+        exposures = np.asarray(exposures, dtype = float)
+        if reference_exposure is None:
+            reference_exposure = exposures.max()
+        unsaturated = ~saturated
+        usable = unsaturated.any(axis = 0)
+        # Bands saturated at every exposure fall back to the shortest one and are flagged
+        candidates = np.where(unsaturated, exposures[:, np.newaxis], -np.inf)
+        chosen = np.where(usable, np.argmax(candidates, axis = 0), np.argmin(exposures))
+        band_indices = np.arange(signals.shape[1])
+        longest_values = signals[chosen, band_indices] * reference_exposure / exposures[chosen]
+        weights = np.where(usable, unsaturated, True).astype(float)
+        times = exposures[:, np.newaxis]
+        slopes = np.sum(weights * times * signals, axis = 0) / np.sum(weights * times ** 2, axis = 0)
+        residuals = np.sum(weights * (signals - slopes * times) ** 2, axis = 0)
+        weighted_means = np.sum(weights * signals, axis = 0) / np.sum(weights, axis = 0)
+        totals = np.sum(weights * (signals - weighted_means) ** 2, axis = 0)
+        r_squared = 1.0 - np.divide(residuals, totals, out = np.full(len(band_indices), np.nan), where = totals > 0)
+        return pd.DataFrame({
+            'Exposure': exposures[chosen],
+            'Unsaturated_exposures': unsaturated.sum(axis = 0),
+            'Saturated': ~usable,
+            'Slope': slopes,
+            'R_squared': r_squared,
+            'Value': longest_values if method == 'longest' else slopes * reference_exposure
+            })
+
+def quantify_series(
+    image_paths: list, rois: pd.DataFrame, exposures: list = None, method: str = 'longest', saturation_level: float = None,
+    max_saturated_pixels: int = 0, background_width: int = 5, channel: int = None, invert: bool = None,
+    register: bool = False, reference_exposure: float = None
+    ) -> pd.DataFrame:
+        if method not in SELECTION_METHODS:
+            raise ValueError(f'Unknown selection method {method}; choose from {SELECTION_METHODS}')
+        if exposures is None:
+            exposures = [exposure_seconds(x) for x in image_paths]
+        if len(exposures) != len(image_paths):
+            raise ValueError(f'{len(image_paths)} images were given with {len(exposures)} exposures')
+        roi_array = rois.loc[:, ['x', 'y', 'width', 'height']].to_numpy(dtype = int)
+        scans = [tr.load_scan(x) for x in image_paths]
+        box = crop_box(roi_array, background_width, scans[0].shape[:2], margin = 4 * REGISTRATION_STRIDE if register else 0)
+        stack, max_value = stack_series(scans, box, channel = channel, invert = invert, register = register)
+        if saturation_level is None:
+            saturation_level = SATURATION_FRACTION * max_value
+        local_rois = roi_array - np.array([box[1], box[0], 0, 0])
+        signals, saturated_pixels = measure_series(stack, local_rois, saturation_level, background_width = background_width)
+        selection = select_exposures(
+            exposures = exposures,
+            signals = signals,
+            saturated = saturated_pixels > max_saturated_pixels,
+            method = method,
+            reference_exposure = reference_exposure
+            )
+        details = rois.loc[:, ['Sample', 'Target']].reset_index(drop = True)
+        details = pd.concat([details, selection], axis = 1)
+        for exposure, exposure_signals, exposure_saturated in zip(exposures, signals, saturated_pixels):
+            details[f'Signal_{exposure:g}s'] = exposure_signals
+            details[f'Saturated_pixels_{exposure:g}s'] = exposure_saturated
+        return details
+
+def main(
+    image_paths: list, roi_path: str, output_path: str, exposures: list = None, method: str = 'longest',
+    details_path: str = None, saturation_level: float = None, max_saturated_pixels: int = 0, background_width: int = 5,
+    channel: int = None, invert: bool = None, register: bool = False, reference_exposure: float = None
+    ) -> pd.DataFrame:
+        start_time = time.perf_counter()
+        rois = ds.read_rois(roi_path)
+        details = quantify_series(
+            image_paths = image_paths,
+            rois = rois,
+            exposures = exposures,
+            method = method,
+            saturation_level = saturation_level,
+            max_saturated_pixels = max_saturated_pixels,
+            background_width = background_width,
+            channel = channel,
+            invert = invert,
+            register = register,
+            reference_exposure = reference_exposure
+            )
+        table = ds.densitometry_table(details, details.loc[:, 'Value'].to_numpy())
+        tio.write_table(table, output_path, index = True)
+        if details_path is not None:
+            tio.write_table(details, details_path)
+        print(f'Processed {len(image_paths)} exposures x {len(details)} bands in {time.perf_counter() - start_time:.2f} s')
+        print(f'{int(details.loc[:, "Saturated"].sum())} bands were saturated at every exposure')
+        print(f'Wrote {table.shape[0]} samples x {table.shape[1]} targets to {output_path}')
+        return details
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-i',
+        '--images',
+        nargs = '+',
+        required = True,
+        help = 'Exposures of one membrane, all the same size (times are read from names like _3sec or _2min)'
+        )
+
+    parser.add_argument(
+        '-e',
+        '--exposures',
+        nargs = '+',
+        default = None,
+        type = float,
+        help = 'Exposure time in seconds for each image, in the same order, for names without one (e.g. _flash)'
+        )
+
+    parser.add_argument(
+        '-r',
+        '--rois',
+        required = True,
+        help = 'ROI table from Lane_detection.py or for Densitometry.py; its Image column is ignored'
+        )
+
+    parser.add_argument(
+        '-o',
+        '--output_path',
+        required = True,
+        help = 'Output Sample x Target table for IJ_data'
+        )
+
+    parser.add_argument(
+        '-m',
+        '--method',
+        default = 'longest',
+        choices = SELECTION_METHODS,
+        help = 'Take each band from its longest unsaturated exposure, or from a linear fit across unsaturated exposures'
+        )
+
+    parser.add_argument(
+        '-d',
+        '--details_path',
+        default = None,
+        help = 'Also write the per-band signals, saturation counts and chosen exposures here'
+        )
+
+    parser.add_argument(
+        '-s',
+        '--saturation_level',
+        default = None,
+        type = float,
+        help = f'Intensity (after inversion) at which a pixel counts as saturated (defaults to {SATURATION_FRACTION} of the maximum)'
+        )
+
+    parser.add_argument(
+        '--max_saturated_pixels',
+        default = 0,
+        type = int,
+        help = 'Saturated pixels a band may contain and still be usable'
+        )
+
+    parser.add_argument(
+        '--reference_exposure',
+        default = None,
+        type = float,
+        help = 'Exposure in seconds that every band value is scaled to (defaults to the longest)'
+        )
+
+    parser.add_argument(
+        '-b',
+        '--background_width',
+        default = 5,
+        type = int,
+        help = 'Width in pixels of the ring around each ROI used for local background (0 disables subtraction)'
+        )
+
+    parser.add_argument(
+        '--register',
+        action = 'store_true',
+        help = 'Align the exposures to the first by phase correlation before measuring'
+        )
+
+    parser.add_argument(
+        '-c',
+        '--channel',
+        default = None,
+        type = int,
+        help = 'Colour channel to measure on RGB exports (defaults to the mean of all channels)'
+        )
+
+    parser.add_argument(
+        '--invert',
+        default = None,
+        action = argparse.BooleanOptionalAction,
+        help = 'Invert intensities before measuring (defaults to inverting light-background scans)'
+        )
+
+    args = parser.parse_args()
+
+    main(
+        image_paths = args.images,
+        roi_path = args.rois,
+        output_path = args.output_path,
+        exposures = args.exposures,
+        method = args.method,
+        details_path = args.details_path,
+        saturation_level = args.saturation_level,
+        max_saturated_pixels = args.max_saturated_pixels,
+        background_width = args.background_width,
+        channel = args.channel,
+        invert = args.invert,
+        register = args.register,
+        reference_exposure = args.reference_exposure
+        )
@@ -0,0 +1,428 @@
+import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy import ndimage
+from scipy.signal import find_peaks, peak_widths
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from Utilities import Table_io as tio
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import Tiled_reader as tr
+import Densitometry as ds
+
+# Fractions of the scan that bound a band's height and a lane's width; the top-hat structuring
+# elements have to be larger than either so that only the slowly varying membrane background is removed
+MAX_BAND_FRACTION = 0.1
+MAX_LANE_FRACTION = 0.125
+MIN_SPACING_FRACTION = 1 / 60
+
+
+def tophat_profile(profile: np.ndarray, size: int, smoothing: int = 3) -> np.ndarray:
+    return ndimage.uniform_filter1d(ndimage.white_tophat(profile, size = max(size, 3)), smoothing)
+
+def detect_bands(row_profile: np.ndarray, prominence_fraction: float = 0.05) -> pd.DataFrame:
+    # Bands are peaks of the background-flattened row projection, strongest first
+    flattened = tophat_profile(row_profile, size = int(len(row_profile) * MAX_BAND_FRACTION))
+    peaks, properties = find_peaks(flattened, prominence = prominence_fraction * flattened.max())
+    _, _, left, right = peak_widths(flattened, peaks, rel_height = 0.8)
+    bands = pd.DataFrame({
+        'y': peaks,
+        'y0': np.floor(left).astype(int),
+        'y1': np.ceil(right).astype(int) + 1,
+        'prominence': properties['prominences']
+        })
+    return bands.sort_values('prominence', ascending = False, kind = 'stable').reset_index(drop = True)
+
+def lane_pitch(flattened: np.ndarray, min_spacing: int) -> int:
+    # Wells are evenly spaced, so the first autocorrelation peak past the minimum spacing is the lane pitch;
+    # the FFT gives every lag at once. Peaks are clipped first, so a saturated ladder or a cut membrane edge
+    # cannot outweigh the lanes
+    clipped = np.minimum(flattened, np.percentile(flattened, 90))
+    centered = clipped - clipped.mean()
+    autocorrelation = np.fft.irfft(np.abs(np.fft.rfft(centered, 2 * len(centered))) ** 2)[:len(centered) // 2]
+    lags, _ = find_peaks(autocorrelation)
+    lags = lags[(lags >= min_spacing) & (autocorrelation[lags] > 0)]
+    return int(lags[0]) if len(lags) > 0 else min_spacing
+
+def detect_lanes(
+    column_profile: np.ndarray, n_lanes: int = None, min_spacing: int = None, prominence_fraction: float = 0.05
+    ) -> tuple[np.ndarray, int]:
+        # Peaks closer than most of a pitch are one lane split by uneven loading; with a known lane count
+        # every local maximum competes and the n most prominent win
+        if min_spacing is None:
+            min_spacing = max(int(len(column_profile) * MIN_SPACING_FRACTION), 1)
+        flattened = tophat_profile(column_profile, size = int(len(column_profile) * MAX_LANE_FRACTION))
+        pitch = lane_pitch(flattened, min_spacing)
+        peaks, properties = find_peaks(
+            flattened,
+            distance = max(int(0.7 * pitch), 1),
+            prominence = 0 if n_lanes is not None else prominence_fraction * flattened.max()
+            )
+        if n_lanes is not None:
+            if len(peaks) < n_lanes:
+                raise ValueError(f'Only {len(peaks)} lanes were found where {n_lanes} were expected')
+            peaks = peaks[np.argsort(properties['prominences'], kind = 'stable')[::-1][:n_lanes]]
+        return np.sort(peaks), pitch
+
+def band_windows(bands: pd.DataFrame) -> list:
+    # Overlapping band windows are merged, so rows shared by a band and its shoulders count once
+    windows = []
+    for y0, y1 in sorted(zip(bands.loc[:, 'y0'], bands.loc[:, 'y1'])):
+        if len(windows) > 0 and y0 <= windows[-1][1]:
+            windows[-1][1] = max(windows[-1][1], int(y1))
+        else:
+            windows.append([int(y0), int(y1)])
+    return windows
+
+def lane_band_rows(strip: np.ndarray, x0: np.ndarray, x1: np.ndarray, band_height: int) -> np.ndarray:
+    # Per-lane row projections from one cumulative sum; each lane's band is placed where a window of
+    # the band's height collects the most signal, which follows smiling or tilted lanes
+    column_sums = np.zeros((strip.shape[0], strip.shape[1] + 1))
+    np.cumsum(strip, axis = 1, out = column_sums[:, 1:])
+    lane_profiles = column_sums[:, x1] - column_sums[:, x0]
+    window_sums = ndimage.uniform_filter1d(lane_profiles, band_height, axis = 0, origin = -(band_height // 2))
+    valid_rows = max(strip.shape[0] - band_height + 1, 1)
+    return np.argmax(window_sums[:valid_rows], axis = 0)
+
+def blank_position(column_profile: np.ndarray, centers: np.ndarray, width: int) -> int:
+    # The emptiest stretch of membrane between the outer lanes stands in for a blank lane
+    window_means = ndimage.uniform_filter1d(column_profile, width, origin = -(width // 2))
+    start = max(int(centers[0] - width // 2), 0)
+    stop = max(min(int(centers[-1] + width // 2), len(column_profile) - width + 1), start + 1)
+    return start + int(np.argmin(window_means[start:stop]))
+
+def detect_image_job(job: dict) -> dict:
+    # Uncompressed scans are projected tile by tile and only the strip around the band is held whole;
+    # lanes running across the image are analysed on the transposed scan, which numpy gives as a view
+    if job['transpose']:
+        intensity = tr.scan_intensity(tr.load_scan(job['image_path']), channel = job['channel'], invert = job['invert']).T
+        row_profile = intensity.mean(axis = 1)
+        read_strip = lambda y0, y1: intensity[y0:y1]
+        read_columns = lambda y0, y1: intensity[y0:y1].sum(axis = 0)
+    elif tr.raw_page_layouts(job['image_path'])[0] is not None:
+        scan = tr.TiledScan(job['image_path'], tile_size = job['tile_size'], channel = job['channel'], invert = job['invert'])
+        row_profile = scan.row_means()
+        read_strip = scan.strip
+        read_columns = scan.column_sums
+    else:
+        intensity = tr.scan_intensity(tr.load_scan(job['image_path']), channel = job['channel'], invert = job['invert'])
+        row_profile = intensity.mean(axis = 1)
+        read_strip = lambda y0, y1: intensity[y0:y1]
+        read_columns = lambda y0, y1: intensity[y0:y1].sum(axis = 0)
+    height = len(row_profile)
+    if job['band_rows'] is not None:
+        y0, y1 = job['band_rows']
+        windows = [[y0, y1]]
+    else:
+        bands = detect_bands(row_profile)
+        if len(bands) <= job['band_index']:
+            raise ValueError(f'Only {len(bands)} bands were found in {job["image_path"]}')
+        y0, y1 = bands.loc[job['band_index'], ['y0', 'y1']]
+        # Lanes are located over every detected band, since a single band may be faint or missing in some lanes;
+        # band_index only picks the band that is measured
+        windows = band_windows(bands)
+    band_height = int(y1 - y0)
+    column_profile = sum(read_columns(a, b) for a, b in windows) / sum(b - a for a, b in windows)
+    width = len(column_profile)
+    # Ladders and membrane edges outside the loaded wells can be left out of the lane search
+    x_start, x_stop = job['columns'] if job['columns'] is not None else (0, width)
+    try:
+        centers, pitch = detect_lanes(column_profile[x_start:x_stop], n_lanes = job['n_lanes'], min_spacing = job['min_spacing'])
+    except ValueError as error:
+        if job['transpose']:
+            advice = 'drop --transpose if the lanes run down the image, or narrow the search with --columns and --band_rows'
+        else:
+            advice = 'pass --transpose if the lanes run across the image (as on films photographed sideways), or narrow the search with --columns and --band_rows'
+        raise ValueError(f'{job["image_path"]}: {error}; {advice}') from None
+    centers = centers + x_start
+    # ROIs share one width so lanes are measured on equal areas, as with ImageJ's gel rectangles
+    roi_width = max(int(job['lane_fraction'] * pitch), 1)
+    x0 = np.clip(centers - roi_width // 2, 0, width - roi_width)
+    # Lanes may drift by up to one band height either side of the shared band window
+    search_y0 = max(int(y0) - band_height, 0)
+    search_y1 = min(int(y1) + band_height, height)
+    lane_y0 = search_y0 + lane_band_rows(read_strip(search_y0, search_y1), x0, x0 + roi_width, band_height)
+    result = {
+        'image_path': job['image_path'],
+        'x': x0,
+        'y': lane_y0,
+        'width': np.full(len(centers), roi_width),
+        'height': np.full(len(centers), band_height)
+        }
+    if job['blank']:
+        result['blank'] = (blank_position(column_profile, centers, roi_width), int(np.median(lane_y0)))
+    if job['transpose']:
+        result['x'], result['y'], result['width'], result['height'] = result['y'], result['x'], result['height'], result['width']
+        if job['blank']:
+            result['blank'] = result['blank'][::-1]
+    return result
+
+def lane_roi_table(result: dict, samples: list, target: str, blank_key: str = 'Blank', reverse: bool = False) -> pd.DataFrame:
+    # Lanes are assigned to samples in loading order; the blank key, if listed, takes the blank ROI
+    lane_samples = [x for x in samples if x != blank_key]
+    lane_order = np.arange(len(result['x']))[::-1] if reverse else np.arange(len(result['x']))
+    rois = pd.DataFrame({
+        'Sample': lane_samples,
+        'Target': target,
+        'Image': result['image_path'],
+        'x': result['x'][lane_order],
+        'y': result['y'][lane_order],
+        'width': result['width'][lane_order],
+        'height': result['height'][lane_order],
+        'Lane': lane_order + 1
+        })
+    if 'blank' in result:
+        blank_x, blank_y = result['blank']
+        blank_roi = pd.DataFrame([{
+            'Sample': blank_key,
+            'Target': target,
+            'Image': result['image_path'],
+            'x': blank_x,
+            'y': blank_y,
+            'width': result['width'][0],
+            'height': result['height'][0],
+            'Lane': 0
+            }])
+        rois = pd.concat([rois, blank_roi], ignore_index = True)
+        # Keep the sample order the lanes were listed in, blank included
+        rois = rois.set_index('Sample').loc[samples].reset_index()
+    return rois
+
+def detect_lane_rois(
+    image_paths: list, targets: list, samples: list, blank_key: str = 'Blank', reverse: bool = False,
+    band_index: int = 0, band_rows: tuple = None, columns: tuple = None, transpose: bool = False,
+    min_spacing: int = None, lane_fraction: float = 0.8, channel: int = None, invert: bool = None,
+    processes: int = None, tile_size: int = tr.DEFAULT_TILE_SIZE
+    ) -> pd.DataFrame:
+        if len(targets) != len(image_paths):
+            raise ValueError(f'{len(image_paths)} images were given with {len(targets)} targets')
+        jobs = [{
+            'image_path': x,
+            'n_lanes': len([y for y in samples if y != blank_key]),
+            'blank': blank_key in samples,
+            'band_index': band_index,
+            'band_rows': band_rows,
+            'columns': columns,
+            'transpose': transpose,
+            'min_spacing': min_spacing,
+            'lane_fraction': lane_fraction,
+            'tile_size': tile_size,
+            'channel': channel,
+            'invert': invert
+            } for x in image_paths]
+        if processes == 1 or len(jobs) == 1:
+            results = [detect_image_job(x) for x in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers = processes) as executor:
+                results = list(executor.map(detect_image_job, jobs))
+        return pd.concat(
+            [lane_roi_table(x, samples, y, blank_key = blank_key, reverse = reverse) for x, y in zip(results, targets)],
+            ignore_index = True
+            )
+
+def main(
+    image_paths: list, sample_path: str, roi_path: str, targets: list = None, densitometry_path: str = None,
+    blank_key: str = 'Blank', reverse: bool = False, band_index: int = 0, band_rows: tuple = None,
+    columns: tuple = None, transpose: bool = False, min_spacing: int = None, lane_fraction: float = 0.8,
+    background_width: int = 5, channel: int = None, invert: bool = None, processes: int = None, tile_size: int = tr.DEFAULT_TILE_SIZE
+    ) -> pd.DataFrame:
+        samples = list(tio.read_table(sample_path).loc[:, 'Sample'].astype(str))
+        if targets is None:
+            targets = [os.path.splitext(os.path.basename(x))[0] for x in image_paths]
+        rois = detect_lane_rois(
+            image_paths = [os.path.abspath(x) for x in image_paths],
+            targets = targets,
+            samples = samples,
+            blank_key = blank_key,
+            reverse = reverse,
+            band_index = band_index,
+            band_rows = band_rows,
+            columns = columns,
+            transpose = transpose,
+            min_spacing = min_spacing,
+            lane_fraction = lane_fraction,
+            channel = channel,
+            invert = invert,
+            processes = processes,
+            tile_size = tile_size
+            )
+        # Image paths are written relative to the ROI table, which is how Densitometry resolves them
+        roi_table = rois.assign(Image = [os.path.relpath(x, os.path.dirname(os.path.abspath(roi_path))) for x in rois.loc[:, 'Image']])
+        tio.write_table(roi_table, roi_path)
+        print(f'Detected {rois.shape[0]} lane ROIs across {len(image_paths)} images into {roi_path}')
+        if densitometry_path is not None:
+            table = ds.quantify_rois(
+                rois = rois,
+                background_width = background_width,
+                channel = channel,
+                invert = invert,
+                processes = processes,
+                tile_size = tile_size
+                )
+            tio.write_table(table, densitometry_path, index = True)
+            print(f'Measured {table.shape[0]} samples x {table.shape[1]} targets into {densitometry_path}')
+        return rois
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-i',
+        '--images',
+        nargs = '+',
+        required = True,
+        help = 'Raw TIFF/JPG exposures to segment, one membrane probe per image'
+        )
+
+    parser.add_argument(
+        '-t',
+        '--targets',
+        nargs = '+',
+        default = None,
+        help = 'Target name for each image, in the same order (defaults to the image file names)'
+        )
+
+    parser.add_argument(
+        '-s',
+        '--samples',
+        required = True,
+        help = 'Table with a Sample column listing the lanes in loading order, such as an existing ImageJ_data.csv'
+        )
+
+    parser.add_argument(
+        '-o',
+        '--roi_path',
+        required = True,
+        help = f'Output ROI table with columns {", ".join(ds.ROI_COLUMNS)} and the detected Lane'
+        )
+
+    parser.add_argument(
+        '-d',
+        '--densitometry_path',
+        default = None,
+        help = 'Also measure the detected ROIs and write the IJ_data-shaped table here'
+        )
+
+    parser.add_argument(
+        '-k',
+        '--blank_key',
+        default = 'Blank',
+        help = 'Sample name measured on empty membrane instead of a detected lane'
+        )
+
+    parser.add_argument(
+        '--reverse',
+        action = 'store_true',
+        help = 'Samples were loaded right to left'
+        )
+
+    parser.add_argument(
+        '-n',
+        '--band_index',
+        default = 0,
+        type = int,
+        help = 'Which detected band to measure, counted from the most prominent (lanes are located over all of them)'
+        )
+
+    parser.add_argument(
+        '--band_rows',
+        nargs = 2,
+        default = None,
+        type = int,
+        help = 'First and last row of the band window, overriding band detection; lanes are then located over these rows'
+        )
+
+    parser.add_argument(
+        '--columns',
+        nargs = 2,
+        default = None,
+        type = int,
+        help = 'First and last column searched for lanes, to leave out ladders and membrane edges'
+        )
+
+    parser.add_argument(
+        '--transpose',
+        action = 'store_true',
+        help = 'Lanes run across the image rather than down it, as on films photographed sideways'
+        )
+
+    parser.add_argument(
+        '--min_spacing',
+        default = None,
+        type = int,
+        help = 'Smallest lane pitch in pixels considered (defaults to 1/60 of the scan width)'
+        )
+
+    parser.add_argument(
+        '--lane_fraction',
+        default = 0.8,
+        type = float,
+        help = 'ROI width as a fraction of the lane pitch'
+        )
+
+    parser.add_argument(
+        '-b',
+        '--background_width',
+        default = 5,
+        type = int,
+        help = 'Width in pixels of the ring around each ROI used for local background with --densitometry_path'
+        )
+
+    parser.add_argument(
+        '--tile_size',
+        default = tr.DEFAULT_TILE_SIZE,
+        type = int,
+        help = 'Edge length in pixels of the tiles uncompressed scans are streamed in'
+        )
+
+    parser.add_argument(
+        '-c',
+        '--channel',
+        default = None,
+        type = int,
+        help = 'Colour channel to analyse on RGB exports (defaults to the mean of all channels)'
+        )
+
+    parser.add_argument(
+        '--invert',
+        default = None,
+        action = argparse.BooleanOptionalAction,
+        help = 'Invert intensities before analysis (defaults to inverting light-background scans)'
+        )
+
+    parser.add_argument(
+        '-p',
+        '--processes',
+        default = None,
+        type = int,
+        help = 'Number of worker processes (defaults to all cores)'
+        )
+
+    args = parser.parse_args()
+
+    main(
+        image_paths = args.images,
+        sample_path = args.samples,
+        roi_path = args.roi_path,
+        targets = args.targets,
+        densitometry_path = args.densitometry_path,
+        blank_key = args.blank_key,
+        reverse = args.reverse,
+        band_index = args.band_index,
+        band_rows = args.band_rows,
+        columns = args.columns,
+        transpose = args.transpose,
+        min_spacing = args.min_spacing,
+        lane_fraction = args.lane_fraction,
+        background_width = args.background_width,
+        channel = args.channel,
+        invert = args.invert,
+        processes = args.processes,
+        tile_size = args.tile_size
+        )
@@ -0,0 +1,227 @@
+from contextlib import contextmanager
+import numpy as np
+from PIL import Image
+
+# PIL raw modes that can be mapped straight from disk, as (dtype, bands)
+RAW_MODES = {
+    'L': ('u1', 1),
+    'RGB': ('u1', 3),
+    'RGBA': ('u1', 4),
+    'I;16': ('<u2', 1),
+    'I;16B': ('>u2', 1),
+    'F;32F': ('<f4', 1)
+    }
+
+DEFAULT_TILE_SIZE = 2048
+SAMPLE_STRIDE = 64
+
+
+@contextmanager
+def open_scan(filepath: str):
+    # Scans are local instrument exports and PIL's decompression-bomb guard would refuse gigapixel headers,
+    # so it is lifted only while a scan is open and restored for every other image the process reads
+    max_image_pixels = Image.MAX_IMAGE_PIXELS
+    Image.MAX_IMAGE_PIXELS = None
+    try:
+        with Image.open(filepath) as image:
+            yield image
+    finally:
+        Image.MAX_IMAGE_PIXELS = max_image_pixels
+
+def raw_page_layouts(filepath: str) -> list:
+    # Where each page's pixels sit on disk, or None for pages that have to be decoded
+    layouts = []
+    with open_scan(filepath) as image:
+        for page in range(getattr(image, 'n_frames', 1)):
+            image.seek(page)
+            tiles = image.tile
+            layout = None
+            if len(tiles) == 1 and tiles[0][0] == 'raw' and tiles[0][1] == (0, 0) + image.size:
+                raw_mode = tiles[0][3][0] if isinstance(tiles[0][3], tuple) else tiles[0][3]
+                if raw_mode in RAW_MODES:
+                    dtype, bands = RAW_MODES[raw_mode]
+                    layout = {'dtype': np.dtype(dtype), 'bands': bands, 'height': image.size[1], 'width': image.size[0], 'offset': tiles[0][2]}
+            layouts.append(layout)
+    return layouts
+
+def page_shape(layout: dict, height: int = None) -> tuple:
+    height = layout['height'] if height is None else height
+    if layout['bands'] == 1:
+        return (height, layout['width'])
+    return (height, layout['width'], layout['bands'])
+
+def load_scan(filepath: str, memory_map: bool = True, page: int = 0) -> np.ndarray:
+    # Uncompressed single-strip TIFFs are mapped in place; anything else (JPG, compressed TIFF) is decoded
+    if memory_map:
+        layout = raw_page_layouts(filepath)[page]
+        if layout is not None:
+            return np.memmap(filepath, dtype = layout['dtype'], mode = 'r', offset = layout['offset'], shape = page_shape(layout))
+    with open_scan(filepath) as image:
+        image.seek(page)
+        return np.asarray(image)
+
+def scan_intensity(scan: np.ndarray, channel: int = None, invert: bool = None, max_value: float = None) -> np.ndarray:
+    # Multi-band exports are averaged unless one channel is asked for; light-background scans are inverted
+    # so that bands integrate to positive signal, as with ImageJ's inverted gel measurements
+    if scan.ndim == 3:
+        scan = scan[..., :3]
+        intensity = scan[..., channel].astype(float) if channel is not None else scan.mean(axis = -1, dtype = float)
+    else:
+        intensity = scan.astype(float)
+    if max_value is None:
+        max_value = float(np.iinfo(scan.dtype).max) if np.issubdtype(scan.dtype, np.integer) else float(np.nanmax(intensity))
+    if invert is None:
+        invert = np.median(intensity[::8, ::8]) > max_value / 2.0
+    if invert:
+        intensity = max_value - intensity
+    return intensity
+
+def integral_image(intensity: np.ndarray) -> np.ndarray:
+    # Zero-padded summed-area table over the last two axes: any rectangle sum is four lookups, and a
+    # stack of images gets one table per image
+    table = np.zeros(intensity.shape[:-2] + (intensity.shape[-2] + 1, intensity.shape[-1] + 1))
+    np.cumsum(np.cumsum(intensity, axis = -2), axis = -1, out = table[..., 1:, 1:])
+    return table
+
+def rectangle_sums(table: np.ndarray, y0: np.ndarray, x0: np.ndarray, y1: np.ndarray, x1: np.ndarray) -> np.ndarray:
+    return table[..., y1, x1] - table[..., y0, x1] - table[..., y1, x0] + table[..., y0, x0]
+
+def integral_rows(intensity: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    # Only the summed-area rows that rectangle corners land on: one reduceat pass sums the strips between
+    # consecutive corner rows, and only those few rows are cumulated across columns
+    height = intensity.shape[0]
+    edges = np.unique(np.concatenate([[0], rows]))
+    starts = edges[edges < height]
+    strip_sums = np.add.reduceat(intensity, starts, axis = 0)
+    column_sums = np.zeros((len(starts) + 1, intensity.shape[1]))
+    np.cumsum(strip_sums, axis = 0, out = column_sums[1:])
+    positions = np.append(starts, height)
+    table_rows = np.zeros((len(rows), intensity.shape[1] + 1))
+    np.cumsum(column_sums[np.searchsorted(positions, rows)], axis = 1, out = table_rows[:, 1:])
+    return table_rows
+
+def subtract_tile_backgrounds(intensity: np.ndarray, tile_size: int = DEFAULT_TILE_SIZE, percentile: float = 10.0) -> np.ndarray:
+    # In-memory counterpart of TiledScan's per-tile background, for scans that had to be decoded
+    corrected = np.array(intensity, dtype = float)
+    for y0 in range(0, corrected.shape[0], tile_size):
+        for x0 in range(0, corrected.shape[1], tile_size):
+            tile = corrected[y0:y0 + tile_size, x0:x0 + tile_size]
+            tile -= np.percentile(tile, percentile)
+    return corrected
+
+class TiledScan:
+
+    def __init__(
+        self,
+        filepath: str,
+        page: int = 0,
+        tile_size: int = DEFAULT_TILE_SIZE,
+        channel: int = None,
+        invert: bool = None
+        ):
+            self.filepath = filepath
+            self.layout = raw_page_layouts(filepath)[page]
+            if self.layout is None:
+                raise ValueError(f'Page {page} of {filepath} is not stored uncompressed and cannot be read tile by tile')
+            self.height = self.layout['height']
+            self.width = self.layout['width']
+            self.tile_size = tile_size
+            self.channel = channel
+            self.row_bytes = self.width * self.layout['bands'] * self.layout['dtype'].itemsize
+            if np.issubdtype(self.layout['dtype'], np.integer):
+                self.max_value = float(np.iinfo(self.layout['dtype']).max)
+            else:
+                self.max_value = float(np.nanmax(self.sample_pixels()))
+            if invert is None:
+                invert = np.median(self.sample_pixels()) > self.max_value / 2.0
+            self.invert = bool(invert)
+
+    @property
+    def shape(self) -> tuple:
+        return (self.height, self.width)
+
+    def row_band(self, y0: int, y1: int) -> np.memmap:
+        # Only rows y0:y1 are mapped, so pages from finished bands are released with the view
+        return np.memmap(
+            self.filepath,
+            dtype = self.layout['dtype'],
+            mode = 'r',
+            offset = self.layout['offset'] + y0 * self.row_bytes,
+            shape = page_shape(self.layout, height = y1 - y0)
+            )
+
+    def sample_pixels(self, stride: int = SAMPLE_STRIDE) -> np.ndarray:
+        samples = []
+        for y0 in range(0, self.height, self.tile_size):
+            band = self.row_band(y0, min(y0 + self.tile_size, self.height))
+            band_samples = band[(-y0) % stride::stride, ::stride]
+            samples.append(band_samples.mean(axis = -1) if band_samples.ndim == 3 else np.asarray(band_samples, dtype = float))
+            del band
+        return np.concatenate([x.ravel() for x in samples])
+
+    def tile_grid(self) -> tuple[np.ndarray, np.ndarray]:
+        return np.arange(0, self.height, self.tile_size), np.arange(0, self.width, self.tile_size)
+
+    def tiles(self):
+        # Lazily yields (y0, x0, intensity) one tile at a time; at most one band of rows is mapped at once
+        row_starts, col_starts = self.tile_grid()
+        for y0 in row_starts:
+            y1 = min(y0 + self.tile_size, self.height)
+            band = self.row_band(y0, y1)
+            for x0 in col_starts:
+                x1 = min(x0 + self.tile_size, self.width)
+                yield y0, x0, scan_intensity(band[:, x0:x1], channel = self.channel, invert = self.invert, max_value = self.max_value)
+            del band
+
+    def strip(self, y0: int, y1: int) -> np.ndarray:
+        # Intensity of full-width rows y0:y1, for the narrow windows that are analysed whole
+        return scan_intensity(self.row_band(y0, y1), channel = self.channel, invert = self.invert, max_value = self.max_value)
+
+    def row_means(self) -> np.ndarray:
+        sums = np.zeros(self.height)
+        for y0, x0, intensity in self.tiles():
+            sums[y0:y0 + intensity.shape[0]] += intensity.sum(axis = 1)
+        return sums / self.width
+
+    def column_sums(self, y0: int = 0, y1: int = None) -> np.ndarray:
+        # Column projection of rows y0:y1, streamed band by band
+        y1 = self.height if y1 is None else y1
+        sums = np.zeros(self.width)
+        for band_y0 in range(y0, y1, self.tile_size):
+            sums += self.strip(band_y0, min(band_y0 + self.tile_size, y1)).sum(axis = 0)
+        return sums
+
+    def tile_backgrounds(self, percentile: float = 10.0) -> np.ndarray:
+        row_starts, col_starts = self.tile_grid()
+        backgrounds = np.zeros((len(row_starts), len(col_starts)))
+        for y0, x0, intensity in self.tiles():
+            backgrounds[y0 // self.tile_size, x0 // self.tile_size] = np.percentile(intensity, percentile)
+        return backgrounds
+
+    def rectangle_sums(
+        self, y0: np.ndarray, x0: np.ndarray, y1: np.ndarray, x1: np.ndarray, background_percentile: float = None
+        ) -> np.ndarray:
+            # Each rectangle's sum is accumulated from its overlap with every tile it touches; with a
+            # background percentile, each tile's own background level is removed from its share first
+            y0, x0, y1, x1 = [np.asarray(x, dtype = int) for x in [y0, x0, y1, x1]]
+            sums = np.zeros(len(y0))
+            for tile_y0, tile_x0, intensity in self.tiles():
+                tile_height, tile_width = intensity.shape
+                overlap_y0 = np.clip(y0 - tile_y0, 0, tile_height)
+                overlap_x0 = np.clip(x0 - tile_x0, 0, tile_width)
+                overlap_y1 = np.clip(y1 - tile_y0, 0, tile_height)
+                overlap_x1 = np.clip(x1 - tile_x0, 0, tile_width)
+                touching = np.flatnonzero((overlap_y1 > overlap_y0) & (overlap_x1 > overlap_x0))
+                if len(touching) == 0:
+                    continue
+                rows, row_indices = np.unique(np.concatenate([overlap_y0[touching], overlap_y1[touching]]), return_inverse = True)
+                table_rows = integral_rows(intensity, rows)
+                top_rows, bottom_rows = row_indices[:len(touching)], row_indices[len(touching):]
+                sums[touching] += (
+                    table_rows[bottom_rows, overlap_x1[touching]] - table_rows[top_rows, overlap_x1[touching]]
+                    - table_rows[bottom_rows, overlap_x0[touching]] + table_rows[top_rows, overlap_x0[touching]]
+                    )
+                if background_percentile is not None:
+                    overlap_areas = (overlap_y1[touching] - overlap_y0[touching]) * (overlap_x1[touching] - overlap_x0[touching])
+                    sums[touching] -= np.percentile(intensity, background_percentile) * overlap_areas
+            return sums
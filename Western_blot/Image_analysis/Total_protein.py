@@ -0,0 +1,207 @@
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from Utilities import Table_io as tio
+from Utilities import Result_cache as rc
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import Tiled_reader as tr
+import Densitometry as ds
+
+FACTOR_COLUMNS = ['Sample', 'Total_protein', 'Factor']
+
+
+def check_factors(samples: list, values: np.ndarray, label: str, advice: str):
+    # Dividing by a zero, negative or missing lane total flips or blows up relative expression, so it is refused
+    values = np.asarray(values, dtype = float)
+    bad = ~np.isfinite(values) | (values <= 0)
+    if bad.any():
+        raise ValueError(
+            f'{label} must be positive for every lane, but not for {list(np.asarray(samples, dtype = object)[bad])}; {advice}'
+            )
+
+def column_profile(
+    image_path: str, rows: tuple = None, channel: int = None, invert: bool = None, tile_size: int = tr.DEFAULT_TILE_SIZE
+    ) -> np.ndarray:
+        # Summed over the lanes' rows in one pass; uncompressed scans are streamed band by band
+        if tr.raw_page_layouts(image_path)[0] is not None:
+            scan = tr.TiledScan(image_path, tile_size = tile_size, channel = channel, invert = invert)
+            y0, y1 = rows if rows is not None else (0, scan.height)
+            return scan.column_sums(y0, y1)
+        intensity = tr.scan_intensity(tr.load_scan(image_path), channel = channel, invert = invert)
+        y0, y1 = rows if rows is not None else (0, intensity.shape[0])
+        return intensity[y0:y1].sum(axis = 0)
+
+def integrate_lanes(profile: np.ndarray, x0: np.ndarray, x1: np.ndarray) -> np.ndarray:
+    # Lane totals from one cumulative sum, less a baseline drawn between the faintest columns of the gaps on
+    # either side, which removes membrane background without borrowing signal from neighbouring lanes
+    order = np.argsort(x0, kind = 'stable')
+    x0, x1 = x0[order], x1[order]
+    inner_gaps = x0[1:] - x1[:-1]
+    outer_gap = int(np.median(inner_gaps)) if len(inner_gaps) > 0 else int(x1[0] - x0[0]) // 4
+    gap_starts = np.clip(np.concatenate([[x0[0] - outer_gap], x1]), 0, len(profile) - 1)
+    gap_stops = np.clip(np.concatenate([x0, [x1[-1] + outer_gap]]), gap_starts + 1, len(profile))
+    # Gaps padded to a common width so every minimum comes from one masked reduction
+    columns = gap_starts[:, np.newaxis] + np.arange(max(int(np.max(gap_stops - gap_starts)), 1))
+    gap_values = np.where(columns < gap_stops[:, np.newaxis], profile[np.minimum(columns, len(profile) - 1)], np.inf)
+    gap_minima = gap_values.min(axis = 1)
+    baseline = (gap_minima[:-1] + gap_minima[1:]) / 2.0
+    cumulative = np.concatenate([[0.0], np.cumsum(profile)])
+    totals = np.empty(len(x0))
+    totals[order] = cumulative[x1] - cumulative[x0] - baseline * (x1 - x0)
+    return totals
+
+def total_protein_factors(
+    image_path: str, rois: pd.DataFrame, rows: tuple = None, channel: int = None, invert: bool = None, tile_size: int = tr.DEFAULT_TILE_SIZE, result_cache: rc.ResultCache = None, blank_key: str = 'Blank'
+    ) -> pd.DataFrame:
+        # Factors are lane totals over their mean, so normalized values keep the scale of the raw signal
+        rois = rois.loc[rois.loc[:, 'Sample'] != blank_key]
+        x0 = rois.loc[:, 'x'].to_numpy(dtype = int)
+        x1 = x0 + rois.loc[:, 'width'].to_numpy(dtype = int)
+        if result_cache is None:
+            result_cache = rc.ResultCache(enabled = False)
+        # Keyed by the scan's content hash, this module and the reader's source, lane geometry and settings; samples
+        # are labelled from the current table, so only the lane integrals are reused
+        totals = result_cache.cached(
+            'total_protein',
+            lambda: integrate_lanes(column_profile(image_path, rows = rows, channel = channel, invert = invert, tile_size = tile_size), x0, x1),
+            input_paths = [image_path, __file__, tr.__file__],
+            parameters = {'lanes': np.column_stack([x0, x1]).tolist(), 'rows': rows, 'channel': channel, 'invert': invert}
+            )
+        check_factors(rois.loc[:, 'Sample'], totals, f'Total protein on {image_path}', 'check the lane ROIs, --rows and --invert against the scan')
+        return pd.DataFrame({
+            'Sample': list(rois.loc[:, 'Sample']),
+            'Total_protein': totals,
+            'Factor': totals / np.mean(totals)
+            })
+
+def read_factors(factor_path: str) -> pd.Series:
+    # Per-sample normalizers as IJ_data.normalize takes them, checked again in case the table was edited or
+    # written before totals were validated
+    factors = tio.read_table(factor_path, index_col = 0).loc[:, 'Factor']
+    check_factors(factors.index, factors.to_numpy(), f'Factors in {factor_path}', 'rerun Total_protein.py on the SYPRO scan')
+    return factors
+
+def main(
+    roi_path: str, output_path: str = None, image_path: str = None, rows: tuple = None, channel: int = None, invert: bool = None, tile_size: int = tr.DEFAULT_TILE_SIZE, cache_dir: str = None,
+    use_cache: bool = True, blank_key: str = 'Blank'
+    ) -> pd.DataFrame:
+        rois = ds.read_rois(roi_path)
+        if image_path is None:
+            image_paths = list(pd.unique(rois.loc[:, 'Image']))
+            if len(image_paths) > 1:
+                raise ValueError(f'{roi_path} has lanes on {len(image_paths)} images; pass the SYPRO scan with --image')
+            image_path = image_paths[0]
+        else:
+            # Lanes found on a probe image of the same membrane can be reused on its total-protein scan
+            rois = rois.drop_duplicates(subset = 'Sample')
+        factors = total_protein_factors(
+            image_path = image_path,
+            rois = rois,
+            rows = rows,
+            channel = channel,
+            invert = invert,
+            tile_size = tile_size,
+            result_cache = rc.ResultCache(cache_dir = cache_dir, enabled = use_cache),
+            blank_key = blank_key
+            )
+        if output_path is None:
+            output_path = os.path.splitext(roi_path)[0] + '_total_protein.csv'
+        tio.write_table(factors, output_path)
+        print(f'Wrote total-protein factors for {len(factors)} lanes to {output_path}')
+        return factors
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-r',
+        '--rois',
+        required = True,
+        help = 'Lane ROI table (from Lane_detection.py) giving each sample\'s lane columns'
+        )
+
+    parser.add_argument(
+        '-i',
+        '--image',
+        default = None,
+        help = 'SYPRO Ruby scan to integrate (defaults to the ROI table\'s image)'
+        )
+
+    parser.add_argument(
+        '-o',
+        '--output_path',
+        default = None,
+        help = f'Output table with columns {", ".join(FACTOR_COLUMNS)} (defaults to <rois>_total_protein.csv)'
+        )
+
+    parser.add_argument(
+        '--rows',
+        nargs = 2,
+        default = None,
+        type = int,
+        help = 'First and last row of the lanes (defaults to the full scan height)'
+        )
+
+    parser.add_argument(
+        '-k',
+        '--blank_key',
+        default = 'Blank',
+        help = 'Sample name left out of the factors'
+        )
+
+    parser.add_argument(
+        '--cache_dir',
+        default = None,
+        help = 'Directory for cached lane integrals keyed by image hash (defaults to the shared result cache)'
+        )
+
+    parser.add_argument(
+        '--no_cache',
+        action = 'store_true',
+        help = 'Always re-integrate the scan'
+        )
+
+    parser.add_argument(
+        '-t',
+        '--tile_size',
+        default = tr.DEFAULT_TILE_SIZE,
+        type = int,
+        help = 'Edge length in pixels of the tiles uncompressed scans are streamed in'
+        )
+
+    parser.add_argument(
+        '-c',
+        '--channel',
+        default = None,
+        type = int,
+        help = 'Colour channel to measure on RGB exports (defaults to the mean of all channels)'
+        )
+
+    parser.add_argument(
+        '--invert',
+        default = None,
+        action = argparse.BooleanOptionalAction,
+        help = 'Invert intensities before measuring (defaults to inverting light-background scans)'
+        )
+
+    args = parser.parse_args()
+
+    main(
+        roi_path = args.rois,
+        output_path = args.output_path,
+        image_path = args.image,
+        rows = args.rows,
+        channel = args.channel,
+        invert = args.invert,
+        tile_size = args.tile_size,
+        cache_dir = args.cache_dir,
+        use_cache = not args.no_cache,
+        blank_key = args.blank_key
+        )
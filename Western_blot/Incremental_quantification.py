@@ -0,0 +1,237 @@
+import os
+import io
+import sys
+import json
+import hashlib
+import argparse
+from typing import Union
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Rep0'))
+import Quantification as qf
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from Utilities import Table_io as tio
+
+STATE_VERSION = 1
+
+
+def prefix_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def read_state(state_path: str) -> dict:
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path, 'r', encoding = 'UTF-8') as state_file:
+        state = json.load(state_file)
+    if state.get('version') != STATE_VERSION:
+        return None
+    return state
+
+def write_state(state: dict, state_path: str):
+    # Renamed into place so an interrupted run leaves the previous state intact
+    temporary_path = state_path + '.tmp'
+    with open(temporary_path, 'w', encoding = 'UTF-8') as state_file:
+        json.dump(state, state_file, indent = 4)
+    os.replace(temporary_path, state_path)
+
+def parse_rows(data: bytes, columns: list = None) -> pd.DataFrame:
+    if columns is None:
+        table = pd.read_csv(io.BytesIO(data), encoding = 'utf-8-sig')
+    else:
+        table = pd.read_csv(io.BytesIO(data), header = None, names = columns, encoding = 'utf-8-sig')
+    return table.set_index(keys = [table.columns[0]])
+
+def normalized_rows(values: np.ndarray, blank: np.ndarray, norm_blank_index: int) -> np.ndarray:
+    # The vectorized zero and normalize steps of IJ_data, applied to any subset of lanes
+    zeroed = values - blank
+    return zeroed / zeroed[:, norm_blank_index, np.newaxis]
+
+def control_lanes(sample_labels: list, first_position: int, control_indecies: Union[int, list[int]], control_condition: str = None) -> list[int]:
+    # Positions within sample_labels, which start at lane first_position of the membrane
+    if control_condition is not None:
+        return [i for i, x in enumerate(sample_labels) if qf.sample_condition(x) == control_condition]
+    control_indecies = control_indecies if isinstance(control_indecies, list) else [control_indecies]
+    return [x - first_position for x in control_indecies if first_position <= x < first_position + len(sample_labels)]
+
+def full_quantification(data: bytes, parameters: dict) -> tuple[pd.DataFrame, dict]:
+    input_data = parse_rows(data)
+    blank_key = parameters['blank_key']
+    if blank_key not in input_data.index:
+        raise ValueError(f'No {blank_key} row to zero the lanes against')
+    lanes = input_data.loc[input_data.index != blank_key]
+    blank = input_data.loc[blank_key, :].to_numpy(dtype = float)
+    norm_blank_index = input_data.columns.get_loc(parameters['normalization_key'])
+    normalized = normalized_rows(lanes.to_numpy(dtype = float), blank, norm_blank_index)
+    controls = control_lanes(list(lanes.index), 0, parameters['control_indecies'], parameters['control_condition'])
+    if len(controls) == 0:
+        raise ValueError('None of the lanes are controls')
+    relative = pd.DataFrame(normalized / normalized[controls].mean(axis = 0), index = lanes.index, columns = lanes.columns)
+    state = {
+        'version': STATE_VERSION,
+        'parameters': parameters,
+        'columns': [input_data.index.name] + list(input_data.columns),
+        'offset': len(data),
+        'prefix_hash': prefix_hash(data),
+        'ends_with_newline': data.endswith(b'\n'),
+        'blank': list(blank),
+        'norm_blank_index': norm_blank_index,
+        'lane_count': len(lanes),
+        # Only control lanes are kept, so the control means can be updated without revisiting other lanes
+        'control_rows': normalized[controls].tolist()
+        }
+    return relative, state
+
+def append_quantification(tail: bytes, state: dict) -> tuple[pd.DataFrame, np.ndarray, dict]:
+    # Returns the new lanes' relative values, the factor every earlier relative value must be scaled by
+    # (None while the control means are unchanged) and the updated state
+    parameters = state['parameters']
+    new_rows = parse_rows(tail, columns = state['columns'])
+    if parameters['blank_key'] in new_rows.index:
+        raise ValueError('Appended rows include a new blank; the membrane has to be re-quantified in full')
+    normalized = normalized_rows(new_rows.to_numpy(dtype = float), np.asarray(state['blank']), state['norm_blank_index'])
+    controls = control_lanes(list(new_rows.index), state['lane_count'], parameters['control_indecies'], parameters['control_condition'])
+    previous_means = np.mean(state['control_rows'], axis = 0)
+    rescale = None
+    if len(controls) > 0:
+        state['control_rows'] = state['control_rows'] + normalized[controls].tolist()
+        control_means = np.mean(state['control_rows'], axis = 0)
+        rescale = previous_means / control_means
+    else:
+        control_means = previous_means
+    relative = pd.DataFrame(normalized / control_means, index = new_rows.index, columns = new_rows.columns)
+    state['lane_count'] += len(new_rows)
+    return relative, rescale, state
+
+def write_relative(relative: pd.DataFrame, output_path: str, append: bool = False):
+    if append and tio.table_format(output_path) == 'csv':
+        relative.to_csv(output_path, mode = 'a', header = False)
+        return
+    if append:
+        relative = pd.concat([tio.read_table(output_path, index_col = 0), relative], axis = 0)
+    tio.write_table(relative, output_path, index = True)
+
+def main(
+    filepath: str, output_path: str = None, state_path: str = None, normalization_key: Union[str, int] = 'Actin', blank_key: Union[str, int] = 'Blank',
+    control_indecies: Union[int, list[int]] = 0, control_condition: str = None, rebuild: bool = False
+    ) -> pd.DataFrame:
+        if output_path is None:
+            output_path = os.path.splitext(filepath)[0] + '_relative.csv'
+        if state_path is None:
+            state_path = os.path.splitext(output_path)[0] + '_state.json'
+        parameters = {
+            'normalization_key': normalization_key,
+            'blank_key': blank_key,
+            'control_indecies': control_indecies,
+            'control_condition': control_condition,
+            'output_path': os.path.abspath(output_path)
+            }
+        with open(filepath, 'rb') as input_file:
+            data = input_file.read()
+        state = None if rebuild else read_state(state_path)
+        # Earlier runs are only extended when the lanes they saw are byte-for-byte unchanged and the new
+        # rows start on a fresh line; anything else is re-quantified from scratch
+        incremental = (
+            state is not None
+            and state['parameters'] == parameters
+            and os.path.exists(output_path)
+            and len(data) >= state['offset']
+            and prefix_hash(data[:state['offset']]) == state['prefix_hash']
+            and (state['ends_with_newline'] or data[state['offset']:state['offset'] + 1] in [b'', b'\n', b'\r'])
+            )
+        if not incremental:
+            relative, state = full_quantification(data, parameters)
+            write_relative(relative, output_path)
+            print(f'Quantified {len(relative)} lanes into {output_path}')
+        elif len(data[state['offset']:].strip()) == 0:
+            print(f'No new lanes in {filepath}')
+            return None
+        else:
+            relative, rescale, state = append_quantification(data[state['offset']:], state)
+            if rescale is None:
+                write_relative(relative, output_path, append = True)
+            else:
+                # New control lanes move the control means, so earlier relative values are rescaled once
+                earlier_relative = tio.read_table(output_path, index_col = 0)
+                write_relative(pd.concat([earlier_relative * rescale, relative], axis = 0), output_path)
+            print(f'Quantified {len(relative)} appended lanes into {output_path}' + (' and rescaled earlier lanes to the new controls' if rescale is not None else ''))
+        state['offset'] = len(data)
+        state['prefix_hash'] = prefix_hash(data)
+        state['ends_with_newline'] = data.endswith(b'\n')
+        write_state(state, state_path)
+        return relative
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-f',
+        '--filepath',
+        default = 'Western_blot/Rep0/ImageJ_data.csv',
+        help = 'Path to the ImageJ lane table that new lanes are appended to'
+        )
+
+    parser.add_argument(
+        '-o',
+        '--output_path',
+        default = None,
+        help = 'Relative expression table kept up to date (defaults to <filepath>_relative.csv)'
+        )
+
+    parser.add_argument(
+        '-s',
+        '--state_path',
+        default = None,
+        help = 'Persisted membrane state: blank vector, control lanes and how much of the table was processed (defaults to <output>_state.json)'
+        )
+
+    parser.add_argument(
+        '-n',
+        '--normalization_key',
+        default = 'Actin',
+        help = 'The column index for the normalization values'
+        )
+
+    parser.add_argument(
+        '-b',
+        '--blank_key',
+        default = 'Blank',
+        help = 'The row index value for the blank values'
+        )
+
+    parser.add_argument(
+        '-c',
+        '--control_indecies',
+        default = [4, 5, 6, 7],
+        nargs = '+',
+        type = int,
+        help = 'Lane positions of the controls'
+        )
+
+    parser.add_argument(
+        '--control_condition',
+        default = None,
+        help = 'Condition whose samples are the controls, overriding --control_indecies; appended lanes of this condition update the control means'
+        )
+
+    parser.add_argument(
+        '--rebuild',
+        action = 'store_true',
+        help = 'Ignore the saved state and re-quantify every lane'
+        )
+
+    args = parser.parse_args()
+
+    main(
+        filepath = args.filepath,
+        output_path = args.output_path,
+        state_path = args.state_path,
+        normalization_key = args.normalization_key,
+        blank_key = args.blank_key,
+        control_indecies = args.control_indecies,
+        control_condition = args.control_condition,
+        rebuild = args.rebuild
+        )
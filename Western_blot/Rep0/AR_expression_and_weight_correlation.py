@@ -1,3 +1,5 @@
+import os
+import sys
 import re
 import argparse
 import hashlib
@@ -5,11 +7,15 @@ from datetime import date
 from typing import Union
 import numpy as np
 import pandas as pd
-from matplotlib import pyplot as plt
 from scipy.stats import pearsonr
 from scipy.stats import spearmanr
 import Quantification as qf
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from Utilities import Plot_style as ps
+from Utilities import Resampling as rs
+from Utilities import Result_cache as rc
+
 
 def obtain_series_average(
     input_data: pd.DataFrame, indexer: Union[str, int],
@@ -65,44 +71,36 @@ def main_plot(
     x_label: str = None, y_label: str = None,
     xlimits: Union[tuple[Union[float, int]], list[Union[float, int]]] = None,
     ylimits: Union[tuple[Union[float, int]], list[Union[float, int]]] = None,
-    output_stats: bool = True, **kwargs
+    output_stats: bool = True, output_path: str = None, **kwargs
     ):
         xvalues = list(input_data.loc[:, xvals_key])
         yvalues = list(input_data.loc[:, yvals_key])
-        plt.figure(figsize = (5, 4))
-        ax = plt.subplot(1, 1, 1)
-        ax.scatter(
-            x = xvalues,
-            y = yvalues,
-            **kwargs
-            )
-        ax.spines['right'].set_color('none')
-        ax.spines['top'].set_color('none')
-        ax.spines['left'].set_linewidth(1.5)
-        ax.spines['bottom'].set_linewidth(1.5)
-        ax.xaxis.set_tick_params(width = 1.5)
-        ax.yaxis.set_tick_params(width = 1.5)
-        if x_label is not None:
-            plt.xlabel(
-                xlabel = x_label,
-                fontsize = 'large',
-                fontweight = 'bold'
-                )
-        if y_label is not None:
-            plt.ylabel(
-                ylabel = y_label,
-                fontsize = 'large',
-                fontweight = 'bold'
+        with ps.figure_template(output_path = output_path, bold_ticks = False) as (fig, ax):
+            ax.scatter(
+                x = xvalues,
+                y = yvalues,
+                **kwargs
                 )
-        if xlimits is not None:
-            if len(xlimits) != 2:
-                raise ValueError(f'{xlimits} should be of length: 2')
-            plt.xlim(xlimits)
-        if ylimits is not None:
-            if len(ylimits) != 2:
-                raise ValueError(f'{ylimits} should be of length: 2')
-            plt.ylim(ylimits)
-        plt.show()
+            if x_label is not None:
+                ax.set_xlabel(
+                    xlabel = x_label,
+                    fontsize = 'large',
+                    fontweight = 'bold'
+                    )
+            if y_label is not None:
+                ax.set_ylabel(
+                    ylabel = y_label,
+                    fontsize = 'large',
+                    fontweight = 'bold'
+                    )
+            if xlimits is not None:
+                if len(xlimits) != 2:
+                    raise ValueError(f'{xlimits} should be of length: 2')
+                ax.set_xlim(xlimits)
+            if ylimits is not None:
+                if len(ylimits) != 2:
+                    raise ValueError(f'{ylimits} should be of length: 2')
+                ax.set_ylim(ylimits)
         if output_stats is True:
             pearson_test = pearsonr(
                 x = xvalues,
@@ -114,6 +112,40 @@ def main_plot(
                 )
             print(f'Pearson test result: {pearson_test}')
             print(f'Spearman test: {spearman_test}')
+            return pearson_test, spearman_test
+
+def correlation_data(
+    filepath: str, weights_data: str, normalization_key: Union[str, int] = 'Actin',
+    blank_key: Union[str, int] = 'Blank', control_indecies: Union[int, list[int]] = 0
+    ) -> pd.DataFrame:
+        input_data = pd.read_csv(
+            filepath_or_buffer = filepath,
+            sep = ','
+            )
+        input_data = input_data.set_index(keys = ['Sample'])
+        ij_object = qf.IJ_data(
+            data = input_data,
+            normalization_data = list(input_data.loc[input_data.index != blank_key, normalization_key]),
+            blank_data = list(input_data.loc[blank_key, :]),
+            norm_blank_index = input_data.columns.get_loc(normalization_key),
+            control_indecies = control_indecies
+            )
+        ij_object_relative = ij_object.main_method(blank_key = blank_key)
+        ij_object_relative = ij_object_relative.assign(Condition = [re.sub(' \(1/2\)', '', x) for x in list(ij_object_relative.index)])
+        # Collapsing down same '-E' and '-F' samples
+        ij_object_relative = sample_collapse(
+            input_data = ij_object_relative,
+            condition_key = 'Condition',
+            average_key = 'AR'
+            )
+        # Renaming 'Condition' column to 'Sample-ID'
+        ij_object_relative = ij_object_relative.rename(columns = {'Condition': 'Sample-ID'})
+        weight_and_vol = pd.read_csv(weights_data)
+        plotting_data = combine_dataframe_objects(
+            ij_object_relative,
+            weight_and_vol
+            )
+        return plotting_data
 
 
 if __name__ == '__main__':
@@ -155,51 +187,95 @@ if __name__ == '__main__':
         help = 'An int or list of integers with the control indecies'
         )
 
-    args = parser.parse_args()
+    parser.add_argument(
+        '-o',
+        '--output_path',
+        default = None,
+        help = 'Write the correlation figure here (.png, .svg or .pdf) instead of showing it'
+        )
 
-    if not (isinstance(args.control_indecies, int) or isinstance(args.control_indecies, list)):
-        raise TypeError(f'{args.control_indecies} is not type \'list\' or \'int\'')
-    if isinstance(args.control_indecies, list) and not all(isinstance(x, int) for x in args.control_indecies):
-        raise TypeError(f'{args.control_indecies} must contain integers')
-    
-    np.random.seed(1717)
+    parser.add_argument(
+        '-r',
+        '--resamples',
+        default = 0,
+        type = int,
+        help = 'Number of permutation/bootstrap resamples for the Pearson and Spearman correlations'
+        )
 
-    input_data = pd.read_csv(
-        filepath_or_buffer = args.filepath,
-        sep = ','
+    parser.add_argument(
+        '--seed',
+        default = 1717,
+        type = int,
+        help = 'Seed for the resampling engine'
         )
-    input_data = input_data.set_index(keys = ['Sample'])
-
-    ij_object = qf.IJ_data(
-        data = input_data,
-        normalization_data = list(input_data.loc[input_data.index != args.blank_key, args.normalization_key]),
-        blank_data = list(input_data.loc[args.blank_key, :]),
-        norm_blank_index = input_data.columns.get_loc(args.normalization_key),
-        control_indecies = args.control_indecies
+
+    parser.add_argument(
+        '--cache_dir',
+        default = rc.DEFAULT_CACHE_DIR,
+        help = 'Directory for cached correlation tables and resampling results, keyed by input hashes and parameters'
         )
-    
-    ij_object_relative = ij_object.main_method(blank_key = args.blank_key)
-    ij_object_relative['Condition'] = [re.sub(' \(1/2\)', '', x) for x in list(ij_object_relative.index)]
-
-    # Collapsing down same '-E' and '-F' samples
-    ij_object_relative = sample_collapse(
-        input_data = ij_object_relative,
-        condition_key = 'Condition',
-        average_key = 'AR'
+
+    parser.add_argument(
+        '--cache_size',
+        default = rc.DEFAULT_MAX_BYTES // 2 ** 20,
+        type = int,
+        help = 'Size in MB the cache is trimmed to, least recently used results first'
+        )
+
+    parser.add_argument(
+        '--no_cache',
+        action = 'store_true',
+        help = 'Recompute every result instead of reusing cached ones'
         )
 
-    # Renaming 'Condition' column to 'Sample-ID'
-    ij_object_relative = ij_object_relative.rename(columns = {'Condition': 'Sample-ID'})
+    args = parser.parse_args()
+
+    if not (isinstance(args.control_indecies, int) or isinstance(args.control_indecies, list)):
+        raise TypeError(f'{args.control_indecies} is not type \'list\' or \'int\'')
+    if isinstance(args.control_indecies, list) and not all(isinstance(x, int) for x in args.control_indecies):
+        raise TypeError(f'{args.control_indecies} must contain integers')
     
-    weight_and_vol = pd.read_csv(args.weights_data)
+    result_cache = rc.ResultCache(cache_dir = args.cache_dir, max_bytes = args.cache_size * 2 ** 20, enabled = not args.no_cache)
+    parameters = {
+        'normalization_key': args.normalization_key,
+        'blank_key': args.blank_key,
+        'control_indecies': args.control_indecies
+        }
 
-    plotting_data = combine_dataframe_objects(
-        ij_object_relative,
-        weight_and_vol
+    # Relative AR expression joined to the tumor weights is reused until an input or parameter changes
+    plotting_data = result_cache.cached(
+        'correlation_data',
+        lambda: correlation_data(
+            filepath = args.filepath,
+            weights_data = args.weights_data,
+            normalization_key = args.normalization_key,
+            blank_key = args.blank_key,
+            control_indecies = args.control_indecies
+            ),
+        input_paths = [args.filepath, args.weights_data, __file__, qf.__file__],
+        parameters = parameters
         )
 
     main_plot(
         input_data = plotting_data,
         xvals_key = 'Weight (g)',
-        yvals_key = 'AR'
+        yvals_key = 'AR',
+        output_path = args.output_path
         )
+
+    if args.resamples > 0:
+        pearson_seed, spearman_seed = np.random.SeedSequence(args.seed).spawn(2)
+        for method, method_seed in [('pearson', pearson_seed), ('spearman', spearman_seed)]:
+            resampled_test = result_cache.cached(
+                'correlation_test',
+                lambda: rs.correlation_test(
+                    x_values = plotting_data.loc[:, 'Weight (g)'],
+                    y_values = plotting_data.loc[:, 'AR'],
+                    method = method,
+                    n_resamples = args.resamples,
+                    seed = method_seed
+                    ),
+                input_paths = [args.filepath, args.weights_data, __file__, qf.__file__, rs.__file__],
+                parameters = dict(parameters, method = method, resamples = args.resamples, seed = args.seed)
+                )
+            print(f'{method.capitalize()} resampling result: {resampled_test}')
@@ -0,0 +1,126 @@
+import argparse
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import Quantification as qf
+
+
+def generate_lane_matrix(number_of_lanes: int, number_of_targets: int, seed: int = 1717) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    values = rng.uniform(20.0, 150.0, size = (number_of_lanes + 1, number_of_targets))
+    # Keeping the blank below every lane so all transformed values remain positive
+    values[-1, :] = rng.uniform(1.0, 10.0, size = number_of_targets)
+    sample_labels = [f'Lane-{i}' for i in range(number_of_lanes)] + ['Blank']
+    feature_labels = ['Actin'] + [f'Target-{i}' for i in range(1, number_of_targets)]
+    input_data = pd.DataFrame(values, index = sample_labels, columns = feature_labels)
+    input_data.index.name = 'Sample'
+    return input_data
+
+def run_pipeline(
+    input_data: pd.DataFrame, control_indecies: list[int], vectorized: bool, copy: bool = True, trace_memory: bool = False
+    ) -> tuple[pd.DataFrame, float, int]:
+        input_data = input_data.copy()
+        # In-place runs hand over a float64 array the caller owns; its allocation is not charged to the pipeline
+        data = input_data if copy else input_data.to_numpy(dtype = float, copy = True)
+        ij_object = qf.IJ_data(
+            data = data,
+            normalization_data = list(input_data.loc[input_data.index != 'Blank', 'Actin']),
+            blank_data = list(input_data.loc['Blank', :]),
+            norm_blank_index = input_data.columns.get_loc('Actin'),
+            control_indecies = control_indecies,
+            sample_labels = list(input_data.index),
+            feature_labels = list(input_data.columns),
+            vectorized = vectorized,
+            copy = copy
+            )
+        if trace_memory:
+            tracemalloc.start()
+        start_time = time.perf_counter()
+        ij_relative = ij_object.main_method(blank_key = 'Blank')
+        elapsed_time = time.perf_counter() - start_time
+        peak_bytes = 0
+        if trace_memory:
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return ij_relative, elapsed_time, peak_bytes
+
+def pipeline_peak(input_data: pd.DataFrame, control_indecies: list[int], copy: bool) -> int:
+    # Construction (where the copy is taken) and every stage are traced together
+    input_data = input_data.copy()
+    data = input_data if copy else input_data.to_numpy(dtype = float, copy = True)
+    normalization_data = list(input_data.loc[input_data.index != 'Blank', 'Actin'])
+    blank_data = list(input_data.loc['Blank', :])
+    tracemalloc.start()
+    ij_object = qf.IJ_data(
+        data = data,
+        normalization_data = normalization_data,
+        blank_data = blank_data,
+        norm_blank_index = input_data.columns.get_loc('Actin'),
+        control_indecies = control_indecies,
+        sample_labels = list(input_data.index),
+        feature_labels = list(input_data.columns),
+        vectorized = True,
+        copy = copy
+        )
+    ij_object.main_method(blank_key = 'Blank')
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak_bytes
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-l',
+        '--lanes',
+        default = 10000,
+        type = int,
+        help = 'Number of lanes in the synthetic membrane'
+        )
+
+    parser.add_argument(
+        '-t',
+        '--targets',
+        default = 50,
+        type = int,
+        help = 'Number of probed targets (including the loading control)'
+        )
+
+    args = parser.parse_args()
+
+    input_data = generate_lane_matrix(
+        number_of_lanes = args.lanes,
+        number_of_targets = args.targets
+        )
+
+    looped_output, looped_time, _ = run_pipeline(
+        input_data = input_data,
+        control_indecies = [4, 5, 6, 7],
+        vectorized = False
+        )
+    vectorized_output, vectorized_time, _ = run_pipeline(
+        input_data = input_data,
+        control_indecies = [4, 5, 6, 7],
+        vectorized = True
+        )
+    in_place_output, in_place_time, _ = run_pipeline(
+        input_data = input_data,
+        control_indecies = [4, 5, 6, 7],
+        vectorized = True,
+        copy = False
+        )
+
+    pd.testing.assert_frame_equal(looped_output, vectorized_output)
+    pd.testing.assert_frame_equal(vectorized_output, in_place_output)
+
+    matrix_bytes = input_data.to_numpy(dtype = float).nbytes
+    copy_peak = pipeline_peak(input_data, [4, 5, 6, 7], copy = True)
+    in_place_peak = pipeline_peak(input_data, [4, 5, 6, 7], copy = False)
+
+    print(f'Lanes x targets: {args.lanes} x {args.targets} ({matrix_bytes / 2 ** 20:.1f} MB lane matrix)')
+    print(f'Per-element apply: {looped_time:.4f} s')
+    print(f'Vectorized (copy): {vectorized_time:.4f} s, peak allocation {copy_peak / 2 ** 20:.1f} MB ({copy_peak / matrix_bytes:.2f}x the lane matrix)')
+    print(f'Vectorized (in place): {in_place_time:.4f} s, peak allocation {in_place_peak / 2 ** 20:.1f} MB ({in_place_peak / matrix_bytes:.2f}x the lane matrix)')
+    print(f'Speedup: {looped_time / vectorized_time:.1f}x')
@@ -1,12 +1,25 @@
+import os
+import sys
 import re
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 from typing import Union
 import numpy as np
 import pandas as pd
-from matplotlib import pyplot as plt
-from scipy import stats
-from statsmodels.stats.multicomp import pairwise_tukeyhsd
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from Utilities import Plot_style as ps
+from Utilities import Grouped_stats as gs
+from Utilities import Resampling as rs
+from Utilities import Table_io as tio
+from Utilities import Result_cache as rc
+
+sys.path.append(os.path.join(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')), 'Western_blot', 'Image_analysis'))
+import Total_protein as tp
+
+CONDITION_COLORS = ['orange', 'black', 'purple']
+REPLICATE_REGEX = '-M[0-9]-[0-9]-(E|F)'
+DILUTION_REGEX = r' \(1/2\)'
 
 def subtract_blank(sample: Union[float , int], blank: Union[float, int]) -> Union[float, int]:
     transformed_value = sample - blank
@@ -16,152 +29,175 @@ def norm_division(sample: float, normalization_factor: float) -> float:
     transformed_value = sample / normalization_factor
     return transformed_value
 
-def run_ttest(input_data, xvals_key, yvals_key, paired: bool = False):
-    unique_x_vals = list(set(list(input_data.loc[:, xvals_key])))
-    grouped_vals = [list(input_data.loc[input_data[xvals_key] == unique_value, yvals_key]) for unique_value in unique_x_vals]
-    if len(grouped_vals) != 2:
+def run_ttest(input_data, xvals_key, yvals_key, paired: bool = False, grouped_data = None):
+    if grouped_data is None:
+        grouped_data = gs.GroupedData(input_data, xvals_key, yvals_key)
+    if grouped_data.number_of_levels != 2:
         raise ValueError('Cannot perform a T-test with a categorical variable that does not have two levels')
     if paired:
-        t_test = stats.ttest_rel(
-            a = grouped_vals[0],
-            b = grouped_vals[1]
-            )
+        t_test = grouped_data.paired_ttest()
     else:
-        t_test = stats.ttest_ind(
-            a = grouped_vals[0],
-            b = grouped_vals[1],
-            equal_var = False
-            )
+        t_test = grouped_data.welch_ttest()
     return t_test
 
-def run_anova(input_data, xvals_key, yvals_key, post_hoc_test = True):
-    unique_x_vals = list(set(list(input_data.loc[:, xvals_key])))
-    grouped_vals = [list(input_data.loc[input_data[xvals_key] == unique_value, yvals_key]) for unique_value in unique_x_vals]
-    anova_result = stats.f_oneway(*grouped_vals)
+def run_anova(input_data, xvals_key, yvals_key, post_hoc_test = True, grouped_data = None):
+    if grouped_data is None:
+        grouped_data = gs.GroupedData(input_data, xvals_key, yvals_key)
+    anova_result = grouped_data.anova()
     if post_hoc_test is True:
-        tukey_result = pairwise_tukeyhsd(
-            endog = list(input_data.loc[:, yvals_key]),
-            groups = list(input_data.loc[:, xvals_key]),
-            alpha = 0.05
-            )
+        tukey_result = grouped_data.tukey_hsd(alpha = 0.05)
         return anova_result, tukey_result
     else:
         return anova_result
 
+def print_stats_output(stats_output):
+    # SciPy results are tuples themselves, so only unpack (ANOVA, Tukey) pairs
+    if hasattr(stats_output, 'pvalue'):
+        print(stats_output)
+    else:
+        for result in stats_output:
+            if isinstance(result, pd.DataFrame):
+                print('Multiple Comparison of Means - Tukey HSD, FWER=0.05')
+                print(result.to_string(index = False))
+            else:
+                print(result)
+
 def barplot_data(
     input_data, xvals_key, yvals_key, color_index = None,
     ylimits = None, xlimits = None, x_label = None, y_label = None,
-    output_stats = True, post_hoc_test = True, jitter_strength = 0.1, **kwargs
+    output_stats = True, post_hoc_test = True, jitter_strength = 0.1,
+    output_path = None, print_stats = True, rng = None, **kwargs
     ):
-    xvalues = list(input_data.loc[:, xvals_key])
-    grouped_data = input_data.groupby(xvals_key)[yvals_key]
-    unique_xvalues = np.unique(xvalues)
-    x_mapping = {val: i for i, val in enumerate(unique_xvalues)}
+    # One factorization of the condition column feeds both the figure and the stats
+    grouped_data = gs.GroupedData(input_data, xvals_key, yvals_key)
+    group_means = grouped_data.group_means()
+    group_sems = grouped_data.sems()
+    if rng is None:
+        rng = np.random.default_rng()
     # Generate random jitter for each point within each category
-    jitter = {}
-    for key in enumerate(unique_xvalues):
-        jitter[key[1]] = np.random.uniform(-jitter_strength, jitter_strength, size = len(grouped_data.get_group(key[1])))
+    jitter = [rng.uniform(-jitter_strength, jitter_strength, size = size) for size in grouped_data.sizes]
     if color_index is None:
-        colors = {key: 'black' for key in xvalues}
+        colors = ['black'] * grouped_data.number_of_levels
     else:
-        colors = {key: value for key in xvalues for value in list(input_data.loc[input_data[xvals_key] == key, color_index])}
-    plt.figure(figsize = (5, 4))
-    ax = plt.subplot(1, 1, 1)
-    for x, y in grouped_data:
-        # Scatter plot with jittered x-values
-        ax.scatter(
-            x = [x_mapping[x] + jitter[x][i] for i in range(len(y))],
-            y = y.values,
-            c = ([colors[x]] * len(y)),
-            **kwargs
-            )
-        # Calculating and plotting SEM for each group
-        sem = np.std(y) / np.sqrt(len(y))
-        ax.bar(
-            x,
-            np.mean(y),
-            color = 'none',
-            edgecolor = colors[x]
-            )
-        ax.errorbar(
-            x,
-            np.mean(y),
-            yerr = sem,
-            fmt = '_',
-            capsize = 5,
-            color = 'black',
-            label = 'SEM'
-            )
-    ax.spines['right'].set_color('none')
-    ax.spines['top'].set_color('none')
-    ax.spines['left'].set_linewidth(1.5)
-    ax.spines['bottom'].set_linewidth(1.5)
-    ax.xaxis.set_tick_params(width = 1.5)
-    ax.yaxis.set_tick_params(width = 1.5)
-    # Making ticks bold
-    for tick in ax.xaxis.get_major_ticks():
-        tick.label1.set_fontweight('bold')
-    for tick in ax.yaxis.get_major_ticks():
-        tick.label1.set_fontweight('bold')
-    if x_label is not None:
-        if not isinstance(x_label, str):
-            raise ValueError(f'{x_label} should be a string')
-        plt.xlabel(
-            xlabel = x_label,
-            fontsize = 'large',
-            fontweight = 'bold'
-            )
-    if y_label is not None:
-        if not isinstance(y_label, str):
-            raise ValueError(f'{y_label} should be a string')
-        plt.ylabel(
-            ylabel = y_label,
-            fontsize = 'large',
-            fontweight = 'bold'
-            )
-    if xlimits is not None:
-        if not isinstance(xlimits, list):
-            raise ValueError(f'{xlimits} should be a list dtype')
-        if len(xlimits) != 2:
-            raise ValueError(f'{xlimits} should be of length: 2')
-        plt.xlim(xlimits)
-    if ylimits is not None:
-        if not isinstance(ylimits, list):
-            raise ValueError(f'{ylimits} should be a list dtype')
-        if len(ylimits) != 2:
-            raise ValueError(f'{ylimits} should be of length: 2')
-        plt.ylim(ylimits)
-    plt.show()
+        color_values = input_data.loc[:, color_index].to_numpy()
+        colors = [color_values[grouped_data.group_indices(i)[-1]] for i in range(grouped_data.number_of_levels)]
+    with ps.figure_template(output_path = output_path, bold_ticks = True) as (fig, ax):
+        for i, x in enumerate(grouped_data.levels):
+            y = grouped_data.group_values(i)
+            # Scatter plot with jittered x-values
+            ax.scatter(
+                x = i + jitter[i],
+                y = y,
+                c = ([colors[i]] * len(y)),
+                **kwargs
+                )
+            # Plotting the mean and SEM for each group
+            ax.bar(
+                x,
+                group_means[i],
+                color = 'none',
+                edgecolor = colors[i]
+                )
+            ax.errorbar(
+                x,
+                group_means[i],
+                yerr = group_sems[i],
+                fmt = '_',
+                capsize = 5,
+                color = 'black',
+                label = 'SEM'
+                )
+        if x_label is not None:
+            if not isinstance(x_label, str):
+                raise ValueError(f'{x_label} should be a string')
+            ax.set_xlabel(
+                xlabel = x_label,
+                fontsize = 'large',
+                fontweight = 'bold'
+                )
+        if y_label is not None:
+            if not isinstance(y_label, str):
+                raise ValueError(f'{y_label} should be a string')
+            ax.set_ylabel(
+                ylabel = y_label,
+                fontsize = 'large',
+                fontweight = 'bold'
+                )
+        if xlimits is not None:
+            if not isinstance(xlimits, list):
+                raise ValueError(f'{xlimits} should be a list dtype')
+            if len(xlimits) != 2:
+                raise ValueError(f'{xlimits} should be of length: 2')
+            ax.set_xlim(xlimits)
+        if ylimits is not None:
+            if not isinstance(ylimits, list):
+                raise ValueError(f'{ylimits} should be a list dtype')
+            if len(ylimits) != 2:
+                raise ValueError(f'{ylimits} should be of length: 2')
+            ax.set_ylim(ylimits)
     if output_stats is True:
-        if len(set(list(input_data.loc[:, xvals_key]))) == 2: # Only two levels, perform an ind T-test with Welch's correction
+        if grouped_data.number_of_levels == 2: # Only two levels, perform an ind T-test with Welch's correction
             ttest_output = run_ttest(
                 input_data = input_data,
                 xvals_key = xvals_key,
-                yvals_key = yvals_key
+                yvals_key = yvals_key,
+                grouped_data = grouped_data
                 )
-            print(ttest_output)
+            if print_stats is True:
+                print_stats_output(ttest_output)
+            return ttest_output
         else: # Else perform an ANOVA
-            anov_output, tuckey_output = run_anova(
+            anova_output = run_anova(
                 input_data = input_data,
                 xvals_key = xvals_key,
                 yvals_key = yvals_key,
-                post_hoc_test = post_hoc_test
+                post_hoc_test = post_hoc_test,
+                grouped_data = grouped_data
                 )
-            print(anov_output)
-            print(tuckey_output)
+            if print_stats is True:
+                print_stats_output(anova_output)
+            return anova_output
+
+def render_feature_job(plot_kwargs: dict):
+    return barplot_data(print_stats = False, **plot_kwargs)
+
+def render_feature_figures(
+    input_data: pd.DataFrame, feature_labels: list, output_dir: str,
+    file_format: str = 'png', processes: int = None, seed: Union[int, np.random.SeedSequence] = 1717,
+    y_label_template: str = '{feature}', **kwargs
+    ) -> dict:
+        if file_format not in ['png', 'svg', 'pdf']:
+            raise ValueError(f'{file_format} should be one of: png, svg, pdf')
+        os.makedirs(output_dir, exist_ok = True)
+        jobs = []
+        # One independent, reproducible jitter stream per feature regardless of worker scheduling
+        generators = rs.spawn_generators(seed = seed, number_of_generators = len(feature_labels))
+        for feature, rng in zip(feature_labels, generators):
+            plot_kwargs = dict(kwargs)
+            plot_kwargs['input_data'] = input_data
+            plot_kwargs['yvals_key'] = feature
+            plot_kwargs['y_label'] = y_label_template.format(feature = feature)
+            plot_kwargs['output_path'] = os.path.join(output_dir, f'{feature}_expression_barplot.{file_format}')
+            plot_kwargs['rng'] = rng
+            jobs.append(plot_kwargs)
+        with ProcessPoolExecutor(max_workers = processes) as executor:
+            stats_outputs = list(executor.map(render_feature_job, jobs))
+        return dict(zip(feature_labels, stats_outputs))
 
 
 class IJ_data:
     
     def __init__(
         self,
-        data: pd.DataFrame,
+        data: Union[pd.DataFrame, np.ndarray],
         normalization_data: list,
         blank_data: list = None,
         norm_blank_index: int = 0,
         control_indecies: Union[int, list[int]] = None,
         sample_labels: list = None,
-        feature_labels: list = None
+        feature_labels: list = None,
+        vectorized: bool = False,
+        copy: bool = True
         ):
             self.data = data
             self.normalization_data = normalization_data
@@ -170,23 +206,68 @@ class IJ_data:
             self.control_indecies = control_indecies
             self.sample_labels = sample_labels
             self.feature_labels = feature_labels
+            self.vectorized = vectorized
+            self.copy = copy
+            if self.vectorized:
+                # Every stage works on one float64 lanes x targets buffer; copy = True takes a private copy of
+                # the input, copy = False works in place on the caller's float64 array
+                if isinstance(data, pd.DataFrame):
+                    self.sample_labels = data.index if sample_labels is None else pd.Index(sample_labels, name = data.index.name)
+                    self.feature_labels = data.columns if feature_labels is None else pd.Index(feature_labels)
+                else:
+                    self.sample_labels = pd.Index(sample_labels, name = 'Sample')
+                    self.feature_labels = pd.Index(feature_labels)
+                if copy:
+                    self.values = np.array(data, dtype = float)
+                else:
+                    self.values = np.asarray(data, dtype = float)
+                    if self.values is not data or not self.values.flags.writeable:
+                        raise ValueError('copy = False needs a writable float64 ndarray to work on in place')
+                self.normalization_data = np.array(normalization_data, dtype = float)
+                self.blank_data = None if blank_data is None else np.asarray(blank_data, dtype = float)
+                self.data = self.frame()
+            elif copy:
+                # The per-element path writes blank-subtracted values column by column, so it works on its own
+                # copy unless the caller asks for its frame to be updated in place
+                self.data = data.copy()
+
+    def frame(self) -> pd.DataFrame:
+        # A labelled view of the current buffer; nothing is copied
+        return pd.DataFrame(self.values, index = self.sample_labels, columns = self.feature_labels, copy = False)
 
     def zero(self, blank_key: Union[str, int] = 'Blank'):
+        if self.vectorized:
+            # Broadcasting the blank vector over the whole lane x target matrix
+            np.subtract(self.values, self.blank_data, out = self.values)
+            self.normalization_data = self.normalization_data - self.blank_data[self.norm_blank_index]
+            lane_rows = np.flatnonzero(self.sample_labels != blank_key)
+            # Dropping a leading or trailing blank is a slice of the same buffer; a blank mid-table is dropped by moving
+            # the later lanes up over it, so copy = False keeps working in (and returning a view of) the caller's array
+            if len(lane_rows) > 0 and lane_rows[-1] - lane_rows[0] == len(lane_rows) - 1:
+                self.values = self.values[lane_rows[0]:lane_rows[-1] + 1]
+            else:
+                self.values[:len(lane_rows)] = self.values[lane_rows]
+                self.values = self.values[:len(lane_rows)]
+            self.sample_labels = self.sample_labels[lane_rows]
+            self.data = self.frame()
+            return
         upper_range = len(np.transpose(self.data.values))
         for i in range(0, upper_range):
             self.data.iloc[:, i] = self.data.iloc[:, i].apply(
                 func = subtract_blank,
                 blank = self.blank_data[i]
                 )
-        self.normalization_data = list(pd.DataFrame({'protein': self.normalization_data}).apply(
-            func = subtract_blank,
-            axis = 1,
-            blank = self.blank_data[self.norm_blank_index]
-            )['protein'])
+        self.normalization_data = [subtract_blank(x, self.blank_data[self.norm_blank_index]) for x in self.normalization_data]
         # Remove the blank row from self.data
         self.data = self.data.loc[self.data.index != blank_key]
 
-    def normalize(self):
+    def normalize(self, normalization_data: list = None):
+        # An alternative normalizer (e.g. total-protein lane factors) replaces the housekeeping column
+        if normalization_data is not None:
+            self.normalization_data = np.array(normalization_data, dtype = float) if self.vectorized else list(normalization_data)
+        if self.vectorized:
+            np.divide(self.values, self.normalization_data[:, np.newaxis], out = self.values)
+            return
         for i in range(0, len(self.data)):
             self.data.iloc[i, :] = self.data.iloc[i, :].apply(
                 func = norm_division,
@@ -194,28 +275,88 @@ class IJ_data:
                 )
 
     def relative_expressions(self):
+        if self.vectorized:
+            if isinstance(self.control_indecies, list):
+                norm_values = np.mean(self.values[self.control_indecies, :], axis = 0)
+            else:
+                # Copied, as the control row is itself divided in place below
+                norm_values = np.array(self.values[self.control_indecies, :])
+            np.divide(self.values, norm_values, out = self.values)
+            return self.data
+        # Per-element path: self.data is updated column by column and returned
         upper_range = len(np.transpose(self.data.values))
-        relative_values = self.data
         for i in range(0, upper_range):
             if isinstance(self.control_indecies, list):
                 norm_value = np.mean(self.data.iloc[self.control_indecies, i])
             else:
                 norm_value = self.data.iloc[self.control_indecies, i]
-            relative_values.iloc[:, i] = self.data.iloc[:, i].apply(
+            self.data.iloc[:, i] = self.data.iloc[:, i].apply(
                 func = norm_division,
                 normalization_factor = norm_value
                 )
-        return relative_values
+        return self.data
     
-    def main_method(self, blank_key = 'Blank') -> pd.DataFrame:
+    def main_method(self, blank_key = 'Blank', normalization_data: list = None) -> pd.DataFrame:
         if self.control_indecies is None:
             self.control_indecies = 0
         self.zero(blank_key = blank_key)
-        self.normalize()
+        self.normalize(normalization_data = normalization_data)
         ij_relative = self.relative_expressions()
         return ij_relative
 
 
+def sample_condition(sample_label: str, replicate_regex: str = REPLICATE_REGEX, dilution_regex: str = DILUTION_REGEX) -> str:
+    return re.sub(replicate_regex, '', re.sub(dilution_regex, '', sample_label))
+
+def sample_conditions(sample_labels: pd.Index, replicate_regex: str = REPLICATE_REGEX, dilution_regex: str = DILUTION_REGEX) -> pd.Index:
+    # sample_condition over a whole index at once, for lane tables too long to loop over
+    return pd.Index(sample_labels).str.replace(dilution_regex, '', regex = True).str.replace(replicate_regex, '', regex = True)
+
+def condition_colors(conditions: list, palette: list = None) -> list:
+    # Colors follow the order conditions first appear in, so lanes no longer have to be loaded in a fixed layout
+    if palette is None:
+        palette = CONDITION_COLORS
+    levels = list(dict.fromkeys(conditions))
+    return [palette[levels.index(x) % len(palette)] for x in conditions]
+
+def control_condition_indecies(sample_labels: list, control_condition: str) -> list[int]:
+    control_indecies = [i for i, x in enumerate(sample_labels) if sample_condition(x) == control_condition]
+    if len(control_indecies) == 0:
+        raise ValueError(f'No samples belong to the control condition {control_condition}')
+    return control_indecies
+
+def quantify_membrane(
+    filepath: str,
+    normalization_key: Union[str, int] = 'Actin',
+    blank_key: Union[str, int] = 'Blank',
+    control_indecies: Union[int, list[int]] = 0,
+    vectorized: bool = False,
+    control_condition: str = None,
+    normalization_factors: pd.Series = None
+    ) -> pd.DataFrame:
+        input_data = tio.read_table(filepath)
+        input_data = input_data.set_index(keys = ['Sample'])
+        if control_condition is not None:
+            control_indecies = control_condition_indecies(list(input_data.index[input_data.index != blank_key]), control_condition)
+        ij_object = IJ_data(
+            data = input_data,
+            normalization_data = list(input_data.loc[input_data.index != blank_key, normalization_key]),
+            blank_data = list(input_data.loc[blank_key, :]),
+            norm_blank_index = input_data.columns.get_loc(normalization_key),
+            control_indecies = control_indecies,
+            vectorized = vectorized
+            )
+        if normalization_factors is not None:
+            # Factors are matched to lanes by sample name; they are already background-corrected, so they
+            # bypass the blank subtraction applied to the housekeeping column
+            sample_labels = list(input_data.index[input_data.index != blank_key])
+            missing_samples = [x for x in sample_labels if x not in normalization_factors.index]
+            if len(missing_samples) > 0:
+                raise ValueError(f'No normalization factors for samples {missing_samples}')
+            return ij_object.main_method(blank_key = blank_key, normalization_data = list(normalization_factors.loc[sample_labels]))
+        return ij_object.main_method(blank_key = blank_key)
+
+
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser()
@@ -248,6 +389,96 @@ if __name__ == '__main__':
         help = 'An int or list of integers with the control indecies'
         )
 
+    parser.add_argument(
+        '--control_condition',
+        default = None,
+        help = 'Condition whose samples are the controls, overriding --control_indecies (for lane maps in any order)'
+        )
+
+    parser.add_argument(
+        '-t',
+        '--total_protein',
+        default = None,
+        help = 'Normalize by total-protein lane factors (a table from Total_protein.py) instead of the normalization key'
+        )
+
+    parser.add_argument(
+        '-v',
+        '--vectorized',
+        action = 'store_true',
+        help = 'Use the NumPy-backed matrix operations instead of per-element apply calls'
+        )
+
+    parser.add_argument(
+        '-o',
+        '--output_dir',
+        default = None,
+        help = 'Directory to write feature figures to headlessly instead of showing them'
+        )
+
+    parser.add_argument(
+        '--format',
+        default = 'png',
+        choices = ['png', 'svg', 'pdf'],
+        help = 'File format for figures written with --output_dir'
+        )
+
+    parser.add_argument(
+        '-p',
+        '--processes',
+        default = None,
+        type = int,
+        help = 'Number of worker processes used to render figures with --output_dir'
+        )
+
+    parser.add_argument(
+        '-s',
+        '--batch_stats',
+        default = None,
+        help = 'Test every feature at once and write one corrected results table to this path (.csv, .parquet, .feather or .xlsx)'
+        )
+
+    parser.add_argument(
+        '--correction',
+        default = 'fdr_bh',
+        choices = ['fdr_bh', 'fdr_by', 'bonferroni', 'holm'],
+        help = 'Multiple-testing correction applied across features with --batch_stats and to the permutation p-values'
+        )
+
+    parser.add_argument(
+        '-r',
+        '--resamples',
+        default = 0,
+        type = int,
+        help = 'Number of permutation/bootstrap resamples per feature (exact permutations are used when they fit)'
+        )
+
+    parser.add_argument(
+        '--seed',
+        default = 1717,
+        type = int,
+        help = 'Seed for the plot jitter and the resampling engine'
+        )
+
+    parser.add_argument(
+        '--cache_dir',
+        default = rc.DEFAULT_CACHE_DIR,
+        help = 'Directory for cached relative expressions and stats tables, keyed by input hashes and parameters'
+        )
+
+    parser.add_argument(
+        '--cache_size',
+        default = rc.DEFAULT_MAX_BYTES // 2 ** 20,
+        type = int,
+        help = 'Size in MB the cache is trimmed to, least recently used results first'
+        )
+
+    parser.add_argument(
+        '--no_cache',
+        action = 'store_true',
+        help = 'Recompute every result instead of reusing cached ones'
+        )
+
     args = parser.parse_args()
 
     if not (isinstance(args.control_indecies, int) or isinstance(args.control_indecies, list)):
@@ -255,33 +486,126 @@ if __name__ == '__main__':
     if isinstance(args.control_indecies, list) and not all(isinstance(x, int) for x in args.control_indecies):
         raise TypeError(f'{args.control_indecies} must contain integers')
     
-    np.random.seed(1717)
+    normalization_factors = None
+    normalization_label = f'{args.normalization_key} Intensity'
+    if args.total_protein is not None:
+        normalization_factors = tp.read_factors(args.total_protein)
+        normalization_label = 'Total protein'
 
-    input_data = pd.read_csv(
-        filepath_or_buffer = args.filepath,
-        sep = ','
-        )
-    input_data = input_data.set_index(keys = ['Sample'])
-
-    ij_object = IJ_data(
-        data = input_data,
-        normalization_data = list(input_data.loc[input_data.index != args.blank_key, args.normalization_key]),
-        blank_data = list(input_data.loc[args.blank_key, :]),
-        norm_blank_index = input_data.columns.get_loc(args.normalization_key),
-        control_indecies = args.control_indecies
+    # Numerical results are reused while the inputs, this script and the parameters are unchanged, so
+    # iterating on figures only re-renders them
+    result_cache = rc.ResultCache(cache_dir = args.cache_dir, max_bytes = args.cache_size * 2 ** 20, enabled = not args.no_cache)
+    input_paths = [args.filepath, __file__] + ([args.total_protein] if args.total_protein is not None else [])
+    parameters = {
+        'normalization_key': args.normalization_key,
+        'blank_key': args.blank_key,
+        'control_indecies': args.control_indecies,
+        'control_condition': args.control_condition,
+        'vectorized': args.vectorized
+        }
+
+    ij_object_relative = result_cache.cached(
+        'quantify_membrane',
+        lambda: quantify_membrane(
+            filepath = args.filepath,
+            normalization_key = args.normalization_key,
+            blank_key = args.blank_key,
+            control_indecies = args.control_indecies,
+            vectorized = args.vectorized,
+            control_condition = args.control_condition,
+            normalization_factors = normalization_factors
+            ),
+        input_paths = input_paths,
+        parameters = parameters
         )
-    
-    ij_object_relative = ij_object.main_method(blank_key = args.blank_key)
-    ij_object_relative['Condition'] = [re.sub('-M[0-9]-[0-9]-(E|F)', '', re.sub(' \(1/2\)', '', x)) for x in list(ij_object_relative.index)]
-    ij_object_relative['Color'] = (['orange'] * 4) + (['black'] * 4) + (['purple'] * 6)
+    # Labels go on a new frame, leaving the numeric matrix as the pipeline returned it
+    conditions = [sample_condition(x) for x in list(ij_object_relative.index)]
+    ij_object_relative = ij_object_relative.assign(Condition = conditions, Color = condition_colors(conditions))
 
-    ij_object.feature_labels = [x for x in list(ij_object_relative.columns) if x != 'Condition' and x != 'Color' and x != args.normalization_key]
+    feature_labels = [x for x in list(ij_object_relative.columns) if x != 'Condition' and x != 'Color' and (x != args.normalization_key or args.total_protein is not None)]
 
-    for feature in ij_object.feature_labels:
-        barplot_data(
+    jitter_seed, resampling_seed = np.random.SeedSequence(args.seed).spawn(2)
+
+    stats_paths = input_paths + [gs.__file__, rs.__file__]
+
+    if args.resamples > 0:
+        resampling_parameters = dict(parameters, resamples = args.resamples, seed = args.seed)
+        permutation_results = result_cache.cached(
+            'permutation_test',
+            lambda: rs.permutation_test(
+                input_data = ij_object_relative,
+                xvals_key = 'Condition',
+                feature_labels = feature_labels,
+                n_resamples = args.resamples,
+                seed = resampling_seed,
+                processes = args.processes,
+                correction = args.correction
+                ),
+            input_paths = stats_paths,
+            parameters = dict(resampling_parameters, correction = args.correction)
+            )
+        bootstrap_results = result_cache.cached(
+            'bootstrap_means',
+            lambda: rs.bootstrap_means(
+                input_data = ij_object_relative,
+                xvals_key = 'Condition',
+                feature_labels = feature_labels,
+                n_resamples = args.resamples,
+                seed = resampling_seed,
+                processes = args.processes
+                ),
+            input_paths = stats_paths,
+            parameters = resampling_parameters
+            )
+        print(permutation_results.to_string(index = False))
+        print(bootstrap_results.to_string(index = False))
+
+    if args.batch_stats is not None:
+        batch_results = result_cache.cached(
+            'batch_tests',
+            lambda: gs.batch_tests(
+                input_data = ij_object_relative,
+                xvals_key = 'Condition',
+                feature_labels = feature_labels,
+                correction = args.correction
+                ),
+            input_paths = stats_paths,
+            parameters = dict(parameters, correction = args.correction)
+            )
+        if args.resamples > 0:
+            batch_results = batch_results.merge(
+                permutation_results.loc[:, ['Feature', 'pvalue_permutation', 'pvalue_permutation_adjusted']],
+                on = 'Feature'
+                )
+        tio.write_table(batch_results, args.batch_stats)
+        print(batch_results.to_string(index = False))
+
+    if args.output_dir is not None:
+        stats_outputs = render_feature_figures(
             input_data = ij_object_relative,
+            feature_labels = feature_labels,
+            output_dir = args.output_dir,
+            file_format = args.format,
+            processes = args.processes,
             xvals_key = 'Condition',
-            yvals_key = feature,
             color_index = 'Color',
-            y_label = f'{feature} Intesity / {args.normalization_key} Intensity'
+            output_stats = args.batch_stats is None,
+            seed = jitter_seed,
+            y_label_template = f'{{feature}} Intesity / {normalization_label}'
             )
+        if args.batch_stats is None:
+            for feature, stats_output in stats_outputs.items():
+                print(f'{feature}:')
+                print_stats_output(stats_output)
+    else:
+        rng = np.random.default_rng(jitter_seed)
+        for feature in feature_labels:
+            barplot_data(
+                input_data = ij_object_relative,
+                xvals_key = 'Condition',
+                yvals_key = feature,
+                color_index = 'Color',
+                y_label = f'{feature} Intesity / {normalization_label}',
+                output_stats = args.batch_stats is None,
+                rng = rng
+                )
@@ -43,7 +43,7 @@ if __name__ == '__main__':
     if isinstance(args.control_indecies, list) and not all(isinstance(x, int) for x in args.control_indecies):
         raise TypeError(f'{args.control_indecies} must contain integers')
     
-    np.random.seed(1717)
+    rng = np.random.default_rng(1717)
 
     input_data = pd.read_csv(
         filepath_or_buffer = args.filepath,
@@ -72,5 +72,6 @@ if __name__ == '__main__':
             yvals_key = feature,
             color_index = 'Color',
             y_label = f'{feature} Intesity / {args.normalization_key} Intensity',
-            ylimits = [0, 5]
+            ylimits = [0, 5],
+            rng = rng
             )
@@ -0,0 +1,163 @@
+import os
+import sys
+import argparse
+from typing import Union
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Rep0'))
+import Quantification as qf
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import Incremental_quantification as iq
+
+DEFAULT_CHUNK_SIZE = 100000
+
+
+def read_chunks(filepath: str, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    return pd.read_csv(filepath, index_col = 0, chunksize = chunk_size, encoding = 'utf-8-sig')
+
+def chunk_controls(lanes: pd.DataFrame, first_position: int, control_indecies: Union[int, list[int]], control_condition: str = None) -> np.ndarray:
+    if control_condition is not None:
+        return np.flatnonzero(qf.sample_conditions(lanes.index) == control_condition)
+    return np.array(iq.control_lanes(list(lanes.index), first_position, control_indecies), dtype = int)
+
+def control_pass(
+    filepath: str, normalization_key: Union[str, int] = 'Actin', blank_key: Union[str, int] = 'Blank',
+    control_indecies: Union[int, list[int]] = 0, control_condition: str = None, chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> tuple[np.ndarray, int, np.ndarray, int]:
+        # First pass: only the blank and the raw control rows are kept; they are normalized once the blank,
+        # which may sit anywhere in the table, has been seen
+        blank = None
+        control_values = []
+        lane_count = 0
+        for chunk in read_chunks(filepath, chunk_size = chunk_size):
+            blank_mask = chunk.index == blank_key
+            if blank_mask.any():
+                if blank is not None or blank_mask.sum() > 1:
+                    raise ValueError(f'{filepath} has more than one {blank_key} row')
+                blank = chunk.loc[blank_mask].to_numpy(dtype = float)[0]
+                norm_blank_index = chunk.columns.get_loc(normalization_key)
+            lanes = chunk.loc[~blank_mask]
+            control_values.append(lanes.to_numpy(dtype = float)[chunk_controls(lanes, lane_count, control_indecies, control_condition)])
+            lane_count += len(lanes)
+        if blank is None:
+            raise ValueError(f'No {blank_key} row to zero the lanes against')
+        control_values = np.concatenate(control_values, axis = 0)
+        if len(control_values) == 0:
+            raise ValueError('None of the lanes are controls')
+        control_means = iq.normalized_rows(control_values, blank, norm_blank_index).mean(axis = 0)
+        return blank, norm_blank_index, control_means, lane_count
+
+def stream_relative(
+    filepath: str, output_path: str, blank: np.ndarray, norm_blank_index: int, control_means: np.ndarray,
+    blank_key: Union[str, int] = 'Blank', chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> int:
+        # Second pass: each chunk is zeroed, normalized and scaled to the controls, then appended to the output
+        # before the next is read, so memory is bounded by the chunk size rather than the table
+        lane_count = 0
+        for i, chunk in enumerate(read_chunks(filepath, chunk_size = chunk_size)):
+            lanes = chunk.loc[chunk.index != blank_key]
+            relative = pd.DataFrame(
+                iq.normalized_rows(lanes.to_numpy(dtype = float), blank, norm_blank_index) / control_means,
+                index = lanes.index,
+                columns = lanes.columns
+                )
+            relative.to_csv(output_path, mode = 'w' if i == 0 else 'a', header = i == 0)
+            lane_count += len(lanes)
+        return lane_count
+
+def main(
+    filepath: str, output_path: str = None, normalization_key: Union[str, int] = 'Actin', blank_key: Union[str, int] = 'Blank',
+    control_indecies: Union[int, list[int]] = 0, control_condition: str = None, chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> int:
+        if output_path is None:
+            output_path = os.path.splitext(filepath)[0] + '_relative.csv'
+        if os.path.splitext(output_path)[1].lower() != '.csv':
+            raise ValueError(f'{output_path} must be a .csv file to be written chunk by chunk')
+        blank, norm_blank_index, control_means, _ = control_pass(
+            filepath = filepath,
+            normalization_key = normalization_key,
+            blank_key = blank_key,
+            control_indecies = control_indecies,
+            control_condition = control_condition,
+            chunk_size = chunk_size
+            )
+        lane_count = stream_relative(
+            filepath = filepath,
+            output_path = output_path,
+            blank = blank,
+            norm_blank_index = norm_blank_index,
+            control_means = control_means,
+            blank_key = blank_key,
+            chunk_size = chunk_size
+            )
+        print(f'Quantified {lane_count} lanes into {output_path}')
+        return lane_count
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-f',
+        '--filepath',
+        default = 'Western_blot/Rep0/ImageJ_data.csv',
+        help = 'Path to the ImageJ lane table'
+        )
+
+    parser.add_argument(
+        '-o',
+        '--output_path',
+        default = None,
+        help = 'Relative expression .csv written chunk by chunk (defaults to <filepath>_relative.csv)'
+        )
+
+    parser.add_argument(
+        '-n',
+        '--normalization_key',
+        default = 'Actin',
+        help = 'The column index for the normalization values'
+        )
+
+    parser.add_argument(
+        '-b',
+        '--blank_key',
+        default = 'Blank',
+        help = 'The row index value for the blank values'
+        )
+
+    parser.add_argument(
+        '-c',
+        '--control_indecies',
+        default = [4, 5, 6, 7],
+        nargs = '+',
+        type = int,
+        help = 'Lane positions of the controls'
+        )
+
+    parser.add_argument(
+        '--control_condition',
+        default = None,
+        help = 'Condition whose samples are the controls, overriding --control_indecies'
+        )
+
+    parser.add_argument(
+        '--chunk_size',
+        default = DEFAULT_CHUNK_SIZE,
+        type = int,
+        help = 'Number of lanes read and written at a time'
+        )
+
+    args = parser.parse_args()
+
+    main(
+        filepath = args.filepath,
+        output_path = args.output_path,
+        normalization_key = args.normalization_key,
+        blank_key = args.blank_key,
+        control_indecies = args.control_indecies,
+        control_condition = args.control_condition,
+        chunk_size = args.chunk_size
+        )